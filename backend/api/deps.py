@@ -1,4 +1,7 @@
-from fastapi import Depends
+import os
+import secrets
+
+from fastapi import Depends, Header, HTTPException
 from services.rag_service import RAGService
 from services.upload_service import UploadService
 from services.image_service import ImageService
@@ -17,3 +20,12 @@ def get_upload_service() -> UploadService:
 def get_image_service() -> ImageService:
     """获取图片服务实例"""
     return ImageService()
+
+
+def require_admin(x_admin_token: str = Header(default=None)):
+    """校验管理接口令牌（未配置 ADMIN_TOKEN 时管理接口一律不可用）"""
+    expected = os.getenv("ADMIN_TOKEN")
+    if not expected:
+        raise HTTPException(status_code=503, detail="未配置管理令牌 ADMIN_TOKEN，管理接口不可用")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, expected):
+        raise HTTPException(status_code=403, detail="管理令牌无效")
@@ -1,6 +1,6 @@
 from fastapi import APIRouter
 
-from api.v1.endpoints import rag, upload, image, chat
+from api.v1.endpoints import rag, upload, image, chat, admin
 
 api_router = APIRouter()
 
@@ -8,3 +8,4 @@ api_router.include_router(rag.router, prefix="/rag", tags=["RAG"])
 api_router.include_router(chat.router, prefix="/chat", tags=["Chat"])
 api_router.include_router(upload.router, prefix="", tags=["Upload"])
 api_router.include_router(image.router, prefix="/image", tags=["Image"])
+api_router.include_router(admin.router, prefix="/admin", tags=["Admin"])
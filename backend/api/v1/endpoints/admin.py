@@ -0,0 +1,57 @@
+from fastapi import APIRouter, Depends, HTTPException
+
+from api.deps import get_rag_service, require_admin
+from core.metrics import metrics
+from core.deployment import worker_memory_report
+from schemas.common import StandardResponse
+from services.rag_service import RAGService
+from services.retention_service import chat_retention_job
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+
+@router.post("/index/rebuild", response_model=StandardResponse)
+async def rebuild_index(rag_service: RAGService = Depends(get_rag_service)):
+    """后台构建新的索引代际，构建完成后原子切换，不中断进行中的请求"""
+    try:
+        status = rag_service.rebuild_index()
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return StandardResponse(message="索引重建已启动", data=status)
+
+
+@router.get("/index/status", response_model=StandardResponse)
+async def get_index_status(rag_service: RAGService = Depends(get_rag_service)):
+    """获取索引构建进度与当前生效的代际ID"""
+    return StandardResponse(data=rag_service.get_index_status())
+
+
+@router.get("/metrics", response_model=StandardResponse)
+async def get_metrics():
+    """导出进程内指标"""
+    return StandardResponse(data=metrics.snapshot())
+
+
+@router.get("/memory", response_model=StandardResponse)
+async def get_memory():
+    """各 worker 的独占(USS)与共享内存统计"""
+    return StandardResponse(data=worker_memory_report())
+
+
+@router.get("/chat/retention", response_model=StandardResponse)
+async def get_chat_retention():
+    """聊天记录保留策略、当前库大小与最近一次清理报告"""
+    return StandardResponse(data={
+        "policy": chat_retention_job.policy(),
+        "size": await chat_retention_job.database_size(),
+        "running": chat_retention_job.is_running,
+        "last_report": chat_retention_job.last_report
+    })
+
+
+@router.post("/chat/purge", response_model=StandardResponse)
+async def purge_chat_history():
+    """立即按保留策略清理一次并增量回收空间，返回回收的字节数"""
+    if chat_retention_job.is_running:
+        raise HTTPException(status_code=409, detail="清理任务正在运行")
+    return StandardResponse(message="清理完成", data=await chat_retention_job.run_once())
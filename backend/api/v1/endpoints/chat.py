@@ -1,19 +1,29 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List
+from typing import List, Optional
 
+from api.deps import get_rag_service
 from core.database import get_db
 from services.chat_service import ChatService
+from services.rag_service import RAGService
 from schemas.chat import SessionListResponse, ChatSessionResponse, ChatMessageResponse, HistoryResponse
 from schemas.common import StandardResponse
 
 router = APIRouter()
 
 @router.get("/sessions", response_model=StandardResponse[SessionListResponse])
-async def get_sessions(db: AsyncSession = Depends(get_db)):
-    """获取会话列表"""
+async def get_sessions(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = Query(None, description="分页游标：上一页返回的 next_cursor"),
+    with_counts: bool = Query(False, description="是否返回每个会话的消息数"),
+    db: AsyncSession = Depends(get_db)
+):
+    """获取会话列表（按更新时间倒序分页）"""
     chat_service = ChatService(db)
-    sessions = await chat_service.get_all_sessions()
+    try:
+        sessions, next_cursor = await chat_service.list_sessions(limit=limit, cursor=cursor, with_counts=with_counts)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     # 转换为响应模型
     session_responses = [
@@ -21,40 +31,53 @@ async def get_sessions(db: AsyncSession = Depends(get_db)):
             id=s.id,
             title=s.title,
             created_at=s.created_at,
-            updated_at=s.updated_at
+            updated_at=s.updated_at,
+            message_count=s.message_count if with_counts else None
         ) for s in sessions
     ]
     
     return StandardResponse(data=SessionListResponse(
         sessions=session_responses,
-        total=len(sessions)
+        total=len(sessions),
+        next_cursor=next_cursor
     ))
 
 @router.get("/sessions/{session_id}/messages", response_model=StandardResponse[HistoryResponse])
-async def get_session_messages(session_id: str, db: AsyncSession = Depends(get_db)):
-    """获取会话消息历史"""
+async def get_session_messages(
+    session_id: str,
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[int] = Query(None, description="分页游标：上一页返回的 next_cursor"),
+    db: AsyncSession = Depends(get_db),
+    rag_service: RAGService = Depends(get_rag_service)
+):
+    """获取会话消息历史（默认最新一页，用 next_cursor 向前翻页）"""
     chat_service = ChatService(db)
-    messages = await chat_service.get_history(session_id)
+    messages, next_cursor = await chat_service.get_messages_page(session_id, limit=limit, before=before)
     
     if not messages and not await chat_service.get_session(session_id):
         raise HTTPException(status_code=404, detail="Session not found")
         
-    message_responses = [
-        ChatMessageResponse(
+    message_responses = []
+    for m in messages:
+        # 文档引用按当前知识库还原为展示信息
+        documents = rag_service.message_documents(m)
+        meta_data = {**(m.meta_data or {}), "documents": documents} if documents is not None else m.meta_data
+        message_responses.append(ChatMessageResponse(
             id=m.id,
             role=m.role,
             content=m.content,
             image_url=m.image_url,
-            meta_data=m.meta_data if m.meta_data else None,
+            meta_data=meta_data if meta_data else None,
             created_at=m.created_at
-        ) for m in messages
-    ]
+        ))
     
-    return StandardResponse(data=HistoryResponse(messages=message_responses))
+    return StandardResponse(data=HistoryResponse(messages=message_responses, next_cursor=next_cursor))
 
 @router.delete("/sessions/{session_id}", response_model=StandardResponse)
 async def delete_session(session_id: str, db: AsyncSession = Depends(get_db)):
-    """删除会话 (暂未实现完全删除逻辑，仅示例)"""
-    # 实际项目中需要在 ChatService 添加 delete_session 方法
-    # 目前简单返回成功
-    return StandardResponse(message="Session deleted (mock)")
+    """删除会话及其全部消息"""
+    chat_service = ChatService(db)
+    deleted = await chat_service.delete_session(session_id)
+    if deleted is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return StandardResponse(message="Session deleted", data={"session_id": session_id, "messages_deleted": deleted})
@@ -26,7 +26,7 @@ async def recognize_food(
         识别结果
     """
     try:
-        food_name = image_service.recognize_food(image_path)
+        food_name = await image_service.recognize_food(image_path)
         return {
             "success": True,
             "food_name": food_name
@@ -1,11 +1,12 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Header
 from fastapi.responses import StreamingResponse
-import json
 from schemas.rag import QuestionRequest, SearchRequest, AnswerResponse
 from schemas.common import StandardResponse
 from services.rag_service import RAGService
 from services.chat_service import ChatService
 from core.database import get_db
+from core.deadline import DEADLINE_HEADER
+from core.sse import PROTOCOL_VERSION, SSEStreamEncoder
 from sqlalchemy.ext.asyncio import AsyncSession
 
 router = APIRouter()
@@ -32,76 +33,101 @@ async def get_statistics(rag_service: RAGService = Depends(get_rag_service)):
 async def ask_question(
     request: QuestionRequest, 
     rag_service: RAGService = Depends(get_rag_service),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    timeout_ms: str = Header(default=None, alias=DEADLINE_HEADER)
 ):
-    """提问接口"""
+    """提问接口（请求头 X-Request-Timeout-Ms 可指定本次请求的时间预算）"""
+    deadline = rag_service.create_deadline(timeout_ms)
     chat_service = ChatService(db)
     
     # 1. 获取或创建会话
     session_id = request.session_id
+    summary = None
     if not session_id:
         session = await chat_service.create_session(title=request.question[:20])
         session_id = session.id
+    else:
+        session = await chat_service.get_session(session_id)
+        summary = session.summary if session else None
     
-    # 2. 保存用户消息
-    await chat_service.add_message(
-        session_id=session_id,
-        role="user",
-        content=request.question,
-        image_url=request.image_name # 简单起见存文件名，实际应存URL
-    )
-
-    # 3. 获取历史记录
+    # 2. 获取历史记录（在保存本轮问题之前读取，只包含此前的对话）
     history_dicts = []
     if session_id:
-        history_msgs = await chat_service.get_history(session_id)
-        # 转换为字典列表，给RAG系统使用 (只取最近10条，避免token溢出)
-        for msg in history_msgs[-10:]:
+        # 只取最近几轮原文，更早的对话由会话摘要概括
+        history_msgs = await chat_service.get_recent_history(session_id, rag_service.history_window)
+        # 转换为字典列表，给RAG系统使用
+        for msg in history_msgs:
             history_dicts.append({
                 "role": msg.role,
                 "content": msg.content
             })
 
+    # 3. 保存用户消息
+    await chat_service.add_message(
+        session_id=session_id,
+        role="user",
+        content=request.question,
+        image_url=request.image_name # 简单起见存文件名，实际应存URL
+    )
+
     # 4. 执行 RAG
     # 错误由全局异常处理器捕获
-    question = rag_service.ask_with_image(request.question, request.image_name)
-    result = rag_service.ask_question(question, chat_history=history_dicts, stream=False)
+    question = await rag_service.ask_with_image(request.question, request.image_name)
+    result = await rag_service.ask_question(
+        question, chat_history=history_dicts, stream=False, deadline=deadline, summary=summary
+    )
     
-    # 5. 保存助手消息
+    # 5. 保存助手消息（文档只保存引用）
     await chat_service.add_message(
         session_id=session_id,
         role="assistant",
-        content=result.answer,
-        meta_data={"documents": [d.metadata for d in result.documents]}
+        content=result["answer"],
+        documents=result["documents"]
     )
+    rag_service.refresh_summary(session_id)
     
-    # 5. 返回结果（附带 session_id）
-    # 注意：AnswerResponse 这里可能需要扩展 session_id 字段，或者我们在前端处理
-    # 暂时我们在返回体里动态添加，或者修改 AnswerResponse Schema
-    # 假设 AnswerResponse 是 Pydantic，我们需要修改它。
-    # 让我先修改 schema 再提交这个代码。但为了原子性，我这里先把逻辑写好。
-    # 由于 AnswerResponse 定义在 schemas/rag.py，我必须确保它有 session_id 字段。
-    # 我会在下一步修改 Schema。这里先假设它有。
-    result.session_id = session_id 
-    return result
+    # 6. 返回结果（附带 session_id）
+    return AnswerResponse(
+        answer=result["answer"],
+        route_type=result.get("route_type") or "",
+        documents=result["documents"],
+        session_id=session_id,
+        degradations=result.get("degradations") or []
+    )
 
 
 @router.post("/ask_stream")
 async def ask_question_stream(
     request: QuestionRequest, 
     rag_service: RAGService = Depends(get_rag_service),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    timeout_ms: str = Header(default=None, alias=DEADLINE_HEADER)
 ):
-    """流式提问接口"""
+    """流式提问接口（请求头 X-Request-Timeout-Ms 可指定本次请求的时间预算）"""
+    deadline = rag_service.create_deadline(timeout_ms)
     chat_service = ChatService(db)
     
     # 1. 获取或创建会话
     session_id = request.session_id
+    summary = None
     if not session_id:
         session = await chat_service.create_session(title=request.question[:20])
         session_id = session.id
+    else:
+        session = await chat_service.get_session(session_id)
+        summary = session.summary if session else None
+
+    # 2. 获取历史记录（在保存本轮问题之前读取，只包含此前的对话）
+    history_dicts = []
+    if session_id:
+        history_msgs = await chat_service.get_recent_history(session_id, rag_service.history_window)
+        for msg in history_msgs:
+            history_dicts.append({
+                "role": msg.role,
+                "content": msg.content
+            })
 
-    # 2. 保存用户消息
+    # 3. 保存用户消息
     await chat_service.add_message(
         session_id=session_id,
         role="user",
@@ -109,37 +135,17 @@ async def ask_question_stream(
         image_url=request.image_name
     )
 
-    question = rag_service.ask_with_image(request.question, request.image_name)
-    
-    # 获取历史记录
-    history_dicts = []
-    if session_id:
-        history_msgs = await chat_service.get_history(session_id)
-        for msg in history_msgs[-10:]:
-            history_dicts.append({
-                "role": msg.role,
-                "content": msg.content
-            })
+    question = await rag_service.ask_with_image(request.question, request.image_name)
 
     async def generate_stream():
-        stream_generator = rag_service.ask_question(question, chat_history=history_dicts, stream=True)
-        full_answer = ""
-        documents = []
-        
-        # 发送 session_id 作为第一个事件，或者随 chunk 发送
-        # 为了前端兼容，最好在第一个 chunk 或每个 chunk 带上 session_id
-        yield f"data: {json.dumps({'session_id': session_id}, ensure_ascii=False)}\n\n"
-
-        print(f"DEBUG: stream_generator type: {type(stream_generator)}")
-        async for chunk in stream_generator:
-            if chunk.get("answer"):
-                full_answer += chunk["answer"]
-            if chunk.get("documents"):
-                documents = chunk["documents"]
-            
-            chunk['session_id'] = session_id
-            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
-        
+        stream_generator = await rag_service.ask_question(
+            question, chat_history=history_dicts, stream=True, deadline=deadline, summary=summary
+        )
+        # 版本 2 事件流：meta 只发送一次文档与会话信息，delta 合并回答片段，done 附带统计
+        encoder = SSEStreamEncoder(session_id)
+        async for frame in encoder.encode(stream_generator):
+            yield frame
+
         # 流结束，保存助手消息
         # 注意：这里需要创建一个新的 DB session，因为原来的可能已经关闭或不在此上下文
         try:
@@ -149,9 +155,10 @@ async def ask_question_stream(
                 await stream_chat_service.add_message(
                     session_id=session_id,
                     role="assistant",
-                    content=full_answer,
-                    meta_data={"documents": documents if documents else []}
+                    content=encoder.answer,
+                    documents=encoder.documents
                 )
+            rag_service.refresh_summary(session_id)
         except Exception as e:
             print(f"Failed to save stream message: {e}")
 
@@ -161,7 +168,8 @@ async def ask_question_stream(
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
-            "X-Accel-Buffering": "no"
+            "X-Accel-Buffering": "no",
+            "X-SSE-Protocol": str(PROTOCOL_VERSION)
         }
     )
 
@@ -169,7 +177,7 @@ async def ask_question_stream(
 @router.post("/search", response_model=StandardResponse)
 async def search_by_category(request: SearchRequest, rag_service: RAGService = Depends(get_rag_service)):
     """按分类搜索菜品"""
-    dishes = rag_service.search_by_category(request.category, request.query)
+    dishes = await rag_service.search_by_category(request.category, request.query)
     return StandardResponse(data={
         "category": request.category,
         "dishes": dishes
@@ -3,7 +3,7 @@ RAG系统配置文件
 """
 
 from dataclasses import dataclass
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 
 @dataclass
 class RAGConfig:
@@ -16,6 +16,8 @@ class RAGConfig:
     # 模型配置
     embedding_model: str = "BAAI/bge-small-zh-v1.5"
     llm_model: str = "Qwen/Qwen2.5-7B-Instruct"
+    # 小模型（路由、重写、闲聊等），为空时读取环境变量 LLM_MODEL_SMALL，仍为空则与 llm_model 相同
+    llm_model_small: Optional[str] = None
 
     # 检索配置
     top_k: int = 5
@@ -26,11 +28,111 @@ class RAGConfig:
         """初始化后的处理"""
         if self.rrf_weights is None:
             self.rrf_weights = {"vector": 3.0, "bm25": 0.5}
+        if self.context_token_budgets is None:
+            self.context_token_budgets = {"detail": 1800, "general": 1200}
+        if self.deadline_thresholds is None:
+            self.deadline_thresholds = {
+                "router_llm": 8.0,
+                "rewrite": 10.0,
+                "hybrid_retrieval": 4.0,
+                "full_generation": 20.0,
+                "generation_reserve": 5.0
+            }
+        if self.upstream_rate_limits is None:
+            self.upstream_rate_limits = {"default": {"rps": 10.0, "burst": 20.0}}
+        if self.model_tiers is None:
+            self.model_tiers = {
+                "small": {"model": self.llm_model_small, "model_env": "LLM_MODEL_SMALL", "timeout": 20.0},
+                "large": {"model": self.llm_model, "timeout": 60.0}
+            }
+        if self.stage_settings is None:
+            # 路由、重写与闲聊输出很短，用小模型；只有分步骤详细回答使用大模型
+            self.stage_settings = {
+                "router": {"tier": "small", "max_tokens": 8, "streaming": False, "hedge": True},
+                "rewrite": {"tier": "small", "max_tokens": 64, "streaming": False, "hedge": True},
+                "chat": {"tier": "small", "max_tokens": 512, "streaming": True},
+                "general": {"tier": "small", "max_tokens": 1024, "streaming": True},
+                "detail": {"tier": "large", "max_tokens": self.max_tokens, "streaming": True},
+                "summary": {"tier": "small", "max_tokens": 256, "streaming": False}
+            }
+
+    # 本地路由配置：规则与分类器置信度不足时才调用 LLM 路由
+    local_router_enabled: bool = True
+    router_confidence_threshold: float = 0.6
+
+    # 并发预检索配置：路由、查询重写与原始问题的推测检索同时进行，
+    # 重写结果与原问题相似度不低于阈值时直接采用推测检索结果
+    speculative_retrieval: bool = True
+    speculation_similarity: float = 0.85
+
+    # 查询重写缓存配置（无历史且无指代的问题直接跳过重写）
+    rewrite_cache_size: int = 2048
+    rewrite_cache_ttl: float = 3600.0
+
+    # 无历史的相同问题在进行中时合并为一次生成
+    coalesce_requests: bool = True
+
+    # 语义答案缓存配置：查询向量相似度不低于阈值且检索到的食谱完全相同时复用回答
+    answer_cache_enabled: bool = True
+    answer_cache_similarity: float = 0.95
+    answer_cache_size: int = 512
+    answer_cache_ttl: float = 1800.0
 
     # 生成配置
     temperature: float = 0.1
     max_tokens: int = 2048
 
+    # 模型分级配置：model_tiers 定义各分级的模型与超时，stage_settings 指定各阶段的分级、max_tokens 与是否流式
+    model_tiers: Dict[str, Dict[str, Any]] = None
+    stage_settings: Dict[str, Dict[str, Any]] = None
+
+    # 上游调度配置：并发上限、按模型的令牌桶限流（rps 每秒请求数，burst 突发容量，default 为未列出模型的默认值）
+    # 与 429/5xx/超时的重试策略（带抖动的指数退避，遵循 Retry-After）
+    upstream_max_concurrency: int = 16
+    upstream_rate_limits: Dict[str, Dict[str, float]] = None
+    upstream_max_retries: int = 3
+    upstream_backoff_base: float = 0.5
+    upstream_backoff_max: float = 8.0
+
+    # 上游端点池：多个 OpenAI 兼容端点（为空时读取环境变量 LLM_BASE_URLS，再退回 LLM_BASE_URL），
+    # 按首 token 延迟 EWMA 选择最快的健康端点，连续失败的端点摘除一段时间；
+    # stage_settings 中 hedge 为 True 的短调用在主端点超过其 p95 延迟未返回时向次优端点再发一份
+    llm_endpoints: Optional[List[str]] = None
+    endpoint_failure_threshold: int = 3
+    endpoint_cooldown_seconds: float = 30.0
+    hedge_quantile: float = 0.95
+
+    # 请求截止时间（秒，可被请求头 X-Request-Timeout-Ms 覆盖，None 表示不限时）与各阶段降级阈值：
+    # 剩余时间低于 router_llm 时只用本地路由、低于 rewrite 时跳过查询重写、低于 hybrid_retrieval 时只做 BM25 检索、
+    # 低于 full_generation 时按比例缩短回答；路由与重写调用需为生成保留 generation_reserve 秒
+    request_deadline: Optional[float] = 45.0
+    deadline_thresholds: Dict[str, float] = None
+    deadline_min_answer_tokens: int = 128
+
+    # 上下文配置：各路由的上下文 token 预算，分词器默认与 LLM 同名
+    context_token_budgets: Dict[str, int] = None
+    tokenizer_model: Optional[str] = None
+
+    # 对话历史配置：会话摘要在每轮结束后异步刷新，提示词只使用摘要与最近 history_keep_turns 轮原文，
+    # 整体不超过 history_token_budget（摘要最多占 history_summary_max_tokens）
+    conversation_summary_enabled: bool = True
+    history_keep_turns: int = 2
+    history_token_budget: int = 800
+    history_summary_max_tokens: int = 300
+
+    # 索引代际配置
+    index_generations_to_keep: int = 2
+
+    # 数据目录监听配置（也可通过环境变量 RAG_WATCH_DATA=1 开启）
+    watch_data_dir: bool = False
+    watch_poll_interval: float = 2.0
+    watch_debounce_seconds: float = 5.0
+
+    # 多进程部署配置：以mmap只读加载FAISS索引（也可通过环境变量 RAG_FAISS_MMAP=1 开启）
+    faiss_mmap: bool = False
+
+    # 独立检索服务地址，如 unix:///tmp/smartcooks-retrieval.sock（也可通过环境变量 RETRIEVAL_SERVICE 设置）
+    retrieval_service_address: Optional[str] = None
 
     
     @classmethod
@@ -45,11 +147,49 @@ class RAGConfig:
             'index_save_path': self.index_save_path,
             'embedding_model': self.embedding_model,
             'llm_model': self.llm_model,
+            'llm_model_small': self.llm_model_small,
             'top_k': self.top_k,
             'score_threshold': self.score_threshold,
             'rrf_weights': self.rrf_weights,
             'temperature': self.temperature,
-            'max_tokens': self.max_tokens
+            'max_tokens': self.max_tokens,
+            'context_token_budgets': self.context_token_budgets,
+            'tokenizer_model': self.tokenizer_model,
+            'conversation_summary_enabled': self.conversation_summary_enabled,
+            'history_keep_turns': self.history_keep_turns,
+            'history_token_budget': self.history_token_budget,
+            'history_summary_max_tokens': self.history_summary_max_tokens,
+            'model_tiers': self.model_tiers,
+            'stage_settings': self.stage_settings,
+            'upstream_max_concurrency': self.upstream_max_concurrency,
+            'upstream_rate_limits': self.upstream_rate_limits,
+            'upstream_max_retries': self.upstream_max_retries,
+            'upstream_backoff_base': self.upstream_backoff_base,
+            'upstream_backoff_max': self.upstream_backoff_max,
+            'llm_endpoints': self.llm_endpoints,
+            'endpoint_failure_threshold': self.endpoint_failure_threshold,
+            'endpoint_cooldown_seconds': self.endpoint_cooldown_seconds,
+            'hedge_quantile': self.hedge_quantile,
+            'request_deadline': self.request_deadline,
+            'deadline_thresholds': self.deadline_thresholds,
+            'deadline_min_answer_tokens': self.deadline_min_answer_tokens,
+            'index_generations_to_keep': self.index_generations_to_keep,
+            'watch_data_dir': self.watch_data_dir,
+            'watch_poll_interval': self.watch_poll_interval,
+            'watch_debounce_seconds': self.watch_debounce_seconds,
+            'faiss_mmap': self.faiss_mmap,
+            'retrieval_service_address': self.retrieval_service_address,
+            'local_router_enabled': self.local_router_enabled,
+            'router_confidence_threshold': self.router_confidence_threshold,
+            'speculative_retrieval': self.speculative_retrieval,
+            'speculation_similarity': self.speculation_similarity,
+            'rewrite_cache_size': self.rewrite_cache_size,
+            'rewrite_cache_ttl': self.rewrite_cache_ttl,
+            'coalesce_requests': self.coalesce_requests,
+            'answer_cache_enabled': self.answer_cache_enabled,
+            'answer_cache_similarity': self.answer_cache_similarity,
+            'answer_cache_size': self.answer_cache_size,
+            'answer_cache_ttl': self.answer_cache_ttl
         }
 
 # 默认配置实例
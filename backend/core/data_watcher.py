@@ -0,0 +1,170 @@
+"""
+数据目录监听 - 防抖后对变更的食谱文件做增量索引
+"""
+
+import asyncio
+import logging
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from rag_modules import DataPreparationModule, RetrievalOptimizationModule
+from core.index_generation import RetrievalSnapshot, new_generation_id
+from core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class DataDirectoryWatcher:
+    """轮询数据目录中的Markdown文件，合并一段时间内的变更后增量更新索引"""
+
+    def __init__(self, rag_system, poll_interval: float = 2.0, debounce_seconds: float = 5.0):
+        """
+        初始化数据目录监听器
+
+        Args:
+            rag_system: RecipeRAGSystem 实例
+            poll_interval: 扫描间隔（秒）
+            debounce_seconds: 最后一次变更后静默多久才触发索引（秒）
+        """
+        self.rag_system = rag_system
+        self.data_path = Path(rag_system.config.data_path)
+        self.poll_interval = poll_interval
+        self.debounce_seconds = debounce_seconds
+        self._mtimes: Dict[Path, float] = {}
+        # 待处理的变更：文件路径 -> 首次观察到变更的时间（墙钟）
+        self._pending: Dict[Path, float] = {}
+        self._last_change: float = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """启动后台监听任务，必须在事件循环中调用"""
+        if self._task is None:
+            self._mtimes = self._scan()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+            logger.info(f"开始监听数据目录: {self.data_path}")
+
+    async def stop(self):
+        """停止监听"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _scan(self) -> Dict[Path, float]:
+        """扫描数据目录，返回 文件 -> 修改时间"""
+        mtimes = {}
+        for md_file in self.data_path.rglob("*.md"):
+            try:
+                mtimes[md_file] = md_file.stat().st_mtime
+            except OSError:
+                # 扫描过程中被删除
+                continue
+        return mtimes
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                self._collect_changes(await asyncio.to_thread(self._scan))
+                quiet_for = time.monotonic() - self._last_change
+                if self._pending and quiet_for >= self.debounce_seconds:
+                    pending, self._pending = self._pending, {}
+                    try:
+                        # 持有构建锁直至新快照切换完成；全量重建期间暂缓，重建完成后再处理
+                        applied = await asyncio.to_thread(
+                            self.rag_system.index_manager.run_if_idle, lambda: self._apply_changes(pending)
+                        )
+                    except Exception:
+                        # 失败的变更放回队列，下一轮重试
+                        self._pending = {**pending, **self._pending}
+                        raise
+                    if not applied:
+                        self._pending = {**pending, **self._pending}
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                metrics.inc("index_watch_errors_total")
+                logger.error(f"增量索引失败: {e}")
+
+    def _collect_changes(self, current: Dict[Path, float]):
+        """对比前后两次扫描结果，记录新增、修改、删除的文件"""
+        now = time.time()
+        changed = [
+            path for path, mtime in current.items()
+            if self._mtimes.get(path) != mtime
+        ]
+        changed.extend(path for path in self._mtimes if path not in current)
+        for path in changed:
+            # 以文件修改时间作为变更时间，删除的文件以发现时间为准
+            self._pending.setdefault(path, current.get(path, now))
+        if changed:
+            self._last_change = time.monotonic()
+            metrics.set_gauge("index_watch_pending_files", len(self._pending))
+        self._mtimes = current
+
+    def _apply_changes(self, pending: Dict[Path, float]):
+        """
+        只对变更文件做加载、分块、向量化，并基于当前快照写时复制出新快照
+
+        Args:
+            pending: 变更文件 -> 变更时间
+        """
+        snapshot = self.rag_system.snapshot
+        data_module = snapshot.data_module
+        changed_parent_ids = {data_module.get_parent_id(path) for path in pending}
+        existing_files: List[Path] = [path for path in pending if path.exists()]
+
+        # 在新模块上加载变更文件，分块时写入的父子映射不会落到正在服务的快照上
+        next_data = DataPreparationModule(data_module.data_path)
+        new_docs, new_chunks = next_data.load_files(existing_files)
+
+        index_module = snapshot.index_module.clone()
+        index_module.remove_documents_by_parent(changed_parent_ids)
+        if new_chunks:
+            index_module.add_documents(new_chunks)
+
+        next_data.documents = [
+            doc for doc in data_module.documents
+            if doc.metadata.get("parent_id") not in changed_parent_ids
+        ] + new_docs
+        next_data.chunks = [
+            chunk for chunk in data_module.chunks
+            if chunk.metadata.get("parent_id") not in changed_parent_ids
+        ] + new_chunks
+        next_data.parent_child_map = {
+            chunk.metadata["chunk_id"]: chunk.metadata["parent_id"]
+            for chunk in next_data.chunks
+            if "chunk_id" in chunk.metadata and "parent_id" in chunk.metadata
+        }
+
+        config = self.rag_system.config
+        retrieval_module = RetrievalOptimizationModule(
+            index_module.vectorstore,
+            next_data.chunks,
+            score_threshold=config.score_threshold,
+            rrf_weights=config.rrf_weights
+        )
+        next_snapshot = RetrievalSnapshot(
+            generation_id=new_generation_id(),
+            data_module=next_data,
+            index_module=index_module,
+            retrieval_module=retrieval_module
+        )
+        self.rag_system.swap_snapshot(next_snapshot)
+
+        # 记录从文件变更到可被检索的延迟
+        searchable_at = time.time()
+        for changed_at in pending.values():
+            metrics.observe("index_watch_lag_seconds", max(searchable_at - changed_at, 0.0))
+        metrics.inc("index_watch_files_reindexed_total", len(pending))
+        metrics.set_gauge("index_watch_pending_files", len(self._pending))
+        logger.info(
+            f"增量索引完成: {len(pending)} 个文件变更, 新增 {len(new_chunks)} 个chunk, "
+            f"代际 {next_snapshot.generation_id}"
+        )
+
+        self.rag_system.index_manager.persist_snapshot(next_snapshot)
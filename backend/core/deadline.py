@@ -0,0 +1,105 @@
+"""
+请求截止时间 - 从接口层传入 RAG 各阶段，剩余预算不足时逐级降级并记录降级步骤
+"""
+
+import asyncio
+import math
+import time
+from typing import Any, AsyncIterator, Awaitable, List, Optional
+
+from core.metrics import metrics
+
+# 客户端可通过该请求头指定本次请求的时间预算（毫秒）
+DEADLINE_HEADER = "X-Request-Timeout-Ms"
+
+
+class DeadlineExceeded(TimeoutError):
+    """请求在截止时间前未能完成"""
+
+
+class Deadline:
+    """单个请求的截止时间与已应用的降级步骤"""
+
+    def __init__(self, budget_seconds: Optional[float] = None):
+        """
+        Args:
+            budget_seconds: 时间预算（秒），为空表示不限时
+        """
+        self.budget_seconds = budget_seconds
+        self.expires_at = time.monotonic() + budget_seconds if budget_seconds else None
+        self.degradations: List[str] = []
+
+    @classmethod
+    def from_header(cls, header_ms: Optional[str], default_seconds: Optional[float]) -> 'Deadline':
+        """请求头的预算优先，格式错误或非正数时使用默认预算"""
+        try:
+            budget = float(header_ms) / 1000 if header_ms else None
+        except ValueError:
+            budget = None
+        return cls(budget if budget and budget > 0 else default_seconds)
+
+    def remaining(self) -> float:
+        if self.expires_at is None:
+            return math.inf
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def below(self, seconds: float) -> bool:
+        """剩余预算是否低于阈值"""
+        return self.remaining() < seconds
+
+    def tier(self, thresholds) -> int:
+        """剩余预算低于多少个降级阈值；档位相同的请求会经历相同的降级步骤"""
+        return sum(1 for seconds in thresholds if self.below(seconds))
+
+    def degrade(self, step: str):
+        """记录一个降级步骤"""
+        if step not in self.degradations:
+            self.degradations.append(step)
+            metrics.inc("deadline_degradations_total", step=step)
+
+    def timeout(self, reserve: float = 0.0) -> Optional[float]:
+        """为某个阶段留出 reserve 秒给后续阶段后的可用时长，不限时返回 None"""
+        if self.expires_at is None:
+            return None
+        return max(self.remaining() - reserve, 0.0)
+
+    async def run(self, coro: Awaitable[Any], reserve: float = 0.0) -> Any:
+        """
+        在可用时长内等待协程，超时抛出 DeadlineExceeded
+
+        Args:
+            coro: 协程
+            reserve: 为后续阶段保留的时长（秒）
+        """
+        try:
+            return await asyncio.wait_for(coro, self.timeout(reserve))
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(f"阶段在 {self.budget_seconds}s 的请求预算内未完成")
+
+    async def bound(self, chunks: AsyncIterator[Any], step: str = "truncated") -> AsyncIterator[Any]:
+        """
+        逐块转发流式输出，截止时间到达时停止并记录降级
+
+        Args:
+            chunks: 分块异步迭代器
+            step: 截断时记录的降级步骤
+        """
+        iterator = chunks.__aiter__()
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(iterator.__anext__(), self.timeout())
+                except StopAsyncIteration:
+                    return
+                except asyncio.TimeoutError:
+                    self.degrade(step)
+                    return
+                yield chunk
+        finally:
+            aclose = getattr(iterator, "aclose", None)
+            if aclose:
+                await aclose()
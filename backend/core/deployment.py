@@ -0,0 +1,140 @@
+"""
+多进程部署支持 - fork前预加载只读资源、worker内存统计、代际同步
+"""
+
+import asyncio
+import gc
+import logging
+import os
+from pathlib import Path
+from typing import Any, Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+def preload_enabled() -> bool:
+    """是否启用 fork 前预加载（由 gunicorn.conf.py 设置 RAG_PRELOAD=1）"""
+    return os.getenv("RAG_PRELOAD", "").lower() in ("1", "true")
+
+
+def preload_rag_system():
+    """
+    在主进程中构建 RAG 系统单例，fork 后各 worker 以写时复制方式共享
+    嵌入模型权重、向量索引、文档块与 BM25 统计表
+    """
+    from core.rag_system import RecipeRAGSystem
+
+    logger.info(f"主进程 {os.getpid()} 预加载 RAG 系统...")
+    RecipeRAGSystem()
+    # 冻结现有对象，避免 worker 中的垃圾回收改写对象头导致共享页被复制
+    gc.collect()
+    gc.freeze()
+    logger.info(f"RAG 系统预加载完成，已冻结 {gc.get_freeze_count()} 个对象")
+
+
+def _read_smaps_rollup(pid: int) -> Dict[str, int]:
+    """读取 /proc/<pid>/smaps_rollup，返回以字节为单位的内存统计"""
+    stats = {}
+    with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 3 and parts[-1] == "kB":
+                stats[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    return stats
+
+
+def process_memory(pid: int = None) -> Dict[str, Any]:
+    """
+    统计进程的独占与共享内存
+
+    Args:
+        pid: 进程ID，默认当前进程
+
+    Returns:
+        rss/uss(独占)/shared(共享)/pss(按比例分摊) 字节数
+    """
+    pid = pid or os.getpid()
+    try:
+        stats = _read_smaps_rollup(pid)
+    except OSError:
+        # 非 Linux 环境只能拿到峰值 RSS
+        import resource
+        return {"pid": pid, "rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+
+    return {
+        "pid": pid,
+        "rss": stats.get("Rss", 0),
+        "uss": stats.get("Private_Clean", 0) + stats.get("Private_Dirty", 0),
+        "shared": stats.get("Shared_Clean", 0) + stats.get("Shared_Dirty", 0),
+        "pss": stats.get("Pss", 0)
+    }
+
+
+def sibling_worker_pids() -> List[int]:
+    """同一主进程下的全部 worker 进程ID（含当前进程）"""
+    parent = os.getppid()
+    pids = []
+    for proc_dir in Path("/proc").iterdir():
+        if not proc_dir.name.isdigit():
+            continue
+        try:
+            with open(proc_dir / "stat", "r") as f:
+                # 进程名可能包含空格，从最后一个右括号之后解析
+                fields = f.read().rsplit(")", 1)[1].split()
+            if int(fields[1]) == parent:
+                pids.append(int(proc_dir.name))
+        except (OSError, IndexError, ValueError):
+            continue
+    return sorted(pids)
+
+
+def worker_memory_report() -> Dict[str, Any]:
+    """当前 worker 及兄弟 worker 的独占/共享内存报告"""
+    workers = []
+    pids = sibling_worker_pids() if preload_enabled() else [os.getpid()]
+    for pid in pids or [os.getpid()]:
+        try:
+            workers.append(process_memory(pid))
+        except OSError:
+            continue
+    return {
+        "current_pid": os.getpid(),
+        "preload": preload_enabled(),
+        "workers": workers,
+        "total_uss": sum(w.get("uss", 0) for w in workers),
+        "total_pss": sum(w.get("pss", 0) for w in workers)
+    }
+
+
+def try_acquire_process_lock(lock_path: str):
+    """
+    非阻塞地获取跨进程文件锁，用于保证后台任务（如数据目录监听）只在一个 worker 中运行
+
+    Returns:
+        成功时返回需保持打开的文件对象，失败返回 None
+    """
+    import fcntl
+
+    Path(lock_path).parent.mkdir(parents=True, exist_ok=True)
+    lock_file = open(lock_path, "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+async def follow_current_generation(rag_system, interval: float = 5.0):
+    """
+    多 worker 部署时，定期检查磁盘上的当前代际指针，
+    使任意 worker 触发的重建或增量更新在所有 worker 生效
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(rag_system.index_manager.sync_with_current)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"同步索引代际失败: {e}")
@@ -0,0 +1,120 @@
+"""
+进程级共享 HTTP 连接池 - 所有上游模型调用（文本与视觉）复用同一组长连接
+
+连接池参数可通过环境变量调整:
+    HTTP_MAX_CONNECTIONS     最大连接数（默认 100）
+    HTTP_MAX_KEEPALIVE       最大空闲保活连接数（默认 20）
+    HTTP_KEEPALIVE_EXPIRY    空闲连接保活时间，秒（默认 30）
+    HTTP_WARMUP_CONNECTIONS  启动时预热的连接数（默认 2）
+    HTTP2                    是否启用 HTTP/2（默认在安装了 h2 时启用）
+"""
+
+import asyncio
+import importlib.util
+import os
+import time
+from typing import Optional
+
+import httpx
+
+from core.metrics import metrics
+
+_async_client: Optional[httpx.AsyncClient] = None
+_sync_client: Optional[httpx.Client] = None
+
+
+def http2_available() -> bool:
+    """HTTP/2 需要可选依赖 h2，可用环境变量 HTTP2=0 强制关闭"""
+    if os.getenv("HTTP2", "").lower() in ("0", "false"):
+        return False
+    return importlib.util.find_spec("h2") is not None
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", 100)),
+        max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE", 20)),
+        keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 30))
+    )
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(float(os.getenv("LLM_TIMEOUT", 60)), connect=10.0)
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """获取共享的异步 HTTP 客户端（fork 后在子进程中首次调用时重新创建）"""
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(http2=http2_available(), limits=_limits(), timeout=_timeout())
+    return _async_client
+
+
+def get_http_client() -> httpx.Client:
+    """获取共享的同步 HTTP 客户端（供线程池中的同步调用使用）"""
+    global _sync_client
+    if _sync_client is None or _sync_client.is_closed:
+        _sync_client = httpx.Client(http2=http2_available(), limits=_limits(), timeout=_timeout())
+    return _sync_client
+
+
+def _forget_clients():
+    """fork 出的子进程不沿用父进程的客户端：连接池与其中的锁不能跨进程共用"""
+    global _async_client, _sync_client
+    _async_client = None
+    _sync_client = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_clients)
+
+
+async def warm_up_http_clients(base_url: Optional[str] = None, connections: Optional[int] = None) -> float:
+    """
+    预先建立到上游的连接（DNS、TCP 与 TLS 握手），首个用户请求不再承担建连开销
+
+    Args:
+        base_url: 上游地址，默认读取 LLM_BASE_URL
+        connections: 并发预热的连接数
+
+    Returns:
+        预热耗时（秒），未配置上游时返回 0
+    """
+    base_url = base_url or os.getenv("LLM_BASE_URL")
+    if not base_url:
+        return 0.0
+    connections = connections or int(os.getenv("HTTP_WARMUP_CONNECTIONS", 2))
+    client = get_async_http_client()
+    headers = {"Authorization": f"Bearer {os.getenv('LLM_API_KEY', '')}"}
+    url = base_url.rstrip("/") + "/models"
+
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(client.get(url, headers=headers, timeout=10.0) for _ in range(connections)),
+        return_exceptions=True
+    )
+    elapsed = time.perf_counter() - start
+    failures = [r for r in results if isinstance(r, Exception)]
+    metrics.observe("http_warmup_seconds", elapsed)
+    if failures:
+        print(f"上游连接预热失败 {len(failures)}/{connections}: {failures[0]}")
+    else:
+        protocol = results[0].http_version if results else ""
+        print(f"上游连接预热完成: {connections} 个连接, {protocol}, 耗时 {elapsed * 1000:.1f}ms")
+    return elapsed
+
+
+async def close_http_clients():
+    """
+    关闭共享客户端，释放连接
+
+    只应在所有上游调用结束后（应用关闭时）调用。已持有旧客户端的视觉客户端与 ChatOpenAI
+    会在下次调用前检测到客户端已关闭并重新获取，不会继续使用已关闭的连接池。
+    """
+    global _async_client, _sync_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+    if _sync_client is not None:
+        _sync_client.close()
+        _sync_client = None
@@ -0,0 +1,391 @@
+"""
+索引代际管理 - 在独立进程中构建新索引，并原子切换检索快照
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import queue
+import shutil
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+from rag_modules import (
+    DataPreparationModule,
+    IndexConstructionModule,
+    RetrievalOptimizationModule
+)
+
+logger = logging.getLogger(__name__)
+
+# 代际目录与当前代际指针文件名
+GENERATIONS_DIR = "generations"
+CURRENT_POINTER = "CURRENT"
+CORPUS_FILE = "corpus.pkl"
+
+
+@dataclass
+class RetrievalSnapshot:
+    """一次索引代际的只读检索快照，请求开始时取用，整个请求内保持不变"""
+    generation_id: str
+    data_module: DataPreparationModule
+    index_module: Optional[IndexConstructionModule]
+    retrieval_module: Any
+    created_at: float = field(default_factory=time.time)
+    # 预渲染的上下文块（parent_id -> RecipeBlocks），切换前由 RAG 系统填充
+    context_blocks: Optional[Dict[str, Any]] = None
+    # 父文档展示信息（parent_id -> 菜名/分类/难度），用于还原聊天记录中的文档引用
+    parent_index: Optional[Dict[str, Dict[str, str]]] = None
+
+
+def new_generation_id() -> str:
+    """生成按时间排序的代际ID"""
+    return f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+
+def generation_dir(index_save_path: str, generation_id: str) -> Path:
+    """代际索引所在目录"""
+    return Path(index_save_path) / GENERATIONS_DIR / generation_id
+
+
+def read_current_generation(index_save_path: str) -> Optional[str]:
+    """读取当前生效的代际ID，不存在或目录缺失时返回None"""
+    pointer = Path(index_save_path) / CURRENT_POINTER
+    if not pointer.exists():
+        return None
+    generation_id = pointer.read_text(encoding="utf-8").strip()
+    gen_dir = generation_dir(index_save_path, generation_id)
+    if not generation_id or not (gen_dir / CORPUS_FILE).exists():
+        return None
+    return generation_id
+
+
+def write_current_generation(index_save_path: str, generation_id: str):
+    """原子地更新当前代际指针（先写临时文件再替换）"""
+    pointer = Path(index_save_path) / CURRENT_POINTER
+    tmp = pointer.with_suffix(".tmp")
+    tmp.write_text(generation_id, encoding="utf-8")
+    tmp.replace(pointer)
+
+
+def build_generation(data_path: str, embedding_model: str, output_dir: str, progress_queue):
+    """
+    子进程入口：加载文档、分块、向量化并保存到代际目录
+
+    Args:
+        data_path: 数据文件夹路径
+        embedding_model: 嵌入模型名称
+        output_dir: 代际输出目录
+        progress_queue: 进度队列，元素为(阶段, 进度, 说明)
+    """
+    def report(stage: str, progress: float, message: str = ""):
+        progress_queue.put((stage, progress, message))
+
+    try:
+        report("loading_documents", 0.05, "加载食谱文档")
+        data_module = DataPreparationModule(data_path)
+        data_module.load_documents()
+
+        report("chunking", 0.15, "进行文本分块")
+        chunks = data_module.chunk_documents()
+
+        report("embedding", 0.2, "加载嵌入模型")
+        index_module = IndexConstructionModule(model_name=embedding_model, index_save_path=output_dir)
+
+        def on_progress(done: int, total: int):
+            report("embedding", 0.2 + 0.7 * done / total, f"已向量化 {done}/{total}")
+
+        index_module.build_vector_index(chunks, progress_callback=on_progress)
+
+        report("saving", 0.92, "保存向量索引")
+        index_module.save_index()
+        data_module.save_corpus(str(Path(output_dir) / CORPUS_FILE))
+        report("built", 0.95, f"共 {len(data_module.documents)} 个文档, {len(chunks)} 个chunk")
+    except Exception as e:
+        report("failed", 1.0, str(e))
+        raise
+
+
+def load_generation_snapshot(config, generation_id: str, embeddings=None, mmap: bool = False) -> RetrievalSnapshot:
+    """
+    从代际目录加载检索快照
+
+    Args:
+        config: RAGConfig 配置
+        generation_id: 代际ID
+        embeddings: 复用已加载的嵌入模型
+        mmap: 是否以mmap方式加载向量索引
+
+    Returns:
+        检索快照
+    """
+    gen_dir = generation_dir(config.index_save_path, generation_id)
+
+    data_module = DataPreparationModule(config.data_path)
+    data_module.load_corpus(str(gen_dir / CORPUS_FILE))
+
+    index_module = IndexConstructionModule(
+        model_name=config.embedding_model,
+        index_save_path=str(gen_dir),
+        embeddings=embeddings
+    )
+    if index_module.load_index(mmap=mmap) is None:
+        raise RuntimeError(f"代际 {generation_id} 的向量索引加载失败")
+
+    retrieval_module = RetrievalOptimizationModule(
+        index_module.vectorstore,
+        data_module.chunks,
+        score_threshold=config.score_threshold,
+        rrf_weights=config.rrf_weights
+    )
+    return RetrievalSnapshot(
+        generation_id=generation_id,
+        data_module=data_module,
+        index_module=index_module,
+        retrieval_module=retrieval_module
+    )
+
+
+def load_or_build_snapshot(config, data_module: DataPreparationModule, index_module: IndexConstructionModule,
+                           mmap: bool = False) -> RetrievalSnapshot:
+    """
+    启动时加载知识库：优先当前代际，其次默认索引目录，都没有则全量构建
+
+    Args:
+        config: RAGConfig 配置
+        data_module: 数据准备模块
+        index_module: 索引构建模块（已加载嵌入模型）
+        mmap: 是否以mmap方式加载向量索引
+
+    Returns:
+        检索快照
+    """
+    # 优先加载最近一次热切换生效的代际
+    generation_id = read_current_generation(config.index_save_path)
+    if generation_id:
+        try:
+            logger.info(f"加载索引代际: {generation_id}")
+            return load_generation_snapshot(config, generation_id, embeddings=index_module.embeddings, mmap=mmap)
+        except Exception as e:
+            logger.warning(f"加载索引代际 {generation_id} 失败: {e}，回退到默认索引")
+
+    vectorstore = index_module.load_index(mmap=mmap)
+    if vectorstore is not None:
+        logger.info("成功加载已保存的向量索引")
+        # 仍需要加载文档和分块用于检索模块
+        data_module.load_documents()
+        data_module.chunk_documents()
+    else:
+        logger.info("未找到已保存的索引，开始构建新索引...")
+        data_module.load_documents()
+        chunks = data_module.chunk_documents()
+        index_module.build_vector_index(chunks)
+        index_module.save_index()
+
+    retrieval_module = RetrievalOptimizationModule(
+        index_module.vectorstore,
+        data_module.chunks,
+        score_threshold=config.score_threshold,
+        rrf_weights=config.rrf_weights
+    )
+    return RetrievalSnapshot(
+        generation_id="initial",
+        data_module=data_module,
+        index_module=index_module,
+        retrieval_module=retrieval_module
+    )
+
+
+class IndexGenerationManager:
+    """索引代际管理器 - 负责后台重建与快照切换"""
+
+    def __init__(self, rag_system):
+        """
+        初始化代际管理器
+
+        Args:
+            rag_system: RecipeRAGSystem 实例
+        """
+        self.rag_system = rag_system
+        self.config = rag_system.config
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._status: Dict[str, Any] = {
+            "state": "idle",
+            "stage": None,
+            "progress": 0.0,
+            "message": "",
+            "building_generation_id": None,
+            "started_at": None,
+            "finished_at": None,
+            "error": None
+        }
+
+    @property
+    def is_building(self) -> bool:
+        return self._status["state"] == "building"
+
+    def run_if_idle(self, update: Callable[[], None]) -> bool:
+        """
+        未在全量重建时执行增量更新（在线程中调用），执行期间持有构建锁，全量重建无法同时开始
+
+        Returns:
+            是否已执行；正在全量重建时返回 False
+        """
+        with self._lock:
+            if self.is_building:
+                return False
+            update()
+            return True
+
+    def get_status(self) -> Dict[str, Any]:
+        """获取构建进度与当前生效的代际ID"""
+        status = dict(self._status)
+        status["active_generation_id"] = self.rag_system.generation_id
+        return status
+
+    def start_rebuild(self) -> Dict[str, Any]:
+        """
+        启动后台重建，必须在事件循环中调用
+
+        Returns:
+            当前构建状态
+        """
+        # 增量更新在线程中持有该锁的时间较长，这里不阻塞事件循环
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("索引正在增量更新，请稍后再试")
+        try:
+            if self.is_building:
+                raise RuntimeError("索引正在构建中，请稍后再试")
+            generation_id = new_generation_id()
+            self._status.update({
+                "state": "building",
+                "stage": "queued",
+                "progress": 0.0,
+                "message": "",
+                "building_generation_id": generation_id,
+                "started_at": time.time(),
+                "finished_at": None,
+                "error": None
+            })
+        finally:
+            self._lock.release()
+        self._task = asyncio.get_running_loop().create_task(self._rebuild(generation_id))
+        return self.get_status()
+
+    async def _rebuild(self, generation_id: str):
+        """在独立进程中构建代际，完成后在后台线程加载并切换快照"""
+        output_dir = generation_dir(self.config.index_save_path, generation_id)
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        # 使用 spawn 避免在已有线程的服务进程中 fork
+        ctx = multiprocessing.get_context("spawn")
+        progress_queue = ctx.Queue()
+        process = ctx.Process(
+            target=build_generation,
+            args=(self.config.data_path, self.config.embedding_model, str(output_dir), progress_queue),
+            daemon=True
+        )
+
+        try:
+            process.start()
+            await self._follow_progress(process, progress_queue)
+            if process.exitcode != 0 or self._status["stage"] == "failed":
+                raise RuntimeError(self._status["message"] or f"构建进程异常退出: {process.exitcode}")
+
+            self._update("loading", 0.96, "加载新代际并构建检索器")
+            snapshot = await asyncio.to_thread(self.load_snapshot, generation_id)
+
+            self._update("swapping", 0.99, "切换检索快照")
+            self.rag_system.swap_snapshot(snapshot)
+            write_current_generation(self.config.index_save_path, generation_id)
+            self._cleanup_old_generations(keep=generation_id)
+
+            self._status.update({"state": "idle", "finished_at": time.time()})
+            self._update("done", 1.0, f"已切换到代际 {generation_id}")
+            logger.info(f"索引代际 {generation_id} 已生效")
+        except Exception as e:
+            logger.error(f"索引代际 {generation_id} 构建失败: {e}")
+            shutil.rmtree(output_dir, ignore_errors=True)
+            self._status.update({
+                "state": "failed",
+                "stage": "failed",
+                "error": str(e),
+                "finished_at": time.time()
+            })
+        finally:
+            if process.is_alive():
+                process.terminate()
+
+    async def _follow_progress(self, process, progress_queue):
+        """轮询子进程进度，直到子进程退出且队列读空"""
+        while True:
+            try:
+                stage, progress, message = await asyncio.to_thread(progress_queue.get, True, 0.5)
+                self._update(stage, progress, message)
+            except queue.Empty:
+                if not process.is_alive():
+                    break
+        await asyncio.to_thread(process.join)
+
+    def _update(self, stage: str, progress: float, message: str):
+        self._status.update({"stage": stage, "progress": round(progress, 3), "message": message})
+
+    def load_snapshot(self, generation_id: str) -> RetrievalSnapshot:
+        """
+        从代际目录加载快照（由 RAG 系统决定本地或远程检索模式）
+
+        Args:
+            generation_id: 代际ID
+
+        Returns:
+            可直接切换的检索快照
+        """
+        return self.rag_system.load_generation(generation_id)
+
+    def sync_with_current(self) -> bool:
+        """
+        若磁盘上的当前代际指针比本进程新，则加载并切换（多worker部署时由其他进程触发了重建）
+
+        Returns:
+            是否发生了切换
+        """
+        generation_id = read_current_generation(self.config.index_save_path)
+        if not generation_id or generation_id == self.rag_system.generation_id or self.is_building:
+            return False
+        self.rag_system.swap_snapshot(self.load_snapshot(generation_id))
+        logger.info(f"已同步到其他进程生成的索引代际 {generation_id}")
+        return True
+
+    def persist_snapshot(self, snapshot: RetrievalSnapshot):
+        """
+        把内存中生成的快照（如增量更新结果）落盘为代际，并设为当前代际
+
+        Args:
+            snapshot: 已切换生效的检索快照
+        """
+        gen_dir = generation_dir(self.config.index_save_path, snapshot.generation_id)
+        gen_dir.mkdir(parents=True, exist_ok=True)
+        snapshot.index_module.index_save_path = str(gen_dir)
+        snapshot.index_module.save_index()
+        snapshot.data_module.save_corpus(str(gen_dir / CORPUS_FILE))
+        write_current_generation(self.config.index_save_path, snapshot.generation_id)
+        self._cleanup_old_generations(keep=snapshot.generation_id)
+
+    def _cleanup_old_generations(self, keep: str):
+        """只保留最近的若干代际目录，当前代际始终保留"""
+        root = Path(self.config.index_save_path) / GENERATIONS_DIR
+        if not root.exists():
+            return
+        others = sorted(
+            (p for p in root.iterdir() if p.is_dir() and p.name != keep),
+            key=lambda p: p.name,
+            reverse=True
+        )
+        for gen_dir in others[max(self.config.index_generations_to_keep - 1, 0):]:
+            shutil.rmtree(gen_dir, ignore_errors=True)
+            logger.info(f"已清理旧索引代际: {gen_dir.name}")
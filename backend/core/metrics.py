@@ -0,0 +1,111 @@
+"""
+进程内指标注册表 - 计数器、仪表盘与直方图摘要
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Any, Dict
+
+
+def _metric_key(name: str, labels: Dict[str, Any]) -> str:
+    """把标签编码进指标名，如 llm_latency_seconds{tier="small"}"""
+    if not labels:
+        return name
+    label_str = ",".join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+    return f"{name}{{{label_str}}}"
+
+
+class _Histogram:
+    """保留最近若干个样本的直方图，用于计算分位数"""
+
+    def __init__(self, max_samples: int = 2048):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=max_samples)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self.samples.append(value)
+
+    def quantile(self, q: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "avg": round(self.total / self.count, 6) if self.count else 0.0,
+            "p50": round(self.quantile(0.5), 6),
+            "p95": round(self.quantile(0.95), 6),
+            "p99": round(self.quantile(0.99), 6),
+            "max": round(self.max, 6)
+        }
+
+
+class MetricsRegistry:
+    """线程安全的指标注册表"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {}
+        self._gauges: Dict[str, float] = {}
+        self._histograms: Dict[str, _Histogram] = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """计数器累加"""
+        key = _metric_key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        """设置仪表盘当前值"""
+        key = _metric_key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name: str, value: float, **labels):
+        """记录一个直方图样本"""
+        key = _metric_key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram()
+            histogram.observe(value)
+
+    def get_counter(self, name: str, **labels) -> float:
+        return self._counters.get(_metric_key(name, labels), 0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """导出全部指标"""
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "histograms": {k: h.summary() for k, h in self._histograms.items()}
+            }
+
+
+# 全局指标实例
+metrics = MetricsRegistry()
+
+
+async def monitor_event_loop_lag(interval: float = 0.25):
+    """
+    周期性测量事件循环延迟：实际唤醒时间比预定时间晚多少，反映同步阻塞代码占用循环的程度
+
+    Args:
+        interval: 采样间隔（秒）
+    """
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(time.perf_counter() - start - interval, 0.0)
+        metrics.observe("event_loop_lag_seconds", lag)
+        metrics.set_gauge("event_loop_lag_seconds_last", lag)
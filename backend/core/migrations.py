@@ -0,0 +1,129 @@
+"""
+聊天记录表结构迁移 - 按版本号顺序执行，已应用的版本记录在 schema_version 表中
+
+新增结构变更时在 MIGRATIONS 末尾追加一项。迁移函数需可重复执行：新库的第 1 步按当前模型建表，
+后续步骤检查列或索引是否已存在。多个 worker 同时启动时，迁移在一个持有写锁的事务中串行执行。
+"""
+
+from typing import Callable, List, Tuple
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from core.database import Base
+
+
+def add_column_if_missing(conn: Connection, table: str, column: str, ddl: str):
+    """
+    给已存在的表补加列
+
+    Args:
+        conn: 数据库连接
+        table: 表名
+        column: 列名
+        ddl: 列定义，如 "TEXT" 或 "INTEGER NOT NULL DEFAULT 0"
+    """
+    columns = {c["name"] for c in inspect(conn).get_columns(table)}
+    if column not in columns:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+
+def _create_tables(conn: Connection):
+    import models.chat  # 注册模型
+    Base.metadata.create_all(conn)
+
+
+def _create_indexes(conn: Connection):
+    # create_all 不会给已存在的表补建索引
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+def _add_session_summary(conn: Connection):
+    add_column_if_missing(conn, "chat_sessions", "summary", "TEXT")
+    add_column_if_missing(conn, "chat_sessions", "summary_message_id", "INTEGER")
+
+
+def _add_message_doc_refs(conn: Connection):
+    add_column_if_missing(conn, "chat_messages", "doc_refs", "BYTEA" if conn.dialect.name == "postgresql" else "BLOB")
+
+
+def normalize_sqlite_timestamps(conn: Connection, table: str, columns: List[str]):
+    """
+    把 SQLite 中由 CURRENT_TIMESTAMP 写入的时间（YYYY-MM-DD HH:MM:SS）补齐为 SQLAlchemy 的微秒格式
+
+    SQLite 按字符串比较时间，两种格式混用时同一秒内的记录排序不一致，游标分页会重复返回边界行。
+    """
+    if conn.dialect.name != "sqlite":
+        return
+    for column in columns:
+        conn.execute(text(f"UPDATE {table} SET {column} = {column} || '.000000' WHERE length({column}) = 19"))
+
+
+def _normalize_message_timestamps(conn: Connection):
+    normalize_sqlite_timestamps(conn, "chat_messages", ["created_at"])
+
+
+def _normalize_session_timestamps(conn: Connection):
+    normalize_sqlite_timestamps(conn, "chat_sessions", ["created_at", "updated_at"])
+
+
+# (版本号, 说明, 迁移函数)
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "创建会话与消息表", _create_tables),
+    (2, "会话与消息的分页索引", _create_indexes),
+    (3, "会话滚动摘要", _add_session_summary),
+    (4, "消息的紧凑文档引用", _add_message_doc_refs),
+    (5, "统一旧消息的时间格式", _normalize_message_timestamps),
+    (6, "统一旧会话的时间格式", _normalize_session_timestamps),
+]
+
+
+def _lock(conn: Connection):
+    """取得迁移锁，其他 worker 等到本事务提交后再读取版本"""
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('smartcooks_schema_migrations'))"))
+    else:
+        # SQLite 的写语句会取得数据库写锁，其他连接在 busy_timeout 内等待
+        conn.execute(text("UPDATE schema_version SET version = version WHERE 1 = 0"))
+
+
+def _migrate(conn: Connection) -> List[int]:
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        "version INTEGER PRIMARY KEY, description VARCHAR(200), "
+        "applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+    ))
+    _lock(conn)
+    current = conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_version")).scalar()
+    applied = []
+    for version, description, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        migrate(conn)
+        conn.execute(
+            text("INSERT INTO schema_version (version, description) VALUES (:version, :description)"),
+            {"version": version, "description": description}
+        )
+        applied.append(version)
+    return applied
+
+
+def current_version() -> int:
+    return MIGRATIONS[-1][0]
+
+
+async def run_migrations(engine: AsyncEngine) -> List[int]:
+    """
+    执行尚未应用的迁移
+
+    Returns:
+        本次应用的版本号
+    """
+    async with engine.begin() as conn:
+        applied = await conn.run_sync(_migrate)
+    if applied:
+        print(f"数据库结构已迁移到版本 {applied[-1]}（{engine.url.get_backend_name()}）")
+    return applied
@@ -134,3 +134,20 @@ class PromptTemplates:
 用户问题: {query}
 
 分类结果:"""
+
+    # 对话摘要模版
+    CONVERSATION_SUMMARY_TEMPLATE = """
+你是对话摘要助手。请把已有摘要与新增对话合并为一段新的摘要，供后续回答参考。
+
+已有摘要:
+{summary}
+
+新增对话:
+{conversation}
+
+要求：
+- 保留用户提到的菜品、食材、口味偏好、忌口、厨具和烹饪水平
+- 保留尚未解决的问题，省略寒暄和已经给出的完整步骤
+- 使用第三人称，不超过 200 字
+
+新的摘要:"""
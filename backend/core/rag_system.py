@@ -2,9 +2,14 @@
 RAG 系统包装类 - 用于 FastAPI
 """
 
+import asyncio
+import difflib
 import os
 import threading
+import time
+from collections import OrderedDict
 from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
 from dotenv import load_dotenv
 from fastapi.responses import StreamingResponse
 os.environ["HF_ENDPOINT"] = "https://hf-mirror.com"
@@ -14,8 +19,31 @@ from rag_modules import (
     DataPreparationModule,
     IndexConstructionModule,
     RetrievalOptimizationModule,
-    GenerationIntegrationModule
+    GenerationIntegrationModule,
+    LocalQueryRouter,
+    RouteDecision,
+    ContextBuilder,
+    TokenCounter,
+    UpstreamScheduler,
+    EndpointPool
 )
+from rag_modules.answer_cache import SemanticAnswerCache
+from rag_modules.caching import TTLCache
+from rag_modules.query_rewrite import needs_rewrite, normalize_query, parse_rewrite_output, rewrite_cache_key
+from core.index_generation import (
+    CORPUS_FILE,
+    IndexGenerationManager,
+    RetrievalSnapshot,
+    generation_dir,
+    load_generation_snapshot,
+    load_or_build_snapshot,
+    read_current_generation
+)
+from core.deadline import Deadline, DeadlineExceeded
+from core.metrics import metrics
+from core.single_flight import SingleFlight
+from core.router_examples import ROUTER_EXAMPLES
+from services.retrieval_client import RetrievalServiceClient, RemoteRetrievalModule
 
 load_dotenv()
 
@@ -41,10 +69,34 @@ class RecipeRAGSystem:
             return
 
         self.config = config or DEFAULT_CONFIG
-        self.data_module = None
-        self.index_module = None
-        self.retrieval_module = None
         self.generation_module = None
+        # 当前生效的检索快照（数据、索引、检索器三者同属一个代际）
+        self._snapshot: Optional[RetrievalSnapshot] = None
+        self._swap_lock = threading.Lock()
+        # 多worker部署时以mmap加载索引，各进程共享页缓存
+        self.mmap_index = self.config.faiss_mmap or os.getenv("RAG_FAISS_MMAP", "").lower() in ("1", "true")
+        # 配置后检索与向量化交给独立的检索服务进程
+        self.retrieval_address = self.config.retrieval_service_address or os.getenv("RETRIEVAL_SERVICE")
+        self._retrieval_client: Optional[RetrievalServiceClient] = None
+        # 检索服务切换代际后的本地语料重载任务，按代际去重并保留引用直到完成
+        self._reload_tasks: Dict[str, asyncio.Task] = {}
+        # 查询向量缓存，路由分类器、本地检索与答案缓存共用
+        self._query_embeddings: OrderedDict = OrderedDict()
+        # 计算中的查询向量，路由分类、检索与答案缓存对同一问题只计算一次
+        self._embedding_tasks: Dict[str, asyncio.Future] = {}
+        # 查询重写结果缓存，键为 (归一化查询, 聊天历史摘要)
+        self._rewrite_cache = TTLCache(
+            max_size=self.config.rewrite_cache_size,
+            ttl_seconds=self.config.rewrite_cache_ttl
+        )
+        # 进行中的相同问题合并
+        self._single_flight = SingleFlight()
+        # 语义答案缓存，仅用于无聊天历史的非闲聊问题，索引代际变化时失效
+        self._answer_cache = SemanticAnswerCache(
+            similarity_threshold=self.config.answer_cache_similarity,
+            max_size=self.config.answer_cache_size,
+            ttl_seconds=self.config.answer_cache_ttl
+        )
         # 开始初始化数据准备模块
         self.initialize_system()
         print("="*30)
@@ -57,67 +109,154 @@ class RecipeRAGSystem:
         print("开始构建知识库")
         self.build_knowledge_base()
         print("知识库构建完成")
+        self.index_manager = IndexGenerationManager(self)
         
         # 标记为已初始化
         self._initialized = True
 
+    @property
+    def snapshot(self) -> Optional[RetrievalSnapshot]:
+        """当前检索快照，单次请求内应只读取一次"""
+        return self._snapshot
+
+    @property
+    def generation_id(self) -> Optional[str]:
+        return self._snapshot.generation_id if self._snapshot else None
+
+    @property
+    def data_module(self) -> Optional[DataPreparationModule]:
+        return self._snapshot.data_module if self._snapshot else None
+
+    @property
+    def index_module(self) -> Optional[IndexConstructionModule]:
+        return self._snapshot.index_module if self._snapshot else None
+
+    @property
+    def retrieval_module(self) -> Optional[RetrievalOptimizationModule]:
+        return self._snapshot.retrieval_module if self._snapshot else None
+
+    def prepare_snapshot(self, snapshot: RetrievalSnapshot) -> RetrievalSnapshot:
+        """为快照预渲染上下文块（切换前在线程中完成，请求路径只做拼装）"""
+        if snapshot.context_blocks is None:
+            data_module = snapshot.data_module
+            snapshot.context_blocks = self.context_builder.render_blocks(data_module.documents, data_module.chunks)
+        if snapshot.parent_index is None:
+            snapshot.parent_index = {
+                doc.metadata["parent_id"]: self._document_info(doc)
+                for doc in snapshot.data_module.documents if doc.metadata.get("parent_id")
+            }
+        return snapshot
+
+    @staticmethod
+    def _document_info(doc) -> Dict[str, str]:
+        """回答中返回的文档展示信息"""
+        return {
+            "dish_name": doc.metadata.get('dish_name', '未知菜品'),
+            "category": doc.metadata.get('category', '未知'),
+            "difficulty": doc.metadata.get('difficulty', '未知')
+        }
+
+    def resolve_documents(self, refs: List[Tuple[str, float]]) -> List[Dict[str, Any]]:
+        """
+        把聊天记录中保存的文档引用还原为展示信息
+
+        Args:
+            refs: 按排名排列的 (parent_id, score)
+
+        Returns:
+            文档信息列表；当前知识库中已不存在的文档只返回 parent_id 与分数
+        """
+        snapshot = self.snapshot
+        parent_index = snapshot.parent_index if snapshot else None
+        documents = []
+        for parent_id, score in refs:
+            info = (parent_index or {}).get(parent_id) or {
+                "dish_name": "未知菜品", "category": "未知", "difficulty": "未知"
+            }
+            documents.append({**info, "parent_id": parent_id, "score": round(score, 4)})
+        return documents
+
+    def swap_snapshot(self, snapshot: RetrievalSnapshot):
+        """原子切换检索快照，进行中的请求继续使用旧快照直至结束"""
+        self.prepare_snapshot(snapshot)
+        with self._swap_lock:
+            previous = self._snapshot
+            self._snapshot = snapshot
+        self._answer_cache.invalidate(keep_generation_id=snapshot.generation_id)
+        print(f"检索快照已切换: {previous.generation_id if previous else None} -> {snapshot.generation_id}")
 
     def initialize_system(self):
-        """初始化所有模块"""
-        print("初始化数据准备模块...")
-        self.data_module = DataPreparationModule(self.config.data_path)
-        print("数据准备模块初始化完成")
-        print("初始化索引构建模块...")
-        self.index_module = IndexConstructionModule(
-            model_name=self.config.embedding_model,
-            index_save_path=self.config.index_save_path
+        """初始化所有模块（数据、索引与检索模块属于检索快照，在构建知识库时创建）"""
+        if self.retrieval_address:
+            # 远程检索模式：嵌入模型、FAISS与BM25都在检索服务进程中
+            print(f"使用远程检索服务: {self.retrieval_address}")
+        self.query_router = LocalQueryRouter(confidence_threshold=self.config.router_confidence_threshold)
+        self.context_builder = ContextBuilder(
+            TokenCounter(self.config.tokenizer_model or self.config.llm_model),
+            budgets=self.config.context_token_budgets
         )
-        print("索引构建模块初始化完成")
         print("🤖 初始化生成集成模块...")
-        self.generation_module = GenerationIntegrationModule(
+        self.generation_module = self._build_generation_module()
+        print("生成集成模块初始化完成")
+        print("初始化完成")
+
+    def _build_generation_module(self) -> GenerationIntegrationModule:
+        """生成模块持有进程内的上游调用状态（LLM 客户端、端点池、调度器），不能跨进程共用"""
+        return GenerationIntegrationModule(
             model_name=self.config.llm_model,
             temperature=self.config.temperature,
-            max_tokens=self.config.max_tokens
+            max_tokens=self.config.max_tokens,
+            model_tiers=self.config.model_tiers,
+            stage_settings=self.config.stage_settings,
+            scheduler=UpstreamScheduler(
+                max_concurrency=self.config.upstream_max_concurrency,
+                rate_limits=self.config.upstream_rate_limits,
+                max_retries=self.config.upstream_max_retries,
+                backoff_base=self.config.upstream_backoff_base,
+                backoff_max=self.config.upstream_backoff_max
+            ),
+            endpoint_pool=EndpointPool.from_env(
+                self.config.llm_endpoints,
+                failure_threshold=self.config.endpoint_failure_threshold,
+                cooldown_seconds=self.config.endpoint_cooldown_seconds,
+                hedge_quantile=self.config.hedge_quantile
+            )
         )
-        print("生成集成模块初始化完成")
-        print("初始化完成")
+
+    def init_worker(self):
+        """
+        在 fork 出的 worker 中重建进程内的上游调用状态
+
+        预加载模式下主进程只应共享只读资源（嵌入模型、索引、文档块）；主进程创建的 LLM 客户端、
+        端点延迟统计与调度器的并发槽位在每个 worker 中各自重建，连接池随之按 worker 独立创建
+        """
+        self.generation_module = self._build_generation_module()
+        self._single_flight = SingleFlight()
+        print(f"worker {os.getpid()} 已重建生成模块")
 
     def build_knowledge_base(self):
         """构建知识库"""
         print("开始构建知识库...")
-        vectorstore = self.index_module.load_index()
-
-        if vectorstore is not None:
-            print("✅ 成功加载已保存的向量索引！")
-            # 仍需要加载文档和分块用于检索模块
-            print("加载食谱文档...")
-            self.data_module.load_documents()
-            print("进行文本分块...")
-            chunks = self.data_module.chunk_documents()
+        if self.retrieval_address:
+            snapshot = self._build_remote_snapshot(read_current_generation(self.config.index_save_path))
         else:
-            print("未找到已保存的索引，开始构建新索引...")
-            # 2. 加载文档
-            print("加载食谱文档...")
-            self.data_module.load_documents()
-            # 3. 文本分块
-            print("进行文本分块...")
-            chunks = self.data_module.chunk_documents()
-            # 4. 构建向量索引
-            print("构建向量索引...")
-            vectorstore = self.index_module.build_vector_index(chunks)
-            # 5. 保存索引
-            print("保存向量索引...")
-            self.index_module.save_index()
-
-        print("初始化检索优化...")
-        self.retrieval_module = RetrievalOptimizationModule(
-            self.index_module.vectorstore,
-            self.data_module.chunks,
-            score_threshold=self.config.score_threshold,
-            rrf_weights=self.config.rrf_weights
-        )
+            # 启动用的模块只经由快照持有，切换代际后随旧快照一起释放
+            print("初始化索引构建模块...")
+            index_module = IndexConstructionModule(
+                model_name=self.config.embedding_model,
+                index_save_path=self.config.index_save_path
+            )
+            snapshot = load_or_build_snapshot(
+                self.config, DataPreparationModule(self.config.data_path), index_module, mmap=self.mmap_index
+            )
+        self.swap_snapshot(snapshot)
+
+        if snapshot.index_module is not None and self.config.local_router_enabled:
+            # 本地模式下启动时即训练路由分类器，远程模式在首次路由时训练
+            texts = [text for text, _ in ROUTER_EXAMPLES]
+            self.query_router.fit(ROUTER_EXAMPLES, snapshot.retrieval_module.embed_queries(texts))
 
-        stats = self.data_module.get_statistics()
+        stats = snapshot.data_module.get_statistics()
         print(f"\n📊 知识库统计:")
         print(f"   文档总数: {stats['total_documents']}")
         print(f"   文本块数: {stats['total_chunks']}")
@@ -126,67 +265,508 @@ class RecipeRAGSystem:
 
         print("✅ 知识库构建完成！")
 
+    def _build_remote_snapshot(self, generation_id: Optional[str]) -> RetrievalSnapshot:
+        """
+        远程检索模式下只加载文档与分块，用于解析检索服务返回的命中引用
+
+        Args:
+            generation_id: 检索服务当前的代际ID（本地存在该代际语料时直接加载）
+        """
+        data_module = DataPreparationModule(self.config.data_path)
+        corpus = generation_dir(self.config.index_save_path, generation_id) / CORPUS_FILE if generation_id else None
+        corpus_generation = None
+        if corpus and corpus.exists():
+            data_module.load_corpus(str(corpus))
+            corpus_generation = generation_id
+        else:
+            data_module.load_documents()
+            data_module.chunk_documents()
+
+        if self._retrieval_client is None:
+            self._retrieval_client = RetrievalServiceClient(self.retrieval_address)
+        retrieval_module = RemoteRetrievalModule(
+            self._retrieval_client,
+            data_module,
+            on_generation_change=self._on_service_generation_change,
+            corpus_generation=corpus_generation
+        )
+        return self.prepare_snapshot(RetrievalSnapshot(
+            generation_id=generation_id or "initial",
+            data_module=data_module,
+            index_module=None,
+            retrieval_module=retrieval_module
+        ))
+
+    def load_generation(self, generation_id: str) -> RetrievalSnapshot:
+        """
+        加载指定代际的检索快照，复用当前进程已加载的嵌入模型
+
+        Args:
+            generation_id: 代际ID
+        """
+        if self.retrieval_address:
+            return self._build_remote_snapshot(generation_id)
+        return self.prepare_snapshot(load_generation_snapshot(
+            self.config,
+            generation_id,
+            # 嵌入模型从当前快照取，各代际共用同一个模型实例
+            embeddings=self.snapshot.index_module.embeddings,
+            mmap=self.mmap_index
+        ))
+
+    def _on_service_generation_change(self, generation_id: str):
+        """检索服务切换代际后，在后台重新加载本地语料"""
+        async def reload():
+            snapshot = await asyncio.to_thread(self._build_remote_snapshot, generation_id)
+            snapshot.retrieval_module.service_generation = generation_id
+            self.swap_snapshot(snapshot)
+
+        if generation_id in self._reload_tasks:
+            return
+        task = asyncio.get_running_loop().create_task(reload())
+        self._reload_tasks[generation_id] = task
+
+        def done(finished: asyncio.Task):
+            self._reload_tasks.pop(generation_id, None)
+            if not finished.cancelled() and finished.exception() is not None:
+                print(f"❌ 重新加载代际 {generation_id} 的本地语料失败: {finished.exception()}")
+        task.add_done_callback(done)
+
+    async def _embed_query(self, snapshot: RetrievalSnapshot, text: str):
+        """获取查询向量（带LRU缓存），同一文本计算中时等待同一次计算"""
+        cached = self._query_embeddings.get(text)
+        if cached is not None:
+            self._query_embeddings.move_to_end(text)
+            return cached
+        # 等待方被取消（如推测检索被放弃）不影响其他等待同一向量的阶段
+        return await asyncio.shield(self._prefetch_embedding(snapshot, text))
+
+    def _prefetch_embedding(self, snapshot: RetrievalSnapshot, text: str) -> asyncio.Future:
+        """在后台开始计算查询向量（已在计算时复用），不等待结果"""
+        task = self._embedding_tasks.get(text)
+        if task is None:
+            task = asyncio.ensure_future(self._compute_embedding(snapshot, text))
+            self._embedding_tasks[text] = task
+
+            def done(finished: asyncio.Future):
+                self._embedding_tasks.pop(text, None)
+                if not finished.cancelled():
+                    # 所有等待方都已取消时也取走异常，避免未检索异常的告警
+                    finished.exception()
+            task.add_done_callback(done)
+        return task
+
+    async def _compute_embedding(self, snapshot: RetrievalSnapshot, text: str):
+        """计算查询向量：本地模式在线程池中计算，远程模式由检索服务计算"""
+        if snapshot.index_module is None:
+            embedding = (await self._retrieval_client.embed([text]))[0]
+        else:
+            embedding = (await asyncio.to_thread(snapshot.retrieval_module.embed_queries, [text]))[0]
+        self._query_embeddings[text] = embedding
+        if len(self._query_embeddings) > 1024:
+            self._query_embeddings.popitem(last=False)
+        return embedding
+
+    async def _ensure_router_fitted(self, snapshot: RetrievalSnapshot):
+        """首次使用时用标注样例训练本地路由分类器"""
+        if self.query_router.is_fitted:
+            return
+        texts = [text for text, _ in ROUTER_EXAMPLES]
+        if snapshot.index_module is None:
+            vectors = await self._retrieval_client.embed(texts)
+        else:
+            vectors = await asyncio.to_thread(snapshot.retrieval_module.embed_queries, texts)
+        self.query_router.fit(ROUTER_EXAMPLES, vectors)
+
+    async def _route(self, snapshot: RetrievalSnapshot, question: str, deadline: Deadline) -> RouteDecision:
+        """
+        查询路由：本地规则与分类器优先，置信度不足时回退到 LLM 路由；
+        剩余时间不足时直接采用分类器的最可能路由
+
+        Returns:
+            路由决策（含置信度与来源）
+        """
+        thresholds = self.config.deadline_thresholds
+        decision = RouteDecision(None, 0.0, "llm", 0.0)
+        if self.config.local_router_enabled:
+            decision = self.query_router.match_rules(question)
+            if decision.route is None and question not in self._query_embeddings \
+                    and deadline.below(thresholds["hybrid_retrieval"]):
+                # 剩余时间只够 BM25 检索时不再为分类器向量化查询，检索也不会用到查询向量
+                deadline.degrade("rules_only_routing")
+            elif decision.route is None:
+                start = time.perf_counter()
+                try:
+                    await self._ensure_router_fitted(snapshot)
+                    embedding = await self._embed_query(snapshot, question)
+                    classified = self.query_router.classify(embedding)
+                    # 分类本身只是一次矩阵乘法，耗时主要在查询向量化（未命中向量缓存时需完整计算一次），一并计入
+                    classified.elapsed_ms = decision.elapsed_ms + (time.perf_counter() - start) * 1000
+                    decision = classified
+                except Exception as e:
+                    print(f"本地路由分类失败，回退到LLM路由: {e}")
+
+        if decision.route is None and deadline.below(thresholds["router_llm"]):
+            deadline.degrade("local_routing")
+            decision = RouteDecision(decision.candidate or 'general', decision.confidence, "local", decision.elapsed_ms)
+        elif decision.route is None:
+            start = time.perf_counter()
+            try:
+                route = await deadline.run(
+                    self.generation_module.aquery_router(question), reserve=thresholds["generation_reserve"]
+                )
+            except DeadlineExceeded:
+                deadline.degrade("router_timeout")
+                route = decision.candidate or 'general'
+            decision = RouteDecision(route, decision.confidence, "llm", (time.perf_counter() - start) * 1000)
+
+        metrics.inc("router_decisions_total", source=decision.source, route=decision.route)
+        metrics.observe("router_latency_seconds", decision.elapsed_ms / 1000, source=decision.source)
+        return decision
+
+    async def _retrieve(self, snapshot: RetrievalSnapshot, query: str, filters: dict, top_k: int,
+                        bm25_only: bool = False):
+        """在给定快照上异步检索（本地模块走线程池，远程模块走检索服务）"""
+        # 路由分类时已算过的查询向量直接复用；本地模式下正在计算的向量等待复用，不再重复计算
+        query_embedding = self._query_embeddings.get(query)
+        if query_embedding is None and not bm25_only and snapshot.index_module is not None \
+                and query in self._embedding_tasks:
+            query_embedding = await self._embed_query(snapshot, query)
+        if filters:
+            return await snapshot.retrieval_module.ametadata_filtered_search(
+                query, filters, top_k=top_k, query_embedding=query_embedding, bm25_only=bm25_only
+            )
+        return await snapshot.retrieval_module.ahybrid_search(
+            query, top_k=top_k, query_embedding=query_embedding, bm25_only=bm25_only
+        )
+
+    def _bm25_only(self, deadline: Deadline) -> bool:
+        """剩余时间不足以做向量检索时只用 BM25"""
+        if deadline.below(self.config.deadline_thresholds["hybrid_retrieval"]):
+            deadline.degrade("bm25_only")
+            return True
+        return False
+
+    async def _rewrite(self, question: str, chat_history_str: str, deadline: Deadline) -> str:
+        """
+        查询重写：自包含的问题直接跳过，其余先查缓存再调用 LLM；剩余时间不足时沿用原问题
+
+        chat_history_str 只包含此前的对话（见 _prior_turns），会话的第一个问题按问题本身判断是否需要重写。
+        """
+        required, reason = needs_rewrite(question, chat_history_str)
+        if not required:
+            self._record_rewrite("skipped")
+            return question
+
+        cache_key = rewrite_cache_key(question, chat_history_str)
+        cached = self._rewrite_cache.get(cache_key)
+        if cached is not None:
+            self._record_rewrite("cache_hit")
+            return cached
+
+        thresholds = self.config.deadline_thresholds
+        if deadline.below(thresholds["rewrite"]):
+            deadline.degrade("skip_rewrite")
+            self._record_rewrite("skipped")
+            return question
+        try:
+            output = await deadline.run(
+                self.generation_module.aquery_rewrite(question, chat_history=chat_history_str),
+                reserve=thresholds["generation_reserve"]
+            )
+        except DeadlineExceeded:
+            deadline.degrade("rewrite_timeout")
+            self._record_rewrite("deadline")
+            return question
+        rewritten_query = parse_rewrite_output(output, question)
+        self._rewrite_cache.set(cache_key, rewritten_query)
+        self._record_rewrite("llm")
+        metrics.inc("query_rewrite_llm_reasons_total", reason=reason)
+        return rewritten_query
+
+    @staticmethod
+    def _record_rewrite(result: str):
+        """记录重写决策，并更新跳过率与缓存命中率"""
+        metrics.inc("query_rewrite_total", result=result)
+        skipped, hits, llm_calls, timeouts = (
+            metrics.get_counter("query_rewrite_total", result=name)
+            for name in ("skipped", "cache_hit", "llm", "deadline")
+        )
+        metrics.set_gauge("query_rewrite_skip_rate", round(skipped / (skipped + hits + llm_calls + timeouts), 4))
+        if hits + llm_calls:
+            metrics.set_gauge("query_rewrite_cache_hit_rate", round(hits / (hits + llm_calls), 4))
+
+    def _is_close_rewrite(self, question: str, rewritten_query: str) -> bool:
+        """判断重写结果是否与原问题足够接近，可以沿用推测检索结果"""
+        original, rewritten = normalize_query(question), normalize_query(rewritten_query)
+        if original == rewritten:
+            return True
+        ratio = difflib.SequenceMatcher(None, original, rewritten).ratio()
+        return ratio >= self.config.speculation_similarity
+
+    async def _pre_retrieve(self, snapshot: RetrievalSnapshot, question: str, chat_history_str: str, timings: dict,
+                            deadline: Deadline):
+        """
+        并发预检索流水线：路由、查询重写、原始问题的推测检索同时发起
+
+        Returns:
+            (路由决策, 最终检索查询, 检索结果)；闲聊路由时后两者为 None
+        """
+        async def timed(stage: str, coro):
+            start = time.perf_counter()
+            try:
+                return await coro
+            finally:
+                timings[f"{stage}_ms"] = round((time.perf_counter() - start) * 1000, 2)
+
+        filters = self._extract_filters_from_query(question)
+
+        # 规则已判定为闲聊时不必发起重写和检索
+        if self.config.local_router_enabled:
+            early = self.query_router.match_rules(question)
+            if early.route == 'chat':
+                metrics.inc("router_decisions_total", source=early.source, route=early.route)
+                metrics.observe("router_latency_seconds", early.elapsed_ms / 1000, source=early.source)
+                timings["route_ms"] = round(early.elapsed_ms, 2)
+                return early, None, None
+
+        # 答案缓存要用原问题的向量：与路由、检索并行计算，路由分类器与推测检索直接复用
+        # （闲聊路由时不取消：其他请求可能在等待同一向量，算完的向量留在缓存中）
+        if self._answer_cache_applies(chat_history_str) and question not in self._query_embeddings \
+                and not deadline.below(self.config.deadline_thresholds["hybrid_retrieval"]):
+            self._prefetch_embedding(snapshot, question)
+
+        route_task = asyncio.create_task(timed("route", self._route(snapshot, question, deadline)))
+        rewrite_task = asyncio.create_task(timed("rewrite", self._rewrite(question, chat_history_str, deadline)))
+        speculative_task = None
+        if self.config.speculative_retrieval:
+            speculative_task = asyncio.create_task(timed("speculative_retrieval", self._retrieve(
+                snapshot, question, filters, self.config.top_k, bm25_only=self._bm25_only(deadline)
+            )))
+        pending = [task for task in (rewrite_task, speculative_task) if task]
+
+        try:
+            decision = await route_task
+            if decision.route == 'chat':
+                for task in pending:
+                    task.cancel()
+                return decision, None, None
+
+            rewritten_query = await rewrite_task
+            if speculative_task and self._is_close_rewrite(question, rewritten_query):
+                timings["speculation"] = "hit"
+                relevant_chunks = await speculative_task
+            else:
+                if speculative_task:
+                    timings["speculation"] = "miss"
+                    speculative_task.cancel()
+                relevant_chunks = await timed("retrieval", self._retrieve(
+                    snapshot, rewritten_query, filters, self.config.top_k, bm25_only=self._bm25_only(deadline)
+                ))
+        except BaseException:
+            for task in pending:
+                task.cancel()
+            raise
+
+        if "speculation" in timings:
+            metrics.inc("speculative_retrieval_total", result=timings["speculation"])
+        return decision, rewritten_query, relevant_chunks
+
     def get_statistics(self):
         """获取知识库统计信息"""
         return self.data_module.get_statistics()
 
-    def ask_question(self, question: str, chat_history: list = None, stream: bool = True):
-        """回答用户问题"""
+    @property
+    def history_window(self) -> int:
+        """提示词中保留原文的最近消息数（不含本轮问题）"""
+        if self.config.conversation_summary_enabled:
+            return self.config.history_keep_turns * 2
+        return 10
+
+    @staticmethod
+    def _history_line(msg: dict) -> str:
+        role_name = "用户" if msg.get("role") == "user" else "助手"
+        return f"{role_name}: {msg.get('content', '')}"
+
+    def format_chat_history(self, chat_history: list = None, summary: str = None) -> str:
+        """
+        把会话摘要与最近的消息格式化为提示词中的聊天历史，总长度不超过 history_token_budget
+
+        预算从最新的消息开始分配，放不下的较早消息被截断或丢弃。
+        """
+        counter = self.context_builder.counter
+        budget = self.config.history_token_budget
+        summary_text = ""
+        if summary:
+            summary_text = "此前对话摘要: " + counter.truncate(summary, self.config.history_summary_max_tokens)
+            budget -= counter.count(summary_text)
+
+        lines = []
+        for msg in reversed((chat_history or [])[-self.history_window:]):
+            if budget <= 0:
+                break
+            line = self._history_line(msg)
+            tokens = counter.count(line)
+            if tokens > budget:
+                line = counter.truncate(line, budget)
+            lines.append(line)
+            budget -= tokens
+
+        history = "\n".join(([summary_text] if summary_text else []) + lines[::-1])
+        if history:
+            metrics.observe("history_tokens", self.config.history_token_budget - max(budget, 0))
+        return history
+
+    async def summarize_conversation(self, summary: Optional[str], messages: list) -> str:
+        """
+        把新移出历史窗口的消息合并进会话摘要
+
+        Args:
+            summary: 已有摘要
+            messages: 按时间正序的消息（role/content）
+        """
+        counter = self.context_builder.counter
+        # 详细步骤类回答很长，摘要只需要其开头
+        per_message = self.config.history_summary_max_tokens
+        conversation = "\n".join(counter.truncate(self._history_line(m), per_message) for m in messages)
+        start = time.perf_counter()
+        try:
+            return await self.generation_module.asummarize_conversation(summary, conversation)
+        finally:
+            metrics.observe("conversation_summary_seconds", time.perf_counter() - start)
+
+    async def ask_question(self, question: str, chat_history: list = None, stream: bool = True,
+                           deadline: Optional[Deadline] = None, summary: Optional[str] = None):
+        """
+        回答用户问题
+
+        Args:
+            question: 用户问题
+            chat_history: 聊天历史
+            stream: 是否流式返回
+            deadline: 请求截止时间，为空时使用配置的默认预算；各阶段按剩余时间降级
+            summary: 会话滚动摘要，与最近几轮原文一起作为聊天历史
+        """
+        deadline = deadline or Deadline(self.config.request_deadline)
         
-        # 格式化聊天历史
-        chat_history_str = ""
-        if chat_history:
-            history_parts = []
-            for msg in chat_history[-10:]: # 只取最近10条
-                role_name = "用户" if msg.get("role") == "user" else "助手"
-                content = msg.get("content", "")
-                history_parts.append(f"{role_name}: {content}")
-            chat_history_str = "\n".join(history_parts)
-
-        if not all([self.retrieval_module, self.generation_module]):
+        # 格式化聊天历史（摘要 + 此前几轮，受 token 上限约束）
+        chat_history_str = self.format_chat_history(self._prior_turns(question, chat_history), summary)
+
+        # 只有此前的对话才构成上下文：会话的第一个问题与无历史的请求一样可以合并
+        if not self.config.coalesce_requests or chat_history_str:
+            return await self._answer(question, chat_history_str, stream, deadline)
+
+        # 无历史的相同问题合并为一次生成（路由由问题决定，相同问题路由相同），分块广播给所有请求；
+        # 合并后的生成受发起者的截止时间约束，因此键中带上截止时间档位：
+        # 预算宽裕的请求不会合并到预算紧张、已按降级路径生成的请求上
+        key = (normalize_query(question), "", deadline.tier(self.config.deadline_thresholds.values()))
+        rows, leader = self._single_flight.join(key, lambda: self._answer(question, "", True, deadline))
+        if not leader:
+            print(f"合并到进行中的相同问题: {question}")
+        if stream:
+            return rows
+        return await self._collect_rows(rows)
+
+    @staticmethod
+    def _prior_turns(question: str, chat_history: list = None) -> list:
+        """
+        去掉历史末尾的本轮问题，只保留此前的对话
+
+        接口在保存本轮问题之前读取历史；调用方若先保存再读取，末尾的用户消息就是本轮问题，
+        留在历史中会让每个请求都显得带有上下文，跳过请求合并与答案缓存。
+        """
+        history = list(chat_history or [])
+        if history and history[-1].get("role") == "user" and history[-1].get("content") == question:
+            history.pop()
+        return history
+
+    @staticmethod
+    async def _collect_rows(rows) -> dict:
+        """把流式分块汇总成非流式结果"""
+        result = {"answer": "", "route_type": None, "documents": []}
+        async for row in rows:
+            result["answer"] += row.get("answer", "")
+            for key in ("route_type", "documents", "timings", "degradations"):
+                if row.get(key):
+                    result[key] = row[key]
+        return result
+
+    def _answer_cache_applies(self, chat_history_str: str) -> bool:
+        """答案缓存只用于无聊天历史的问题"""
+        return self.config.answer_cache_enabled and not chat_history_str
+
+    def _answer_max_tokens(self, route_type: str, deadline: Deadline) -> Optional[int]:
+        """剩余时间不足以生成完整回答时，按剩余比例缩短 max_tokens"""
+        full = self.config.deadline_thresholds["full_generation"]
+        if not deadline.below(full):
+            return None
+        deadline.degrade("short_answer")
+        configured = self.generation_module.stage_max_tokens(route_type)
+        return max(int(configured * deadline.remaining() / full), self.config.deadline_min_answer_tokens)
+
+    async def _bounded_rows(self, rows, route_type: str, documents: list, deadline: Deadline):
+        """截止时间到达时停止生成，并在末尾补一行降级信息"""
+        async for row in deadline.bound(rows):
+            yield row
+        if "truncated" in deadline.degradations:
+            yield {"answer": "", "route_type": route_type, "documents": documents,
+                   "degradations": list(deadline.degradations)}
+
+    async def _answer(self, question: str, chat_history_str: str, stream: bool, deadline: Deadline):
+        """路由、检索与生成的完整流程"""
+        # 整个请求固定使用同一个快照，热切换不影响进行中的请求
+        snapshot = self.snapshot
+        if not snapshot or not self.generation_module:
             raise ValueError("请先构建知识库")
         print(f"开始处理问题:{question},当前的stream为{stream}")
-        route_type = self.generation_module.query_router(question)
-
+        timings = {}
+        pipeline_start = time.perf_counter()
+        decision, rewritten_query, relevant_chunks = await self._pre_retrieve(
+            snapshot, question, chat_history_str, timings, deadline
+        )
+        timings["pre_generation_ms"] = round((time.perf_counter() - pipeline_start) * 1000, 2)
+        metrics.observe("pre_generation_latency_seconds", timings["pre_generation_ms"] / 1000)
+        route_type = decision.route
 
-        print(f"路由结果: {route_type}")
+        print(f"路由结果: {route_type} (来源: {decision.source}, 置信度: {decision.confidence:.2f}, "
+              f"耗时: {decision.elapsed_ms:.2f}ms)")
+        print(f"阶段耗时: {timings}")
 
         # 如果是闲聊，直接生成不需要检索
         if route_type == 'chat':
+            max_tokens = self._answer_max_tokens('chat', deadline)
             if stream:
                 async def generate():
-                    answer_chunks = self.generation_module.generate_chat_answer_stream(question, chat_history=chat_history_str)
+                    answer_chunks = self.generation_module.generate_chat_answer_stream(
+                        question, chat_history=chat_history_str, max_tokens=max_tokens
+                    )
+                    first = True
                     async for chunk in answer_chunks:
                         row = {
                             "answer": chunk,
                             "documents": [],
                             "route_type": "chat"
                         }
+                        if first:
+                            row["timings"] = timings
+                            row["degradations"] = list(deadline.degradations)
+                            first = False
                         yield row
                 
-                return generate()
+                return self._bounded_rows(generate(), "chat", [], deadline)
             else:
-                answer = self.generation_module.generate_chat_answer(question, chat_history=chat_history_str)
+                answer = await deadline.run(self.generation_module.agenerate_chat_answer(
+                    question, chat_history=chat_history_str, max_tokens=max_tokens
+                ))
                 return {
                     "answer": answer,
                     "documents": [],
-                    "route_type": "chat"
+                    "route_type": "chat",
+                    "timings": timings,
+                    "degradations": deadline.degradations
                 }
 
-        # 优化查询（仅非闲聊）
-        rewritten_query = self.generation_module.query_rewrite(question, chat_history=chat_history_str)
-        if "最终查询:" in rewritten_query:
-            rewritten_query = rewritten_query.split("最终查询:")[1]
         print(f"优化后的查询: {rewritten_query}")
-        filters = self._extract_filters_from_query(question)
-        if filters:
-            relevant_chunks = self.retrieval_module.metadata_filtered_search(
-                rewritten_query, filters, top_k=self.config.top_k
-            )
-        else:
-            relevant_chunks = self.retrieval_module.hybrid_search(
-                rewritten_query, top_k=self.config.top_k
-            )
 
         if not relevant_chunks:
             if stream:
@@ -194,67 +774,152 @@ class RecipeRAGSystem:
                     yield {
                         "answer": "抱歉，没有找到相关的食谱信息。请尝试其他菜品名称或关键词。",
                         "route_type": route_type,
-                        "documents": []
+                        "documents": [],
+                        "timings": timings,
+                        "degradations": list(deadline.degradations)
                     }
                 return empty_generator()
             else:
                 return {
                     "answer": "抱歉，没有找到相关的食谱信息。请尝试其他菜品名称或关键词。",
                     "route_type": route_type,
-                    "documents": []
+                    "documents": [],
+                    "timings": timings,
+                    "degradations": deadline.degradations
                 }
 
-        relevant_docs = self.data_module.get_parent_documents(relevant_chunks)
+        relevant_docs = snapshot.data_module.get_parent_documents(relevant_chunks)
 
+        # 父文档的分数取其命中子块的最高 RRF 分数（各检索路径都在本次结果的副本上写入），
+        # 不混用向量相关度；聊天记录只保存 parent_id 与分数
+        parent_scores: Dict[str, float] = {}
+        for chunk in relevant_chunks:
+            parent_id = chunk.metadata.get("parent_id")
+            score = float(chunk.metadata.get("rrf_score", 0.0))
+            if parent_id and score > parent_scores.get(parent_id, -1.0):
+                parent_scores[parent_id] = score
         doc_info = []
         for doc in relevant_docs:
+            parent_id = doc.metadata.get("parent_id")
             doc_info.append({
-                "dish_name": doc.metadata.get('dish_name', '未知菜品'),
-                "category": doc.metadata.get('category', '未知'),
-                "difficulty": doc.metadata.get('difficulty', '未知')
+                **self._document_info(doc),
+                "parent_id": parent_id,
+                "score": round(parent_scores.get(parent_id, 0.0), 4)
             })
 
+        # 按路由的 token 预算组装上下文，优先放入命中的章节（list 路由不经过LLM）
+        context = None
+        if route_type != 'list':
+            context = self.context_builder.build(
+                question, route_type, relevant_docs, relevant_chunks, snapshot.context_blocks or {}
+            )
+
+        # 无历史的问题查询语义答案缓存，键为查询向量 + 检索到的父文档集合；
+        # 向量已在预检索阶段并行计算，时间不足而未计算时跳过缓存
+        cache_embedding = None
+        parent_ids = [doc.metadata.get("parent_id") for doc in relevant_docs]
+        if self._answer_cache_applies(chat_history_str) and (
+                question in self._query_embeddings or question in self._embedding_tasks):
+            try:
+                cache_embedding = await self._embed_query(snapshot, question)
+            except Exception as e:
+                print(f"计算答案缓存向量失败，跳过缓存: {e}")
+        if cache_embedding is not None:
+            cached = self._answer_cache.get(snapshot.generation_id, route_type, parent_ids, cache_embedding)
+            metrics.inc("answer_cache_total", result="hit" if cached else "miss", route=route_type)
+            if cached:
+                timings["answer_cache"] = "hit"
+                print(f"答案缓存命中: {question}")
+                if stream:
+                    async def replay_generator():
+                        for index, chunk in enumerate(cached.chunks):
+                            row = {
+                                "answer": chunk,
+                                "route_type": route_type,
+                                "documents": doc_info
+                            }
+                            if index == 0:
+                                row["timings"] = timings
+                                row["degradations"] = list(deadline.degradations)
+                            yield row
+                            await asyncio.sleep(0)
+                    return replay_generator()
+                return {
+                    "answer": cached.answer,
+                    "route_type": route_type,
+                    "documents": doc_info,
+                    "timings": timings,
+                    "degradations": deadline.degradations
+                }
+
+        def store_answer(chunks):
+            if cache_embedding is not None and "".join(chunks).strip():
+                self._answer_cache.set(
+                    snapshot.generation_id, route_type, parent_ids, cache_embedding, chunks, doc_info
+                )
+
+        max_tokens = self._answer_max_tokens(route_type, deadline) if route_type != 'list' else None
         if stream:
             async def stream_generator():
                 if route_type == 'list':
                     answer_chunks = self.generation_module.generate_list_answer_stream(question, relevant_docs)
                 elif route_type == "detail":
-                    answer_chunks = self.generation_module.generate_step_by_step_answer_stream(question, relevant_docs, chat_history=chat_history_str)
+                    answer_chunks = self.generation_module.generate_step_by_step_answer_stream(question, relevant_docs, chat_history=chat_history_str, context=context, max_tokens=max_tokens)
                 else:
-                    answer_chunks = self.generation_module.generate_basic_answer_stream(question, relevant_docs, chat_history=chat_history_str)
+                    answer_chunks = self.generation_module.generate_basic_answer_stream(question, relevant_docs, chat_history=chat_history_str, context=context, max_tokens=max_tokens)
                 
+                first = True
+                generated = []
                 async for chunk in answer_chunks:
+                    generated.append(chunk)
                     row = {
                         "answer": chunk,
                         "route_type": route_type,
                         "documents": doc_info
                     }
+                    if first:
+                        row["timings"] = timings
+                        row["degradations"] = list(deadline.degradations)
+                        first = False
                     yield row
+                # 只缓存完整生成且未降级的回答
+                if not deadline.degradations:
+                    store_answer(generated)
             
-            return stream_generator()
+            return self._bounded_rows(stream_generator(), route_type, doc_info, deadline)
         else:
             if route_type == 'list':
                 answer = self.generation_module.generate_list_answer(question, relevant_docs)
             elif route_type == "detail":
-                answer = self.generation_module.generate_step_by_step_answer(question, relevant_docs, chat_history=chat_history_str)
+                answer = await deadline.run(self.generation_module.agenerate_step_by_step_answer(
+                    question, relevant_docs, chat_history=chat_history_str, context=context, max_tokens=max_tokens
+                ))
             else:
-                answer = self.generation_module.generate_basic_answer(question, relevant_docs, chat_history=chat_history_str)
+                answer = await deadline.run(self.generation_module.agenerate_basic_answer(
+                    question, relevant_docs, chat_history=chat_history_str, context=context, max_tokens=max_tokens
+                ))
 
+            # 非流式回答按固定长度切块，回放时与流式输出节奏一致
+            if not deadline.degradations:
+                store_answer([answer[i:i + 16] for i in range(0, len(answer), 16)])
             return {
                 "answer": answer,
                 "route_type": route_type,
-                "documents": doc_info
+                "documents": doc_info,
+                "timings": timings,
+                "degradations": deadline.degradations
             }
 
-    def search_by_category(self, category: str, query: str = ""):
+    async def search_by_category(self, category: str, query: str = ""):
         """按分类搜索菜品"""
-        if not self.retrieval_module:
+        snapshot = self.snapshot
+        if not snapshot:
             raise ValueError("请先构建知识库")
 
         search_query = query if query else category
         filters = {"category": category}
 
-        docs = self.retrieval_module.metadata_filtered_search(search_query, filters, top_k=10)
+        docs = await self._retrieve(snapshot, search_query, filters, 10)
 
         dish_names = []
         for doc in docs:
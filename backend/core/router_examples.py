@@ -0,0 +1,65 @@
+"""
+本地查询路由的标注样例，用于计算各路由类型的向量质心
+"""
+
+ROUTER_EXAMPLES = [
+    # list - 想要菜品列表或推荐，只需要菜名
+    ("推荐几个素菜", "list"),
+    ("有什么川菜", "list"),
+    ("给我3个简单的菜", "list"),
+    ("有哪些适合早餐的菜", "list"),
+    ("推荐几道下饭菜", "list"),
+    ("来点简单的汤", "list"),
+    ("有什么甜品推荐", "list"),
+    ("夏天适合吃什么菜", "list"),
+    ("家里有鸡蛋和番茄能做什么菜", "list"),
+    ("推荐一些水产类的菜", "list"),
+    ("有没有简单的饮品", "list"),
+    ("列几个适合新手的菜", "list"),
+    ("晚饭吃什么好", "list"),
+    ("有哪些用土豆做的菜", "list"),
+
+    # detail - 想要具体的制作方法或详细信息
+    ("宫保鸡丁怎么做", "detail"),
+    ("红烧肉的制作步骤", "detail"),
+    ("糖醋排骨需要什么食材", "detail"),
+    ("番茄炒蛋的做法", "detail"),
+    ("教我做可乐鸡翅", "detail"),
+    ("蒜蓉虾怎么做才好吃", "detail"),
+    ("清蒸鲈鱼要蒸多久", "detail"),
+    ("麻婆豆腐需要哪些调料", "detail"),
+    ("煎饺的详细做法", "detail"),
+    ("水煮鱼怎么做", "detail"),
+    ("红烧鱼头的制作方法", "detail"),
+    ("蛋炒饭需要什么材料", "detail"),
+    ("黄油煎虾的步骤是什么", "detail"),
+    ("怎样做皮蛋瘦肉粥", "detail"),
+
+    # general - 其他一般性问题
+    ("什么是川菜", "general"),
+    ("炒菜怎么不粘锅", "general"),
+    ("鸡蛋的营养价值", "general"),
+    ("红烧和清蒸有什么区别", "general"),
+    ("为什么肉炒出来很柴", "general"),
+    ("焯水有什么作用", "general"),
+    ("生抽和老抽的区别", "general"),
+    ("怎么判断油温", "general"),
+    ("减肥期间可以吃红烧肉吗", "general"),
+    ("冷冻的肉怎么快速解冻", "general"),
+    ("腌肉的技巧", "general"),
+    ("海鲜和啤酒能一起吃吗", "general"),
+
+    # chat - 非食谱查询的闲聊
+    ("你好", "chat"),
+    ("谢谢", "chat"),
+    ("再见", "chat"),
+    ("早上好", "chat"),
+    ("你是谁", "chat"),
+    ("你叫什么名字", "chat"),
+    ("辛苦了", "chat"),
+    ("哈哈哈", "chat"),
+    ("你真棒", "chat"),
+    ("在吗", "chat"),
+    ("今天心情不错", "chat"),
+    ("晚安", "chat"),
+]
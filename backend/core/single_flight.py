@@ -0,0 +1,157 @@
+"""
+相同问题的请求合并 - 并发的相同请求共用一次上游生成，分块广播给所有订阅者
+"""
+
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class BroadcastStream:
+    """一次上游生成的广播缓冲，后加入的订阅者先回放已缓冲的前缀再跟随实时分块"""
+
+    def __init__(self):
+        self.rows: List[Dict[str, Any]] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.producer: Optional[asyncio.Task] = None
+        self._changed = asyncio.Condition()
+
+    async def publish(self, row: Dict[str, Any]):
+        async with self._changed:
+            self.rows.append(row)
+            self._changed.notify_all()
+
+    async def close(self, error: Optional[BaseException] = None):
+        async with self._changed:
+            self.done = True
+            self.error = error
+            self._changed.notify_all()
+
+    def subscribe(self) -> 'Subscription':
+        """登记一个订阅者，返回其分块迭代器"""
+        self.subscribers += 1
+        return Subscription(self)
+
+    def unsubscribe(self):
+        self.subscribers -= 1
+        # 所有订阅者都已断开时停止上游生成
+        if self.subscribers == 0 and not self.done and self.producer and not self.producer.done():
+            self.producer.cancel()
+
+    async def _iterate(self) -> AsyncIterator[Dict[str, Any]]:
+        """逐条产出分块（每个订阅者拿到独立的副本，避免相互修改）"""
+        index = 0
+        while True:
+            async with self._changed:
+                while index >= len(self.rows) and not self.done:
+                    await self._changed.wait()
+                batch = self.rows[index:]
+                finished, error = self.done, self.error
+            index += len(batch)
+            for row in batch:
+                yield dict(row)
+            if finished and index >= len(self.rows):
+                if error is not None:
+                    raise error
+                return
+
+
+class Subscription:
+    """
+    单个订阅者的分块迭代器
+
+    订阅在迭代结束、出错、aclose 或对象被回收时退订（只退订一次）；
+    从未开始迭代就被丢弃的订阅同样会退订，不会让上游生成一直保持订阅者。
+    """
+
+    def __init__(self, flight: BroadcastStream):
+        self._flight = flight
+        self._rows = flight._iterate()
+        self._released = False
+
+    def __aiter__(self) -> 'Subscription':
+        return self
+
+    async def __anext__(self) -> Dict[str, Any]:
+        try:
+            return await self._rows.__anext__()
+        except BaseException:
+            self.release()
+            raise
+
+    async def aclose(self):
+        try:
+            await self._rows.aclose()
+        finally:
+            self.release()
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._flight.unsubscribe()
+
+    def __del__(self):
+        self.release()
+
+
+class SingleFlight:
+    """按键合并进行中的生成，进行中的并发请求数受不同问题数约束而非用户数"""
+
+    def __init__(self):
+        self._flights: Dict[Hashable, BroadcastStream] = {}
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    def join(self, key: Hashable,
+             factory: Callable[[], Awaitable[AsyncIterator[Dict[str, Any]]]]) -> Tuple[Subscription, bool]:
+        """
+        加入已有的生成，或以 factory 启动新的生成
+
+        Args:
+            key: 合并键
+            factory: 返回分块异步迭代器的协程函数
+
+        Returns:
+            (订阅迭代器, 是否为发起者)
+        """
+        flight = self._flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = BroadcastStream()
+            self._flights[key] = flight
+            flight.producer = asyncio.get_running_loop().create_task(self._produce(key, flight, factory))
+            # 生成在开始执行前就被取消时 _produce 的 finally 不会运行，由回调兜底移除
+            flight.producer.add_done_callback(lambda _: self._forget(key, flight))
+        subscription = flight.subscribe()
+        metrics.inc("single_flight_requests_total", role="leader" if leader else "follower")
+        metrics.set_gauge("single_flight_in_flight", len(self._flights))
+        return subscription, leader
+
+    async def _produce(self, key: Hashable, flight: BroadcastStream, factory):
+        error = None
+        try:
+            rows = await factory()
+            async for row in rows:
+                await flight.publish(row)
+        except asyncio.CancelledError as e:
+            error = e
+            logger.info(f"合并请求的订阅者已全部断开，停止生成: {key}")
+        except Exception as e:
+            error = e
+        finally:
+            # 先移除再关闭，结束后到达的相同请求会发起新的生成
+            self._forget(key, flight)
+            await flight.close(error)
+
+    def _forget(self, key: Hashable, flight: BroadcastStream):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        metrics.set_gauge("single_flight_in_flight", len(self._flights))
@@ -0,0 +1,180 @@
+"""
+流式回答的 SSE 事件协议（版本 2）
+
+    event: meta    首个事件，只发送一次：{"v": 2, "session_id", "route_type", "documents", "timings", "degradations"}
+    event: delta   回答片段，按字符数或时间窗口合并：{"text": "..."}
+    event: done    结束事件：{"usage": {"chars", "deltas", "chunks", "ttft_ms", "elapsed_ms"}, "degradations": [...]}
+    event: error   生成失败：{"message": "..."}
+    : ping         空闲时的心跳注释行，防止代理断开长连接
+"""
+
+import asyncio
+import json
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from core.metrics import metrics
+
+try:
+    import orjson
+
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj)
+except ImportError:
+    def dumps(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+PROTOCOL_VERSION = 2
+HEARTBEAT_FRAME = b": ping\n\n"
+
+_END = object()
+
+
+def frame(event: str, data: Dict[str, Any]) -> bytes:
+    """编码单个 SSE 事件"""
+    return b"event: " + event.encode() + b"\ndata: " + dumps(data) + b"\n\n"
+
+
+class SSEStreamEncoder:
+    """把 RAG 系统产出的回答分块编码为版本 2 事件流，并累积完整回答供落库"""
+
+    def __init__(self, session_id: Optional[str], coalesce_chars: int = 48, coalesce_ms: float = 40.0,
+                 heartbeat_seconds: float = 15.0):
+        """
+        初始化编码器
+
+        Args:
+            session_id: 会话ID
+            coalesce_chars: 缓冲的文本达到该字符数时立即发送
+            coalesce_ms: 缓冲中最早的文本等待超过该时长时发送
+            heartbeat_seconds: 超过该时长没有任何事件时发送心跳
+        """
+        self.session_id = session_id
+        self.coalesce_chars = coalesce_chars
+        self.coalesce_seconds = coalesce_ms / 1000
+        self.heartbeat_seconds = heartbeat_seconds
+        self.parts: List[str] = []
+        self.documents: List[Dict[str, Any]] = []
+        self.route_type: Optional[str] = None
+        self.degradations: List[str] = []
+        self.chunks = 0
+        self.deltas = 0
+        self.bytes_sent = 0
+
+    @property
+    def answer(self) -> str:
+        return "".join(self.parts)
+
+    @staticmethod
+    async def _pump(rows: AsyncIterator[Dict[str, Any]], queue: asyncio.Queue):
+        # 在独立任务中读取分块，编码循环可以按时间窗口与心跳超时等待
+        try:
+            async for row in rows:
+                await queue.put(row)
+            await queue.put(_END)
+        except Exception as e:
+            await queue.put(e)
+
+    def _emit(self, data: bytes) -> bytes:
+        self.bytes_sent += len(data)
+        return data
+
+    def _meta(self, row: Dict[str, Any]) -> bytes:
+        self.route_type = row.get("route_type")
+        self.documents = row.get("documents") or []
+        return self._emit(frame("meta", {
+            "v": PROTOCOL_VERSION,
+            "session_id": self.session_id,
+            "route_type": self.route_type,
+            "documents": self.documents,
+            "timings": row.get("timings") or {},
+            "degradations": self.degradations
+        }))
+
+    def _delta(self, buffer: List[str]) -> bytes:
+        self.deltas += 1
+        return self._emit(frame("delta", {"text": "".join(buffer)}))
+
+    async def encode(self, rows: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[bytes]:
+        """
+        编码事件流
+
+        Args:
+            rows: RAG 系统的回答分块（answer/route_type/documents/timings）
+
+        Yields:
+            SSE 帧
+        """
+        start = time.perf_counter()
+        ttft_ms = None
+        queue: asyncio.Queue = asyncio.Queue()
+        pump = asyncio.get_running_loop().create_task(self._pump(rows, queue))
+        buffer: List[str] = []
+        buffered = 0
+        flush_at = None
+        last_sent = time.monotonic()
+        meta_sent = False
+        try:
+            while True:
+                now = time.monotonic()
+                deadline = flush_at if flush_at is not None else last_sent + self.heartbeat_seconds
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout=max(deadline - now, 0))
+                except asyncio.TimeoutError:
+                    if buffer:
+                        yield self._delta(buffer)
+                        buffer, buffered, flush_at = [], 0, None
+                    else:
+                        yield self._emit(HEARTBEAT_FRAME)
+                    last_sent = time.monotonic()
+                    continue
+
+                if item is _END or isinstance(item, Exception):
+                    if not meta_sent:
+                        yield self._meta({})
+                    if buffer:
+                        yield self._delta(buffer)
+                    if isinstance(item, Exception):
+                        yield self._emit(frame("error", {"message": str(item)}))
+                        metrics.inc("sse_streams_total", result="error")
+                        return
+                    break
+
+                self.chunks += 1
+                # 截止时间引起的降级步骤（生成阶段截断时会在末尾补发）
+                if item.get("degradations"):
+                    self.degradations = item["degradations"]
+                if not meta_sent:
+                    yield self._meta(item)
+                    meta_sent = True
+                    last_sent = time.monotonic()
+                text = item.get("answer")
+                if not text:
+                    continue
+                if ttft_ms is None:
+                    ttft_ms = round((time.perf_counter() - start) * 1000, 2)
+                self.parts.append(text)
+                buffer.append(text)
+                buffered += len(text)
+                if flush_at is None:
+                    flush_at = time.monotonic() + self.coalesce_seconds
+                if buffered >= self.coalesce_chars:
+                    yield self._delta(buffer)
+                    buffer, buffered, flush_at = [], 0, None
+                    last_sent = time.monotonic()
+
+            answer_chars = sum(len(p) for p in self.parts)
+            yield self._emit(frame("done", {"usage": {
+                "chars": answer_chars,
+                "deltas": self.deltas,
+                "chunks": self.chunks,
+                "ttft_ms": ttft_ms,
+                "elapsed_ms": round((time.perf_counter() - start) * 1000, 2)
+            }, "degradations": self.degradations}))
+            metrics.inc("sse_streams_total", result="done")
+        finally:
+            # 客户端断开时停止读取上游分块
+            pump.cancel()
+            metrics.observe("sse_stream_bytes", self.bytes_sent)
+            if self.chunks:
+                metrics.observe("sse_chunks_per_delta", self.chunks / max(self.deltas, 1))
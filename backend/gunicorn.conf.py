@@ -0,0 +1,20 @@
+"""
+多 worker 部署配置：gunicorn 主进程预加载 RAG 系统后再 fork 出 uvicorn worker
+
+启动: gunicorn main:app -c gunicorn.conf.py
+"""
+
+import os
+
+# 必须在加载应用之前设置，main.py 据此在主进程中预加载
+os.environ.setdefault("RAG_PRELOAD", "1")
+os.environ.setdefault("RAG_FAISS_MMAP", "1")
+# fork 后 tokenizers / OpenMP 线程池不可复用，限制并行避免死锁
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+os.environ.setdefault("OMP_NUM_THREADS", "1")
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = 120
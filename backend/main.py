@@ -1,3 +1,5 @@
+import asyncio
+import os
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
@@ -5,8 +7,23 @@ from contextlib import asynccontextmanager
 from pathlib import Path
 
 from core.rag_system import RecipeRAGSystem
+from core.http_client import close_http_clients, warm_up_http_clients
+from core.metrics import monitor_event_loop_lag
+from core.deadline import DeadlineExceeded
+from core.deployment import (
+    follow_current_generation,
+    preload_enabled,
+    preload_rag_system,
+    process_memory,
+    try_acquire_process_lock
+)
 from api.v1.api import api_router
 
+# gunicorn preload_app 模式下在 fork 前加载只读资源，各 worker 共享物理内存；
+# LLM 客户端等进程内状态在 lifespan 中按 worker 重建（见 RecipeRAGSystem.init_worker）
+if preload_enabled():
+    preload_rag_system()
+
 app = FastAPI(
     title="尝尝咸淡 RAG API",
     description="食谱检索增强生成系统 API",
@@ -35,6 +52,17 @@ async def http_exception_handler(request: Request, exc: HTTPException):
         ).model_dump()
     )
 
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exception_handler(request: Request, exc: DeadlineExceeded):
+    return JSONResponse(
+        status_code=504,
+        content=ErrorResponse(
+            code=504,
+            message=str(exc)
+        ).model_dump()
+    )
+
+
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     return JSONResponse(
@@ -52,11 +80,66 @@ async def lifespan(app: FastAPI):
     # 初始化数据库
     from core.database import init_db
     await init_db()
+    # 聊天消息延迟写入：请求路径只入队，后台批量落库
+    from services.message_writer import message_writer, write_behind_enabled
+    if write_behind_enabled():
+        message_writer.start()
+    # 聊天记录保留策略与空间回收：多 worker 时只在一个 worker 中运行
+    from services.retention_service import chat_retention_job
+    purge_lock = try_acquire_process_lock("chat_purge.lock")
+    if purge_lock:
+        chat_retention_job.start()
     
     print("正在初始化 RAG 系统...")
     rag_system_instance = RecipeRAGSystem()
+    if preload_enabled():
+        # 预加载的单例来自 fork 前的主进程，上游客户端与调度器在本 worker 中重建
+        rag_system_instance.init_worker()
     print("RAG 系统初始化完成！")
+    # 预热上游连接池（端点池中的每个端点），首个请求不再承担 TLS 握手
+    await asyncio.gather(*(
+        warm_up_http_clients(url) for url in rag_system_instance.generation_module.endpoint_pool.urls
+    ))
+
+    # 多 worker 部署：跟随其他 worker 生成的索引代际
+    follower = None
+    watcher_lock = None
+    config = rag_system_instance.config
+    if preload_enabled():
+        follower = asyncio.create_task(follow_current_generation(rag_system_instance))
+        # 数据目录监听只需在一个 worker 中运行
+        watcher_lock = try_acquire_process_lock(str(Path(config.index_save_path) / ".watcher.lock"))
+
+    # 可选：监听数据目录，增量更新索引
+    watcher = None
+    watch_enabled = config.watch_data_dir or os.getenv("RAG_WATCH_DATA", "").lower() in ("1", "true")
+    # 远程检索模式下本进程不持有向量索引，由检索服务跟随代际
+    local_index = rag_system_instance.index_module is not None
+    if watch_enabled and local_index and (watcher_lock or not preload_enabled()):
+        from core.data_watcher import DataDirectoryWatcher
+        watcher = DataDirectoryWatcher(
+            rag_system_instance,
+            poll_interval=config.watch_poll_interval,
+            debounce_seconds=config.watch_debounce_seconds
+        )
+        watcher.start()
+    print(f"worker 内存: {process_memory()}")
+    loop_monitor = asyncio.create_task(monitor_event_loop_lag())
     yield
+    loop_monitor.cancel()
+    if watcher:
+        await watcher.stop()
+    if follower:
+        follower.cancel()
+    if watcher_lock:
+        watcher_lock.close()
+    if purge_lock:
+        await chat_retention_job.stop()
+        purge_lock.close()
+    # 写完队列中尚未落库的消息
+    await message_writer.stop()
+    # 最后关闭共享连接池；持有它的视觉客户端与 LLM 在下次使用时会按新连接池重建
+    await close_http_clients()
     print("RAG 系统关闭")
 
 app.router.lifespan_context = lifespan
@@ -1,34 +1,50 @@
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import List, Optional
-from sqlalchemy import String, DateTime, Text, ForeignKey, JSON
+from sqlalchemy import String, DateTime, Text, ForeignKey, JSON, Index, LargeBinary
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from sqlalchemy.sql import func
 
 from core.database import Base
 
+
+def utcnow() -> datetime:
+    """应用侧的微秒精度 UTC 时间，同一秒内的记录也能按时间排序和分页"""
+    return datetime.now(timezone.utc)
+
+
 class ChatSession(Base):
     """聊天会话模型"""
     __tablename__ = "chat_sessions"
+    # 会话列表按 updated_at 倒序做游标分页，id 用于同一时间的排序
+    __table_args__ = (Index("ix_chat_sessions_updated", "updated_at", "id"),)
 
     id: Mapped[str] = mapped_column(String(36), primary_key=True)  # UUID
     title: Mapped[str] = mapped_column(String(100), default="新对话")
-    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
-    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), onupdate=func.now(), server_default=func.now())
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utcnow, server_default=func.now())
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utcnow, onupdate=utcnow,
+                                                 server_default=func.now())
+    # 滚动摘要：summary_message_id 及之前的消息已合并进 summary
+    summary: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    summary_message_id: Mapped[Optional[int]] = mapped_column(nullable=True)
 
-    # 关联消息
-    messages: Mapped[List["ChatMessage"]] = relationship(back_populates="session", cascade="all, delete-orphan", lazy="selectin")
+    # 关联消息（不随会话自动加载，列表与详情查询只读取会话本身）
+    messages: Mapped[List["ChatMessage"]] = relationship(back_populates="session", cascade="all, delete-orphan", lazy="select")
 
 class ChatMessage(Base):
     """聊天消息模型"""
     __tablename__ = "chat_messages"
+    # 按会话取最近消息与分页：WHERE session_id = ? ORDER BY created_at DESC LIMIT n
+    __table_args__ = (Index("ix_chat_messages_session_created", "session_id", "created_at"),)
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
-    session_id: Mapped[str] = mapped_column(ForeignKey("chat_sessions.id"), index=True)
+    session_id: Mapped[str] = mapped_column(ForeignKey("chat_sessions.id"))
     role: Mapped[str] = mapped_column(String(20))  # user, assistant
     content: Mapped[str] = mapped_column(Text)
     image_url: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
-    meta_data: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)  # 存储文档来源等信息
-    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    meta_data: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)  # 存储文档来源等信息（旧消息）
+    # 回答引用的文档：按排名排列的 parent_id(md5 16字节) | score(f32)，读取时按当前知识库还原展示信息
+    doc_refs: Mapped[Optional[bytes]] = mapped_column(LargeBinary, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utcnow, server_default=func.now())
 
     # 关联会话
     session: Mapped["ChatSession"] = relationship(back_populates="messages")
@@ -6,10 +6,20 @@ from .data_preparation import DataPreparationModule
 from .index_construction import IndexConstructionModule
 from .retrieval_optimization import RetrievalOptimizationModule
 from .generation_integration import GenerationIntegrationModule
+from .query_router import LocalQueryRouter, RouteDecision
+from .context_builder import ContextBuilder, TokenCounter
+from .upstream_scheduler import UpstreamScheduler
+from .endpoint_pool import EndpointPool
 
 __all__ = [
     'DataPreparationModule',
     'IndexConstructionModule',
     'RetrievalOptimizationModule',
-    'GenerationIntegrationModule'
+    'GenerationIntegrationModule',
+    'LocalQueryRouter',
+    'RouteDecision',
+    'ContextBuilder',
+    'TokenCounter',
+    'UpstreamScheduler',
+    'EndpointPool'
 ]
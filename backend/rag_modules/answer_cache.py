@@ -0,0 +1,147 @@
+"""
+语义答案缓存 - 相近问题且检索到相同食谱时复用已生成的回答
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+@dataclass
+class CachedAnswer:
+    """缓存的回答，按原始流式分块保存以便原样回放"""
+    chunks: List[str]
+    documents: List[Dict[str, Any]]
+    embedding: np.ndarray = field(repr=False)
+    expires_at: float
+
+    @property
+    def answer(self) -> str:
+        return "".join(self.chunks)
+
+
+class SemanticAnswerCache:
+    """
+    以 (代际, 路由, 父文档ID集合) 分组，组内按查询向量余弦相似度匹配
+
+    每组的归一化向量堆叠成矩阵，查找只在本组内做一次矩阵乘法；矩阵在组内条目变化后的首次查找时重建
+    """
+
+    def __init__(self, similarity_threshold: float = 0.95, max_size: int = 512, ttl_seconds: float = 1800.0):
+        """
+        初始化答案缓存
+
+        Args:
+            similarity_threshold: 查询向量余弦相似度不低于该值才视为命中
+            max_size: 最大缓存回答数，超出时淘汰最久未使用的
+            ttl_seconds: 回答存活时间（秒）
+        """
+        self.similarity_threshold = similarity_threshold
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple, CachedAnswer]" = OrderedDict()
+        # 分组 -> 组内条目键（按插入顺序）；分组 -> (键列表, 向量矩阵)
+        self._groups: Dict[Tuple, Dict[Tuple, None]] = {}
+        self._matrices: Dict[Tuple, Tuple[List[Tuple], np.ndarray]] = {}
+        self._counter = 0
+
+    @staticmethod
+    def _group_key(generation_id: str, route: str, parent_ids: Iterable[str]) -> Tuple[str, str, FrozenSet[str]]:
+        return generation_id, route, frozenset(parent_ids)
+
+    @staticmethod
+    def _normalize(embedding: Sequence[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, generation_id: str, route: str, parent_ids: Iterable[str],
+            embedding: Sequence[float]) -> Optional[CachedAnswer]:
+        """
+        查找缓存回答
+
+        Args:
+            generation_id: 当前索引代际
+            route: 路由类型
+            parent_ids: 本次检索到的父文档ID
+            embedding: 查询向量
+
+        Returns:
+            命中的缓存回答，未命中返回 None
+        """
+        group = self._group_key(generation_id, route, parent_ids)
+        query = self._normalize(embedding)
+        now = time.monotonic()
+        with self._lock:
+            members = self._groups.get(group)
+            if not members:
+                return None
+            for key in [key for key in members if self._entries[key].expires_at < now]:
+                self._remove(key)
+            index = self._matrix(group)
+            if index is None:
+                return None
+            keys, matrix = index
+            scores = matrix @ query
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity_threshold:
+                return None
+            self._entries.move_to_end(keys[best])
+            return self._entries[keys[best]]
+
+    def _matrix(self, group: Tuple) -> Optional[Tuple[List[Tuple], np.ndarray]]:
+        """组内全部向量堆叠成的矩阵（调用方持有锁）"""
+        members = self._groups.get(group)
+        if not members:
+            return None
+        index = self._matrices.get(group)
+        if index is None:
+            keys = list(members)
+            index = (keys, np.stack([self._entries[key].embedding for key in keys]))
+            self._matrices[group] = index
+        return index
+
+    def _remove(self, key: Tuple):
+        """删除一条回答并维护分组索引（调用方持有锁）"""
+        self._entries.pop(key, None)
+        group = key[0]
+        members = self._groups.get(group)
+        if members is not None:
+            members.pop(key, None)
+            if not members:
+                del self._groups[group]
+        self._matrices.pop(group, None)
+
+    def set(self, generation_id: str, route: str, parent_ids: Iterable[str], embedding: Sequence[float],
+            chunks: List[str], documents: List[Dict[str, Any]]):
+        """写入一条回答"""
+        group = self._group_key(generation_id, route, parent_ids)
+        entry = CachedAnswer(
+            chunks=list(chunks),
+            documents=documents,
+            embedding=self._normalize(embedding),
+            expires_at=time.monotonic() + self.ttl_seconds
+        )
+        with self._lock:
+            self._counter += 1
+            key = (group, self._counter)
+            self._entries[key] = entry
+            self._groups.setdefault(group, {})[key] = None
+            self._matrices.pop(group, None)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, keep_generation_id: Optional[str] = None):
+        """清除非指定代际的缓存（不指定时全部清除）"""
+        with self._lock:
+            for key in list(self._entries):
+                if key[0][0] != keep_generation_id:
+                    self._remove(key)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,275 @@
+"""
+上下文构建模块 - 按模型真实 token 数与路由预算，优先选取命中的食谱章节
+"""
+
+import logging
+import re
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+from langchain_core.documents import Document
+
+from core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 没有二级标题的开头部分（菜名、简介、难度）
+INTRO_SECTION = "简介"
+
+# 各路由优先放入上下文的章节，靠前的优先
+ROUTE_SECTION_PRIORITY = {
+    'detail': ["必备原料和工具", "计算", "操作", INTRO_SECTION, "附加内容"],
+    'general': [INTRO_SECTION, "操作", "附加内容", "必备原料和工具", "计算"],
+    'ingredients': ["必备原料和工具", "计算", INTRO_SECTION],
+}
+
+# 每个路由"必须先给每道菜都放入"的主章节数
+PRIMARY_SECTION_COUNT = {
+    'detail': 3,
+    'general': 1,
+    'ingredients': 2,
+}
+
+INGREDIENT_QUESTION = re.compile(r'食材|原料|材料|配料|调料|用料|用量|需要(什么|哪些)|要准备')
+
+SEPARATOR = "\n" + "=" * 50
+
+
+class TokenCounter:
+    """按生成模型的分词器计数 token，分词器不可用时按字符估算"""
+
+    def __init__(self, model_name: Optional[str] = None):
+        """
+        初始化计数器
+
+        Args:
+            model_name: HuggingFace 分词器名称（通常与 LLM 同名），为空时直接使用估算
+        """
+        self.model_name = model_name
+        self._tokenizer = None
+        if model_name:
+            try:
+                from transformers import AutoTokenizer
+                self._tokenizer = AutoTokenizer.from_pretrained(model_name)
+                logger.info(f"已加载分词器: {model_name}")
+            except Exception as e:
+                logger.warning(f"分词器 {model_name} 加载失败，改用字符估算: {e}")
+
+    @property
+    def exact(self) -> bool:
+        return self._tokenizer is not None
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self._tokenizer is not None:
+            return len(self._tokenizer.encode(text, add_special_tokens=False))
+        # 估算：中文约每字 1 token，其余约每 4 字符 1 token
+        cjk = len(re.findall(r'[一-鿿]', text))
+        return cjk + (len(text) - cjk + 3) // 4
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """截断到不超过 max_tokens"""
+        if max_tokens <= 0:
+            return ""
+        if self._tokenizer is not None:
+            ids = self._tokenizer.encode(text, add_special_tokens=False)
+            return text if len(ids) <= max_tokens else self._tokenizer.decode(ids[:max_tokens])
+        tokens = self.count(text)
+        return text if tokens <= max_tokens else text[:max(int(len(text) * max_tokens / tokens), 0)]
+
+
+@dataclass
+class SectionBlock:
+    """预渲染的章节块"""
+    section: str
+    text: str
+    tokens: int
+    order: int
+
+
+@dataclass
+class RecipeBlocks:
+    """一道食谱的预渲染上下文块"""
+    parent_id: str
+    header: str
+    header_tokens: int
+    sections: List[SectionBlock] = field(default_factory=list)
+
+    def get(self, section: str) -> Optional[SectionBlock]:
+        for block in self.sections:
+            if block.section == section:
+                return block
+        return None
+
+
+class ContextBuilder:
+    """按 token 预算组装上下文：先保证每道相关食谱的主章节，再按优先级补充其余章节"""
+
+    def __init__(self, token_counter: TokenCounter, budgets: Dict[str, int] = None, default_budget: int = 1200):
+        """
+        初始化上下文构建器
+
+        Args:
+            token_counter: token 计数器
+            budgets: 各路由的上下文 token 预算
+            default_budget: 未配置路由的预算
+        """
+        self.counter = token_counter
+        self.budgets = budgets or {}
+        self.default_budget = default_budget
+
+    @staticmethod
+    def _render_header(index_hint: str, metadata: Dict) -> str:
+        header = f"【食谱{index_hint}】"
+        if 'dish_name' in metadata:
+            header += f" {metadata['dish_name']}"
+        if 'category' in metadata:
+            header += f" | 分类: {metadata['category']}"
+        if 'difficulty' in metadata:
+            header += f" | 难度: {metadata['difficulty']}"
+        return header
+
+    def render_blocks(self, documents: Iterable[Document], chunks: Iterable[Document]) -> Dict[str, RecipeBlocks]:
+        """
+        建索引时预渲染每道食谱的头部与各章节文本，并计算 token 数
+
+        Args:
+            documents: 父文档
+            chunks: 按标题分割出的子块
+
+        Returns:
+            parent_id -> 预渲染块
+        """
+        children = defaultdict(list)
+        for chunk in chunks:
+            if chunk.metadata.get("doc_type") == "child":
+                children[chunk.metadata.get("parent_id")].append(chunk)
+
+        rendered = {}
+        for doc in documents:
+            parent_id = doc.metadata.get("parent_id")
+            header = self._render_header("", doc.metadata)
+            blocks = RecipeBlocks(parent_id, header, self.counter.count(header))
+            parent_chunks = sorted(children.get(parent_id, []), key=lambda c: c.metadata.get("chunk_index", 0))
+            if not parent_chunks:
+                parent_chunks = [doc]
+            for order, chunk in enumerate(parent_chunks):
+                section = chunk.metadata.get("二级标题") or INTRO_SECTION
+                text = chunk.page_content.strip()
+                existing = blocks.get(section)
+                if existing:
+                    # 同一二级标题下的三级标题块合并
+                    existing.text += "\n" + text
+                    existing.tokens = self.counter.count(existing.text)
+                    continue
+                blocks.sections.append(SectionBlock(section, text, self.counter.count(text), order))
+            rendered[parent_id] = blocks
+        logger.info(f"上下文块预渲染完成: {len(rendered)} 道食谱")
+        return rendered
+
+    @staticmethod
+    def context_route(route: str, query: str) -> str:
+        """食材类问题单独使用"原料优先"的章节顺序"""
+        if INGREDIENT_QUESTION.search(query):
+            return 'ingredients'
+        return route if route in ROUTE_SECTION_PRIORITY else 'general'
+
+    def build(self, query: str, route: str, parent_docs: List[Document], matched_chunks: List[Document],
+              blocks: Dict[str, RecipeBlocks]) -> str:
+        """
+        组装上下文
+
+        Args:
+            query: 用户问题
+            route: 路由类型
+            parent_docs: 按相关性排序的父文档
+            matched_chunks: 检索命中的子块（其章节优先放入）
+            blocks: 预渲染块
+
+        Returns:
+            上下文字符串
+        """
+        if not parent_docs:
+            return "暂无相关食谱信息。"
+
+        budget = self.budgets.get(route, self.default_budget)
+        context_route = self.context_route(route, query)
+        priority = ROUTE_SECTION_PRIORITY[context_route]
+        primary = set(priority[:PRIMARY_SECTION_COUNT[context_route]])
+        rank = {section: i for i, section in enumerate(priority)}
+
+        matched = defaultdict(set)
+        for chunk in matched_chunks:
+            matched[chunk.metadata.get("parent_id")].add(chunk.metadata.get("二级标题") or INTRO_SECTION)
+
+        recipes = [blocks[doc.metadata.get("parent_id")] for doc in parent_docs
+                   if doc.metadata.get("parent_id") in blocks]
+        if not recipes:
+            return self.build_from_documents(parent_docs, budget)
+
+        def ordered(recipe: RecipeBlocks, first_pass: bool) -> List[SectionBlock]:
+            wanted = primary | matched[recipe.parent_id]
+            candidates = [b for b in recipe.sections if (b.section in wanted) == first_pass]
+            return sorted(candidates, key=lambda b: (b.section not in matched[recipe.parent_id],
+                                                     rank.get(b.section, len(rank))))
+
+        selected: Dict[str, List[SectionBlock]] = defaultdict(list)
+        used = 0
+        # 第一轮每道菜只放主章节与命中章节，第二轮再按优先级补充，避免前面的菜挤掉后面的菜
+        for first_pass in (True, False):
+            for recipe in recipes:
+                for block in ordered(recipe, first_pass):
+                    cost = block.tokens + (0 if selected[recipe.parent_id] else recipe.header_tokens)
+                    if used + cost <= budget:
+                        selected[recipe.parent_id].append(block)
+                        used += cost
+                    elif used == 0 and first_pass:
+                        # 首道菜的首个章节都放不下时截断放入，保证上下文不为空；
+                        # 预算连标题都放不下时跳过这道菜
+                        remaining = max(budget - recipe.header_tokens, 0)
+                        if remaining == 0:
+                            break
+                        text = self.counter.truncate(block.text, remaining)
+                        selected[recipe.parent_id].append(SectionBlock(block.section, text, remaining, block.order))
+                        used = budget
+
+        if not used:
+            # 每道菜都被跳过：整体截断第一篇文档，保证上下文不为空
+            return self.build_from_documents(parent_docs, budget)
+        metrics.observe("context_tokens", used, route=route)
+        parts = []
+        for i, recipe in enumerate(r for r in recipes if selected[r.parent_id]):
+            sections = sorted(selected[recipe.parent_id], key=lambda b: b.order)
+            header = recipe.header.replace("【食谱】", f"【食谱 {i + 1}】", 1)
+            parts.append(header + "\n" + "\n\n".join(b.text for b in sections) + "\n")
+        return SEPARATOR + "\n".join(parts)
+
+    def build_from_documents(self, docs: List[Document], budget: Optional[int] = None) -> str:
+        """
+        没有预渲染块时按整篇文档组装，放不下的文档跳过而不是中断
+
+        Args:
+            docs: 文档列表
+            budget: token 预算
+
+        Returns:
+            上下文字符串
+        """
+        if not docs:
+            return "暂无相关食谱信息。"
+        budget = budget or self.default_budget
+        parts = []
+        used = 0
+        for doc in docs:
+            doc_text = self._render_header(f" {len(parts) + 1}", doc.metadata) + f"\n{doc.page_content}\n"
+            tokens = self.counter.count(doc_text)
+            if used + tokens > budget:
+                continue
+            parts.append(doc_text)
+            used += tokens
+        if not parts:
+            first = self._render_header(" 1", docs[0].metadata) + "\n" + docs[0].page_content
+            parts.append(self.counter.truncate(first, budget) + "\n")
+        return SEPARATOR + "\n".join(parts)
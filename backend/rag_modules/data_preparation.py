@@ -5,7 +5,7 @@
 import logging
 import hashlib
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
 
 from langchain_text_splitters import MarkdownHeaderTextSplitter
 from langchain_core.documents import Document
@@ -53,29 +53,73 @@ class DataPreparationModule:
         logger.info(f"正在从 {self.data_path} 加载文档...")
         
         # 直接读取Markdown文件以保持原始格式
+        documents = self._read_markdown_files(Path(self.data_path).rglob("*.md"))
+        
+        self.documents = documents
+        logger.info(f"成功加载 {len(documents)} 个文档")
+        return documents
+
+    def load_files(self, file_paths: List[Path]) -> Tuple[List[Document], List[Document]]:
+        """
+        只加载并分块指定的Markdown文件，不修改模块自身的文档与分块（用于增量索引）；
+        分块会登记父子映射，应在新建的模块上调用，不要用正在服务的快照中的模块
+
+        Args:
+            file_paths: 需要加载的文件路径列表
+
+        Returns:
+            (父文档列表, 子块列表)
+        """
+        documents = self._read_markdown_files(file_paths)
+        chunks = self._markdown_header_split(documents)
+        for chunk in chunks:
+            if 'chunk_id' not in chunk.metadata:
+                chunk.metadata['chunk_id'] = str(uuid.uuid4())
+            chunk.metadata['chunk_size'] = len(chunk.page_content)
+        logger.info(f"增量加载 {len(documents)} 个文档, 生成 {len(chunks)} 个chunk")
+        return documents, chunks
+
+    def get_parent_id(self, md_file: Path) -> str:
+        """
+        为父文档生成确定性的唯一ID（基于数据根目录的相对路径）
+
+        Args:
+            md_file: Markdown文件路径
+
+        Returns:
+            父文档ID
+        """
+        try:
+            data_root = Path(self.data_path).resolve()
+            relative_path = Path(md_file).resolve().relative_to(data_root).as_posix()
+        except Exception:
+            relative_path = Path(md_file).as_posix()
+        return hashlib.md5(relative_path.encode("utf-8")).hexdigest()
+
+    def _read_markdown_files(self, file_paths) -> List[Document]:
+        """
+        读取Markdown文件并构建带增强元数据的父文档
+
+        Args:
+            file_paths: 文件路径可迭代对象
+
+        Returns:
+            父文档列表
+        """
         documents = []
-        data_path_obj = Path(self.data_path)
 
-        for md_file in data_path_obj.rglob("*.md"):
+        for md_file in file_paths:
             try:
                 # 直接读取文件内容，保持Markdown格式
                 with open(md_file, 'r', encoding='utf-8') as f:
                     content = f.read()
 
-                # 为每个父文档分配确定性的唯一ID（基于数据根目录的相对路径）
-                try:
-                    data_root = Path(self.data_path).resolve()
-                    relative_path = Path(md_file).resolve().relative_to(data_root).as_posix()
-                except Exception:
-                    relative_path = Path(md_file).as_posix()
-                parent_id = hashlib.md5(relative_path.encode("utf-8")).hexdigest()
-
                 # 创建Document对象
                 doc = Document(
                     page_content=content,
                     metadata={
                         "source": str(md_file),
-                        "parent_id": parent_id,
+                        "parent_id": self.get_parent_id(md_file),
                         "doc_type": "parent"  # 标记为父文档
                     }
                 )
@@ -87,9 +131,7 @@ class DataPreparationModule:
         # 增强文档元数据
         for doc in documents:
             self._enhance_metadata(doc)
-        
-        self.documents = documents
-        logger.info(f"成功加载 {len(documents)} 个文档")
+
         return documents
     
     def _enhance_metadata(self, doc: Document):
@@ -164,10 +206,13 @@ class DataPreparationModule:
         logger.info(f"Markdown分块完成，共生成 {len(chunks)} 个chunk")
         return chunks
 
-    def _markdown_header_split(self) -> List[Document]:
+    def _markdown_header_split(self, documents: List[Document] = None) -> List[Document]:
         """
         使用Markdown标题分割器进行结构化分割
 
+        Args:
+            documents: 待分割的父文档，默认使用已加载的全部文档
+
         Returns:
             按标题结构分割的文档列表
         """
@@ -186,7 +231,7 @@ class DataPreparationModule:
 
         all_chunks = []
 
-        for doc in self.documents:
+        for doc in (self.documents if documents is None else documents):
             try:
                 # 检查文档内容是否包含Markdown标题
                 content_preview = doc.page_content[:200]
@@ -312,6 +357,41 @@ class DataPreparationModule:
         
         logger.info(f"元数据已导出到: {output_path}")
 
+    def save_corpus(self, output_path: str):
+        """
+        保存父文档、子块及映射关系，供其他进程直接加载
+
+        Args:
+            output_path: 输出文件路径
+        """
+        import pickle
+
+        with open(output_path, 'wb') as f:
+            pickle.dump({
+                'documents': self.documents,
+                'chunks': self.chunks,
+                'parent_child_map': self.parent_child_map
+            }, f)
+
+        logger.info(f"语料已保存到: {output_path}")
+
+    def load_corpus(self, input_path: str):
+        """
+        加载 save_corpus 保存的语料，保证子块与向量索引一一对应
+
+        Args:
+            input_path: 语料文件路径
+        """
+        import pickle
+
+        with open(input_path, 'rb') as f:
+            corpus = pickle.load(f)
+
+        self.documents = corpus['documents']
+        self.chunks = corpus['chunks']
+        self.parent_child_map = corpus['parent_child_map']
+        logger.info(f"已从 {input_path} 加载 {len(self.documents)} 个文档, {len(self.chunks)} 个chunk")
+
     def get_parent_documents(self, child_chunks: List[Document]) -> List[Document]:
         """
         根据子块获取对应的父文档（智能去重）
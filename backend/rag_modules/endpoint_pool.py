@@ -0,0 +1,223 @@
+"""
+上游端点池 - 在多个 OpenAI 兼容端点间按健康状况与首 token 延迟选路，并对短调用做对冲请求
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from contextlib import nullcontext
+from typing import Any, AsyncContextManager, AsyncIterator, Awaitable, Callable, List, Optional
+
+from core.metrics import metrics
+from .upstream_scheduler import retry_reason
+
+logger = logging.getLogger(__name__)
+
+# 以端点为参数返回排队上下文（上游调度器的限流令牌与并发槽位）
+Admission = Callable[['Endpoint'], AsyncContextManager]
+
+
+class Endpoint:
+    """单个上游端点的延迟与健康状态"""
+
+    def __init__(self, url: str, ewma_alpha: float = 0.3, window: int = 200):
+        self.url = url.rstrip("/")
+        self.ewma_alpha = ewma_alpha
+        self.ewma_ttft: Optional[float] = None
+        self.samples = deque(maxlen=window)
+        self.inflight = 0
+        self.consecutive_failures = 0
+        self.unhealthy_until = 0.0
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.unhealthy_until
+
+    def score(self) -> float:
+        """选路得分，越小越优先；没有样本的端点得分为 0，会先被探测"""
+        if self.ewma_ttft is None:
+            return 0.0
+        # 进行中的请求越多、最近连续失败越多，预期延迟越高
+        return self.ewma_ttft * (1 + 0.1 * self.inflight) * (1 + self.consecutive_failures)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+    def record_success(self, ttft: Optional[float]):
+        self.consecutive_failures = 0
+        if ttft is None:
+            return
+        self.samples.append(ttft)
+        self.ewma_ttft = ttft if self.ewma_ttft is None else \
+            self.ewma_alpha * ttft + (1 - self.ewma_alpha) * self.ewma_ttft
+        metrics.set_gauge("llm_endpoint_ttft_ewma_seconds", self.ewma_ttft, endpoint=self.url)
+
+    def record_failure(self, threshold: int, cooldown: float):
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= threshold:
+            # 熔断一段时间，到期后重新参与选路（半开探测）
+            self.unhealthy_until = time.monotonic() + cooldown
+            metrics.inc("llm_endpoint_ejections_total", endpoint=self.url)
+            logger.warning(f"上游端点 {self.url} 连续失败 {self.consecutive_failures} 次，摘除 {cooldown:.0f}s")
+
+
+class EndpointPool:
+    """多个上游端点组成的池，单端点时退化为直连"""
+
+    def __init__(self, urls: List[str], ewma_alpha: float = 0.3, failure_threshold: int = 3,
+                 cooldown_seconds: float = 30.0, hedge_quantile: float = 0.95,
+                 hedge_min_delay: float = 0.05, hedge_default_delay: float = 1.0, hedge_min_samples: int = 20):
+        """
+        初始化端点池
+
+        Args:
+            urls: 端点 base_url 列表
+            ewma_alpha: 首 token 延迟 EWMA 的平滑系数
+            failure_threshold: 连续失败多少次后摘除端点
+            cooldown_seconds: 摘除时长
+            hedge_quantile: 对冲延迟取主端点延迟的分位数
+            hedge_min_delay: 对冲延迟下限（秒）
+            hedge_default_delay: 样本不足时的对冲延迟（秒）
+            hedge_min_samples: 使用分位数所需的最少样本数
+        """
+        if not urls:
+            raise ValueError("至少需要一个上游端点")
+        self.endpoints = [Endpoint(url, ewma_alpha) for url in dict.fromkeys(urls)]
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_default_delay = hedge_default_delay
+        self.hedge_min_samples = hedge_min_samples
+
+    @classmethod
+    def from_env(cls, urls: Optional[List[str]] = None, **kwargs) -> 'EndpointPool':
+        """
+        按配置或环境变量创建端点池：LLM_BASE_URLS（逗号分隔）优先，否则使用 LLM_BASE_URL
+
+        Args:
+            urls: 显式指定的端点列表
+        """
+        if not urls:
+            urls = [u.strip() for u in os.getenv("LLM_BASE_URLS", "").split(",") if u.strip()]
+        if not urls:
+            urls = [os.getenv("LLM_BASE_URL", "")]
+        return cls(urls, **kwargs)
+
+    @property
+    def urls(self) -> List[str]:
+        return [endpoint.url for endpoint in self.endpoints]
+
+    def choose(self, exclude: Optional[Endpoint] = None) -> Optional[Endpoint]:
+        """选出预期首 token 延迟最低的健康端点；全部不健康时选最早恢复的端点"""
+        candidates = [e for e in self.endpoints if e is not exclude]
+        if not candidates:
+            return None
+        healthy = [e for e in candidates if e.healthy]
+        if healthy:
+            return min(healthy, key=lambda e: e.score())
+        return None if exclude else min(candidates, key=lambda e: e.unhealthy_until)
+
+    def hedge_delay(self, endpoint: Endpoint) -> float:
+        """主端点在该时长内未返回时发出对冲请求"""
+        if len(endpoint.samples) >= self.hedge_min_samples:
+            return max(endpoint.quantile(self.hedge_quantile), self.hedge_min_delay)
+        if endpoint.ewma_ttft is not None:
+            return max(endpoint.ewma_ttft * 2, self.hedge_min_delay)
+        return self.hedge_default_delay
+
+    def _record_error(self, endpoint: Endpoint, error: Exception):
+        # 只有上游侧的错误（限流、5xx、超时、连接失败）计入端点健康
+        if retry_reason(error) is not None:
+            endpoint.record_failure(self.failure_threshold, self.cooldown_seconds)
+
+    async def _call(self, endpoint: Endpoint, call: Callable[[Endpoint], Awaitable[Any]], track_latency: bool,
+                    admit: Optional[Admission] = None):
+        async with admit(endpoint) if admit else nullcontext():
+            # 排队时间不计入端点延迟
+            endpoint.inflight += 1
+            start = time.perf_counter()
+            try:
+                result = await call(endpoint)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._record_error(endpoint, e)
+                raise
+            finally:
+                endpoint.inflight -= 1
+        endpoint.record_success(time.perf_counter() - start if track_latency else None)
+        return result
+
+    async def run(self, call: Callable[[Endpoint], Awaitable[Any]], hedge: bool = False,
+                  track_latency: bool = True, admit: Optional[Admission] = None) -> Any:
+        """
+        在选中的端点上执行非流式调用
+
+        Args:
+            call: 以端点为参数发起调用的协程函数
+            hedge: 主端点超过对冲延迟未返回时，向次优端点再发一份，先返回者胜出
+            track_latency: 是否将耗时计入端点延迟（只应对输出很短的调用开启）
+            admit: 每次端点调用（含对冲请求）前的排队，为空时直接调用
+
+        Returns:
+            调用结果
+        """
+        primary = self.choose()
+        secondary = self.choose(exclude=primary) if hedge else None
+        if secondary is None:
+            return await self._call(primary, call, track_latency, admit)
+
+        tasks = {asyncio.ensure_future(self._call(primary, call, track_latency, admit)): "primary"}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay(primary))
+            if not done:
+                tasks[asyncio.ensure_future(self._call(secondary, call, track_latency, admit))] = "hedge"
+                metrics.inc("llm_hedged_requests_total")
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        metrics.inc("llm_hedge_winner_total", winner=tasks[task])
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            losers = [task for task in tasks if not task.done()]
+            for task in losers:
+                task.cancel()
+            # 等落败的调用退出，确保其并发槽位在返回前已归还
+            await asyncio.gather(*losers, return_exceptions=True)
+
+    async def stream(self, call: Callable[[Endpoint], AsyncIterator[Any]],
+                     admit: Optional[Admission] = None) -> AsyncIterator[Any]:
+        """
+        在选中的端点上执行流式调用，以首个分块到达的时间更新端点延迟
+
+        Args:
+            call: 以端点为参数返回分块异步迭代器的函数
+            admit: 调用前的排队，为空时直接调用
+        """
+        endpoint = self.choose()
+        async with admit(endpoint) if admit else nullcontext():
+            endpoint.inflight += 1
+            start = time.perf_counter()
+            first = True
+            try:
+                async for chunk in call(endpoint):
+                    if first:
+                        endpoint.record_success(time.perf_counter() - start)
+                        first = False
+                    yield chunk
+            except Exception as e:
+                self._record_error(endpoint, e)
+                raise
+            finally:
+                endpoint.inflight -= 1
@@ -4,22 +4,56 @@
 
 import os
 import logging
-from typing import List
+import time
+from typing import Any, Dict, List, Optional
 
 from langchain_core.prompts import ChatPromptTemplate, PromptTemplate
 from langchain_openai import ChatOpenAI
 from langchain_core.documents import Document
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import Runnable
 from langchain_core.output_parsers import StrOutputParser
 
+from core.http_client import get_async_http_client, get_http_client
+from core.metrics import metrics
 from core.prompts import PromptTemplates
+from .endpoint_pool import EndpointPool
+from .upstream_scheduler import PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL, UpstreamScheduler
 
 logger = logging.getLogger(__name__)
 
 class GenerationIntegrationModule:
     """生成集成模块 - 负责LLM集成和回答生成"""
+
+    # 路由类型对应的回答链（list 路由直接拼接菜名，不经过LLM）
+    ROUTE_CHAINS = {
+        'general': 'basic_answer',
+        'detail': 'step_by_step',
+        'chat': 'chat_answer'
+    }
+
+    # 每条链所属的生成阶段，阶段决定使用的模型分级与生成参数
+    CHAIN_STAGES = {
+        'basic_answer': 'general',
+        'step_by_step': 'detail',
+        'chat_answer': 'chat',
+        'query_rewrite': 'rewrite',
+        'query_router': 'router',
+        'conversation_summary': 'summary'
+    }
+
+    # 各阶段在上游调度队列中的优先级：路由与重写阻塞整个请求且输出很短，最先执行
+    STAGE_PRIORITY = {
+        'router': PRIORITY_HIGH,
+        'rewrite': PRIORITY_HIGH,
+        'chat': PRIORITY_NORMAL,
+        'general': PRIORITY_LOW,
+        'detail': PRIORITY_LOW,
+        'summary': PRIORITY_LOW
+    }
     
-    def __init__(self, model_name: str = "Qwen/Qwen2.5-7B-Instruct", temperature: float = 0.1, max_tokens: int = 2048):
+    def __init__(self, model_name: str = "Qwen/Qwen2.5-7B-Instruct", temperature: float = 0.1, max_tokens: int = 2048,
+                 model_tiers: Dict[str, Dict[str, Any]] = None, stage_settings: Dict[str, Dict[str, Any]] = None,
+                 scheduler: UpstreamScheduler = None, endpoint_pool: EndpointPool = None):
         """
         初始化生成集成模块
         
@@ -27,33 +61,222 @@ class GenerationIntegrationModule:
             model_name: 模型名称（硅基流动支持的模型）
             temperature: 生成温度
             max_tokens: 最大token数
+            model_tiers: 模型分级，如 {"small": {"model": ..., "timeout": 20}}，model 为空时读取 model_env
+                指定的环境变量，仍为空则使用 model_name；为空时只有一个默认分级
+            stage_settings: 各阶段（router/rewrite/chat/general/detail/summary）的分级、max_tokens、是否流式与是否对冲
+            scheduler: 上游调度器（并发上限、限流与重试），为空时使用默认参数创建
+            endpoint_pool: 上游端点池，为空时按环境变量 LLM_BASE_URLS / LLM_BASE_URL 创建
         """
         self.model_name = model_name
         self.temperature = temperature
         self.max_tokens = max_tokens
+        self.model_tiers = model_tiers or {
+            "default": {"model": model_name, "timeout": float(os.getenv("LLM_TIMEOUT", 60))}
+        }
+        default_tier = next(iter(self.model_tiers))
+        self.stage_settings = {
+            stage: {"tier": default_tier, "max_tokens": max_tokens, "streaming": True, "hedge": False}
+            for stage in self.CHAIN_STAGES.values()
+        }
+        for stage, settings in (stage_settings or {}).items():
+            self.stage_settings.setdefault(stage, {}).update(settings)
+        self.scheduler = scheduler or UpstreamScheduler()
+        self.endpoint_pool = endpoint_pool or EndpointPool.from_env()
         self.llm = None
+        self.llms: Dict[str, ChatOpenAI] = {}
+        # 阶段 -> 端点 -> 模型；分级配置了固定 base_url 的阶段不参与端点选路
+        self.endpoint_llms: Dict[str, Dict[str, ChatOpenAI]] = {}
+        self.chains: Dict[str, Runnable] = {}
+        self.endpoint_chains: Dict[str, Dict[str, Runnable]] = {}
         self.setup_llm()
     
     def setup_llm(self):
-        """初始化大语言模型"""
+        """按阶段初始化大语言模型，同一分级的各阶段只在 max_tokens 上有区别"""
         logger.info(f"正在初始化LLM: {self.model_name}")
 
         api_key = os.getenv("LLM_API_KEY")
         if not api_key:
             raise ValueError("请设置 LLM_API_KEY 环境变量")
 
-        self.llm = ChatOpenAI(
-            model=self.model_name,
-            temperature=self.temperature,
-            max_tokens=self.max_tokens,
-            api_key=api_key,
-            base_url=os.getenv("LLM_BASE_URL"),
-            timeout=float(os.getenv("LLM_TIMEOUT", 60))
-        )
+        for stage, settings in self.stage_settings.items():
+            tier = self.model_tiers[settings["tier"]]
+            urls = [tier["base_url"]] if tier.get("base_url") else self.endpoint_pool.urls
+            llms = {
+                url: ChatOpenAI(
+                    model=tier.get("model") or os.getenv(tier.get("model_env", ""), "") or self.model_name,
+                    temperature=tier.get("temperature", self.temperature),
+                    max_tokens=settings.get("max_tokens", self.max_tokens),
+                    api_key=api_key,
+                    base_url=url,
+                    timeout=float(tier.get("timeout", os.getenv("LLM_TIMEOUT", 60))),
+                    streaming=settings.get("streaming", True),
+                    # 重试由上游调度器统一处理（退避期间不占用并发槽位，并遵循 Retry-After）
+                    max_retries=0,
+                    # 复用进程级连接池，避免每次调用重新握手
+                    http_client=get_http_client(),
+                    http_async_client=get_async_http_client()
+                )
+                for url in urls
+            }
+            self.llms[stage] = llms[urls[0]]
+            if not tier.get("base_url"):
+                self.endpoint_llms[stage] = llms
+            logger.info(f"阶段 {stage}: 分级 {settings['tier']}, 模型 {self.llms[stage].model_name}, "
+                        f"max_tokens {settings.get('max_tokens')}, 端点 {len(urls)} 个")
+        self.llm = self.llms["detail"]
         
+        self.build_chains()
         logger.info("LLM初始化完成")
+
+    def build_chains(self):
+        """
+        预先构建所有LCEL链，模板只解析一次；
+        每次请求的问题、上下文与历史作为输入字典传入，不再创建闭包
+        """
+        prompts = {
+            'basic_answer': ChatPromptTemplate.from_template(PromptTemplates.BASIC_ANSWER_TEMPLATE),
+            'step_by_step': ChatPromptTemplate.from_template(PromptTemplates.STEP_BY_STEP_TEMPLATE),
+            'chat_answer': ChatPromptTemplate.from_template(PromptTemplates.CHAT_ANSWER_TEMPLATE),
+            'query_rewrite': PromptTemplate(
+                template=PromptTemplates.QUERY_REWRITE_TEMPLATE,
+                input_variables=["query", "chat_history"]
+            ),
+            'query_router': ChatPromptTemplate.from_template(PromptTemplates.QUERY_ROUTER_TEMPLATE),
+            'conversation_summary': ChatPromptTemplate.from_template(PromptTemplates.CONVERSATION_SUMMARY_TEMPLATE)
+        }
+        self.prompts = prompts
+        self.chains = {
+            name: prompt | self.llms.get(self.CHAIN_STAGES[name], self.llm) | StrOutputParser()
+            for name, prompt in prompts.items()
+        }
+        self.endpoint_chains = {
+            url: {
+                name: prompt | self.endpoint_llms[self.CHAIN_STAGES[name]][url] | StrOutputParser()
+                for name, prompt in prompts.items()
+                if self.CHAIN_STAGES[name] in self.endpoint_llms
+            }
+            for url in self.endpoint_pool.urls
+        }
+
+    def get_chain(self, route: str) -> Runnable:
+        """
+        按路由类型获取回答链
+
+        Args:
+            route: 路由类型（general/detail/chat），未知类型使用基础回答链
+
+        Returns:
+            预构建的LCEL链
+        """
+        return self.chains[self.ROUTE_CHAINS.get(route, 'basic_answer')]
+
+    def _labels(self, name: str) -> Dict[str, str]:
+        stage = self.CHAIN_STAGES[name]
+        return {"stage": stage, "tier": self.stage_settings.get(stage, {}).get("tier", "default")}
+
+    def _schedule_args(self, name: str):
+        stage = self.CHAIN_STAGES[name]
+        model = getattr(self.llms.get(stage, self.llm), "model_name", stage)
+        return model, self.STAGE_PRIORITY.get(stage, PRIORITY_LOW)
+
+    def _pooled(self, name: str) -> bool:
+        return name in next(iter(self.endpoint_chains.values()), {})
+
+    def _chain(self, name: str, url: str = None, max_tokens: int = None) -> Runnable:
+        """取预构建的链；请求因截止时间缩短输出时，临时绑定更小的 max_tokens"""
+        if max_tokens is None:
+            return self.endpoint_chains[url][name] if url else self.chains[name]
+        stage = self.CHAIN_STAGES[name]
+        llm = self.endpoint_llms[stage][url] if url else self.llms.get(stage, self.llm)
+        return self.prompts[name] | llm.bind(max_tokens=max_tokens) | StrOutputParser()
+
+    def _admission(self, name: str):
+        """端点池中每次端点调用（含对冲请求）按 (模型, 端点) 经调度器排队"""
+        model, priority = self._schedule_args(name)
+        return lambda endpoint: self.scheduler.admission(model, priority, endpoint.url)
+
+    def _call_once(self, name: str, inputs: Dict[str, Any], max_tokens: int = None):
+        """单次非流式调用：经端点池选路，短调用可对冲"""
+        if not self._pooled(name):
+            return self._chain(name, max_tokens=max_tokens).ainvoke(inputs)
+        hedge = self.stage_settings.get(self.CHAIN_STAGES[name], {}).get("hedge", False)
+        return self.endpoint_pool.run(
+            lambda endpoint: self._chain(name, endpoint.url, max_tokens).ainvoke(inputs),
+            hedge=hedge,
+            # 只有输出很短的调用，其总耗时才能近似首 token 延迟
+            track_latency=hedge,
+            admit=self._admission(name)
+        )
+
+    def _stream_once(self, name: str, inputs: Dict[str, Any], max_tokens: int = None):
+        """单次流式调用：经端点池选路，首个分块的到达时间计入端点延迟"""
+        if not self._pooled(name):
+            return self._chain(name, max_tokens=max_tokens).astream(inputs)
+        return self.endpoint_pool.stream(
+            lambda endpoint: self._chain(name, endpoint.url, max_tokens).astream(inputs),
+            admit=self._admission(name)
+        )
+
+    def stage_max_tokens(self, route: str) -> int:
+        """路由对应回答阶段配置的 max_tokens"""
+        stage = self.CHAIN_STAGES[self.ROUTE_CHAINS.get(route, 'basic_answer')]
+        return self.stage_settings.get(stage, {}).get("max_tokens", self.max_tokens)
+
+    def _ensure_http_clients(self):
+        """
+        共享连接池被关闭后（如应用生命周期结束后在同一进程内重新启动），
+        已构建的 ChatOpenAI 仍持有旧客户端，此时按新的共享客户端重建模型与链
+        """
+        clients = (getattr(self.llm, "http_async_client", None), getattr(self.llm, "http_client", None))
+        if any(client is not None and client.is_closed for client in clients):
+            logger.info("共享 HTTP 客户端已关闭，重新初始化LLM")
+            self.setup_llm()
+
+    def _invoke(self, name: str, inputs: Dict[str, Any]) -> str:
+        """同步调用链并记录分级延迟（仅供离线脚本使用，不经过上游调度器）"""
+        self._ensure_http_clients()
+        start = time.perf_counter()
+        try:
+            return self.chains[name].invoke(inputs)
+        finally:
+            metrics.observe("llm_latency_seconds", time.perf_counter() - start, **self._labels(name))
+
+    async def _ainvoke(self, name: str, inputs: Dict[str, Any], max_tokens: int = None) -> str:
+        """异步调用链并记录分级延迟"""
+        self._ensure_http_clients()
+        start = time.perf_counter()
+        try:
+            # 端点池调用在选定端点后排队，调度器这里只负责重试
+            return await self.scheduler.run(
+                *self._schedule_args(name), lambda: self._call_once(name, inputs, max_tokens),
+                admit=not self._pooled(name)
+            )
+        finally:
+            metrics.observe("llm_latency_seconds", time.perf_counter() - start, **self._labels(name))
+
+    async def _astream(self, name: str, inputs: Dict[str, Any], max_tokens: int = None):
+        """流式调用链并记录首 token 延迟与总延迟；阶段关闭流式时一次性返回"""
+        labels = self._labels(name)
+        if not self.stage_settings.get(labels["stage"], {}).get("streaming", True):
+            yield await self._ainvoke(name, inputs, max_tokens)
+            return
+        self._ensure_http_clients()
+        start = time.perf_counter()
+        first = True
+        try:
+            stream = self.scheduler.stream(
+                *self._schedule_args(name), lambda: self._stream_once(name, inputs, max_tokens),
+                admit=not self._pooled(name)
+            )
+            async for chunk in stream:
+                if first:
+                    metrics.observe("llm_ttft_seconds", time.perf_counter() - start, **labels)
+                    first = False
+                yield chunk
+        finally:
+            metrics.observe("llm_latency_seconds", time.perf_counter() - start, **labels)
     
-    def generate_basic_answer(self, query: str, context_docs: List[Document], chat_history: str = "") -> str:
+    def generate_basic_answer(self, query: str, context_docs: List[Document], chat_history: str = "", context: str = None) -> str:
         """
         生成基础回答
 
@@ -61,30 +284,41 @@ class GenerationIntegrationModule:
             query: 用户查询
             context_docs: 上下文文档列表
             chat_history: 聊天历史字符串
+            context: 预先构建的上下文（为空时由 context_docs 构建）
 
         Returns:
             生成的回答
         """
-        context = self._build_context(context_docs)
-
-        prompt = ChatPromptTemplate.from_template(PromptTemplates.BASIC_ANSWER_TEMPLATE)
+        context = self._resolve_context(context, context_docs)
+        return self._invoke('basic_answer', {
+            "question": query,
+            "context": context,
+            "chat_history": chat_history
+        })
+
+    async def agenerate_basic_answer(self, query: str, context_docs: List[Document], chat_history: str = "", context: str = None,
+                                     max_tokens: int = None) -> str:
+        """
+        生成基础回答 - 异步版本，经过上游调度器
 
-        # 使用LCEL构建链
-        chain = (
-            {
-                "question": RunnablePassthrough(), 
-                "context": lambda _: context,
-                "chat_history": lambda _: chat_history
-            }
-            | prompt
-            | self.llm
-            | StrOutputParser()
-        )
+        Args:
+            query: 用户查询
+            context_docs: 上下文文档列表
+            chat_history: 聊天历史字符串
+            context: 预先构建的上下文（为空时由 context_docs 构建）
+            max_tokens: 覆盖阶段配置的最大生成长度（截止时间临近时缩短回答）
 
-        response = chain.invoke(query)
-        return response
-    
-    def generate_step_by_step_answer(self, query: str, context_docs: List[Document], chat_history: str = "") -> str:
+        Returns:
+            生成的回答
+        """
+        context = self._resolve_context(context, context_docs)
+        return await self._ainvoke('basic_answer', {
+            "question": query,
+            "context": context,
+            "chat_history": chat_history
+        }, max_tokens)
+
+    def generate_step_by_step_answer(self, query: str, context_docs: List[Document], chat_history: str = "", context: str = None) -> str:
         """
         生成分步骤回答
 
@@ -92,28 +326,40 @@ class GenerationIntegrationModule:
             query: 用户查询
             context_docs: 上下文文档列表
             chat_history: 聊天历史字符串
+            context: 预先构建的上下文（为空时由 context_docs 构建）
 
         Returns:
             分步骤的详细回答
         """
-        context = self._build_context(context_docs)
+        context = self._resolve_context(context, context_docs)
+        return self._invoke('step_by_step', {
+            "question": query,
+            "context": context,
+            "chat_history": chat_history
+        })
+    
+    async def agenerate_step_by_step_answer(self, query: str, context_docs: List[Document], chat_history: str = "", context: str = None,
+                                            max_tokens: int = None) -> str:
+        """
+        生成分步骤回答 - 异步版本，经过上游调度器
 
-        prompt = ChatPromptTemplate.from_template(PromptTemplates.STEP_BY_STEP_TEMPLATE)
+        Args:
+            query: 用户查询
+            context_docs: 上下文文档列表
+            chat_history: 聊天历史字符串
+            context: 预先构建的上下文（为空时由 context_docs 构建）
+            max_tokens: 覆盖阶段配置的最大生成长度（截止时间临近时缩短回答）
 
-        chain = (
-            {
-                "question": RunnablePassthrough(), 
-                "context": lambda _: context,
-                "chat_history": lambda _: chat_history
-            }
-            | prompt
-            | self.llm
-            | StrOutputParser()
-        )
+        Returns:
+            分步骤的详细回答
+        """
+        context = self._resolve_context(context, context_docs)
+        return await self._ainvoke('step_by_step', {
+            "question": query,
+            "context": context,
+            "chat_history": chat_history
+        }, max_tokens)
 
-        response = chain.invoke(query)
-        return response
-    
     def query_rewrite(self, query: str, chat_history: str = "") -> str:
         """
         智能查询重写 - 让大模型判断是否需要重写查询
@@ -125,24 +371,31 @@ class GenerationIntegrationModule:
         Returns:
             重写后的查询或原查询
         """
-        prompt = PromptTemplate(
-            template=PromptTemplates.QUERY_REWRITE_TEMPLATE,
-            input_variables=["query", "chat_history"]
-        )
+        inputs = {"query": query, "chat_history": chat_history}
+        response = self._invoke('query_rewrite', inputs).strip()
 
-        chain = (
-            {
-                "query": RunnablePassthrough(),
-                "chat_history": lambda _: chat_history
-            }
-            | prompt
-            | self.llm
-            | StrOutputParser()
-        )
+        # 记录重写结果
+        if response != query:
+            logger.info(f"查询已重写: '{query}' → '{response}'")
+        else:
+            logger.info(f"查询无需重写: '{query}'")
 
-        response = chain.invoke(query).strip()
+        return response
+
+    async def aquery_rewrite(self, query: str, chat_history: str = "") -> str:
+        """
+        智能查询重写 - 异步版本，便于与路由、检索并发执行
+
+        Args:
+            query: 原始查询
+            chat_history: 聊天历史
+
+        Returns:
+            重写后的查询或原查询
+        """
+        inputs = {"query": query, "chat_history": chat_history}
+        response = (await self._ainvoke('query_rewrite', inputs)).strip()
 
-        # 记录重写结果
         if response != query:
             logger.info(f"查询已重写: '{query}' → '{response}'")
         else:
@@ -150,7 +403,22 @@ class GenerationIntegrationModule:
 
         return response
 
+    async def aquery_router(self, query: str) -> str:
+        """
+        查询路由 - 异步版本
 
+        Args:
+            query: 用户查询
+
+        Returns:
+            路由类型 ('list', 'detail', 'general', 'chat')
+        """
+        result = (await self._ainvoke('query_router', {"query": query})).strip().lower()
+
+        if result in ['list', 'detail', 'general', 'chat']:
+            return result
+        else:
+            return 'general'
 
     def query_router(self, query: str) -> str:
         """
@@ -162,16 +430,7 @@ class GenerationIntegrationModule:
         Returns:
             路由类型 ('list', 'detail', 'general')
         """
-        prompt = ChatPromptTemplate.from_template(PromptTemplates.QUERY_ROUTER_TEMPLATE)
-
-        chain = (
-            {"query": RunnablePassthrough()}
-            | prompt
-            | self.llm
-            | StrOutputParser()
-        )
-
-        result = chain.invoke(query).strip().lower()
+        result = self._invoke('query_router', {"query": query}).strip().lower()
 
         # 确保返回有效的路由类型
         if result in ['list', 'detail', 'general', 'chat']:
@@ -245,7 +504,8 @@ class GenerationIntegrationModule:
                 yield f"{i+1}. {name}\n"
             yield f"\n还有其他 {len(dish_names)-3} 道菜品可供选择。"
 
-    async def generate_basic_answer_stream(self, query: str, context_docs: List[Document], chat_history: str = ""):
+    async def generate_basic_answer_stream(self, query: str, context_docs: List[Document], chat_history: str = "", context: str = None,
+                                           max_tokens: int = None):
         """
         生成基础回答 - 流式输出
 
@@ -253,29 +513,20 @@ class GenerationIntegrationModule:
             query: 用户查询
             context_docs: 上下文文档列表
             chat_history: 聊天历史字符串
+            context: 预先构建的上下文（为空时由 context_docs 构建）
+            max_tokens: 覆盖阶段配置的最大生成长度（截止时间临近时缩短回答）
 
         Yields:
             生成的回答片段
         """
-        context = self._build_context(context_docs)
-
-        prompt = ChatPromptTemplate.from_template(PromptTemplates.BASIC_ANSWER_TEMPLATE)
+        context = self._resolve_context(context, context_docs)
+        inputs = {"question": query, "context": context, "chat_history": chat_history}
 
-        chain = (
-            {
-                "question": RunnablePassthrough(), 
-                "context": lambda _: context,
-                "chat_history": lambda _: chat_history
-            }
-            | prompt
-            | self.llm
-            | StrOutputParser()
-        )
-
-        async for chunk in chain.astream(query):
+        async for chunk in self._astream('basic_answer', inputs, max_tokens):
             yield chunk
 
-    async def generate_step_by_step_answer_stream(self, query: str, context_docs: List[Document], chat_history: str = ""):
+    async def generate_step_by_step_answer_stream(self, query: str, context_docs: List[Document], chat_history: str = "", context: str = None,
+                                                  max_tokens: int = None):
         """
         生成详细步骤回答 - 流式输出
 
@@ -283,26 +534,16 @@ class GenerationIntegrationModule:
             query: 用户查询
             context_docs: 上下文文档列表
             chat_history: 聊天历史字符串
+            context: 预先构建的上下文（为空时由 context_docs 构建）
+            max_tokens: 覆盖阶段配置的最大生成长度（截止时间临近时缩短回答）
 
         Yields:
             详细步骤回答片段
         """
-        context = self._build_context(context_docs)
-        # print("context:", context)
-        prompt = ChatPromptTemplate.from_template(PromptTemplates.STEP_BY_STEP_TEMPLATE)
-        # print("prompt:", prompt)
-        chain = (
-            {
-                "question": RunnablePassthrough(), 
-                "context": lambda _: context,
-                "chat_history": lambda _: chat_history
-            }
-            | prompt
-            | self.llm
-            | StrOutputParser()
-        )
+        context = self._resolve_context(context, context_docs)
+        inputs = {"question": query, "context": context, "chat_history": chat_history}
 
-        async for chunk in chain.astream(query):
+        async for chunk in self._astream('step_by_step', inputs, max_tokens):
             yield chunk
 
     def generate_chat_answer(self, query: str, chat_history: str = "") -> str:
@@ -316,39 +557,42 @@ class GenerationIntegrationModule:
         Returns:
             回答
         """
-        prompt = ChatPromptTemplate.from_template(PromptTemplates.CHAT_ANSWER_TEMPLATE)
-        
-        chain = (
-            {
-                "question": RunnablePassthrough(),
-                "chat_history": lambda _: chat_history
-            }
-            | prompt
-            | self.llm
-            | StrOutputParser()
-        )
-        
-        return chain.invoke(query)
+        inputs = {"question": query, "chat_history": chat_history}
+        return self._invoke('chat_answer', inputs)
+
+    async def agenerate_chat_answer(self, query: str, chat_history: str = "", max_tokens: int = None) -> str:
+        """
+        生成闲聊回答 - 异步版本，经过上游调度器
+        """
+        inputs = {"question": query, "chat_history": chat_history}
+        return await self._ainvoke('chat_answer', inputs, max_tokens)
 
-    async def generate_chat_answer_stream(self, query: str, chat_history: str = ""):
+    async def generate_chat_answer_stream(self, query: str, chat_history: str = "", max_tokens: int = None):
         """
         生成闲聊回答 - 流式
         """
-        prompt = ChatPromptTemplate.from_template(PromptTemplates.CHAT_ANSWER_TEMPLATE)
-        
-        chain = (
-            {
-                "question": RunnablePassthrough(),
-                "chat_history": lambda _: chat_history
-            }
-            | prompt
-            | self.llm
-            | StrOutputParser()
-        )
-        
-        async for chunk in chain.astream(query):
+        inputs = {"question": query, "chat_history": chat_history}
+        async for chunk in self._astream('chat_answer', inputs, max_tokens):
             yield chunk
 
+    async def asummarize_conversation(self, summary: str, conversation: str) -> str:
+        """
+        把已有摘要与新增对话合并为新的会话摘要（后台任务，低优先级排队）
+
+        Args:
+            summary: 已有摘要，可为空
+            conversation: 新增对话文本
+
+        Returns:
+            新的摘要
+        """
+        inputs = {"summary": summary or "（无）", "conversation": conversation}
+        return (await self._ainvoke('conversation_summary', inputs)).strip()
+
+    def _resolve_context(self, context: Optional[str], docs: List[Document]) -> str:
+        """调用方已按 token 预算构建好上下文时直接使用，否则按字符长度从文档拼装"""
+        return context if context is not None else self._build_context(docs)
+
     def _build_context(self, docs: List[Document], max_length: int = 2000) -> str:
         """
         构建上下文字符串
@@ -379,9 +623,9 @@ class GenerationIntegrationModule:
             # 构建文档文本
             doc_text = f"{metadata_info}\n{doc.page_content}\n"
             
-            # 检查长度限制
+            # 检查长度限制，放不下的文档跳过，后面较短的文档仍可放入
             if current_length + len(doc_text) > max_length:
-                break
+                continue
             
             context_parts.append(doc_text)
             current_length += len(doc_text)
@@ -3,7 +3,7 @@
 """
 
 import logging
-from typing import List
+from typing import List, Callable, Optional, Set
 from pathlib import Path
 
 from langchain_huggingface import HuggingFaceEmbeddings
@@ -15,19 +15,22 @@ logger = logging.getLogger(__name__)
 class IndexConstructionModule:
     """索引构建模块 - 负责向量化和索引构建"""
 
-    def __init__(self, model_name: str = "BAAI/bge-small-zh-v1.5", index_save_path: str = "./vector_index"):
+    def __init__(self, model_name: str = "BAAI/bge-small-zh-v1.5", index_save_path: str = "./vector_index",
+                 embeddings: Optional[HuggingFaceEmbeddings] = None):
         """
         初始化索引构建模块
 
         Args:
             model_name: 嵌入模型名称
             index_save_path: 索引保存路径
+            embeddings: 复用已加载的嵌入模型（为空时重新加载）
         """
         self.model_name = model_name
         self.index_save_path = index_save_path
-        self.embeddings = None
+        self.embeddings = embeddings
         self.vectorstore = None
-        self.setup_embeddings()
+        if self.embeddings is None:
+            self.setup_embeddings()
     
     def setup_embeddings(self):
         """初始化嵌入模型"""
@@ -41,12 +44,16 @@ class IndexConstructionModule:
         
         logger.info("嵌入模型初始化完成")
     
-    def build_vector_index(self, chunks: List[Document]) -> FAISS:
+    def build_vector_index(self, chunks: List[Document],
+                           progress_callback: Optional[Callable[[int, int], None]] = None,
+                           batch_size: int = 64) -> FAISS:
         """
         构建向量索引
         
         Args:
             chunks: 文档块列表
+            progress_callback: 进度回调，参数为(已向量化数量, 总数量)
+            batch_size: 每批向量化的文档块数量
             
         Returns:
             FAISS向量存储对象
@@ -56,10 +63,19 @@ class IndexConstructionModule:
         if not chunks:
             raise ValueError("文档块列表不能为空")
         
+        # 分批向量化，便于上报构建进度
+        texts = [chunk.page_content for chunk in chunks]
+        vectors = []
+        for start in range(0, len(texts), batch_size):
+            vectors.extend(self.embeddings.embed_documents(texts[start:start + batch_size]))
+            if progress_callback:
+                progress_callback(len(vectors), len(texts))
+
         # 构建FAISS向量存储
-        self.vectorstore = FAISS.from_documents(
-            documents=chunks,
-            embedding=self.embeddings
+        self.vectorstore = FAISS.from_embeddings(
+            text_embeddings=list(zip(texts, vectors)),
+            embedding=self.embeddings,
+            metadatas=[chunk.metadata for chunk in chunks]
         )
         
         logger.info(f"向量索引构建完成，包含 {len(chunks)} 个向量")
@@ -79,6 +95,51 @@ class IndexConstructionModule:
         self.vectorstore.add_documents(new_chunks)
         logger.info("新文档添加完成")
 
+    def remove_documents_by_parent(self, parent_ids: Set[str]) -> int:
+        """
+        从现有索引删除属于指定父文档的所有文档块
+
+        Args:
+            parent_ids: 父文档ID集合
+
+        Returns:
+            删除的向量数量
+        """
+        if not self.vectorstore:
+            raise ValueError("请先构建向量索引")
+
+        docstore = self.vectorstore.docstore
+        doc_ids = [
+            doc_id for doc_id in self.vectorstore.index_to_docstore_id.values()
+            if docstore.search(doc_id).metadata.get('parent_id') in parent_ids
+        ]
+        if doc_ids:
+            self.vectorstore.delete(doc_ids)
+        logger.info(f"已从索引删除 {len(doc_ids)} 个向量")
+        return len(doc_ids)
+
+    def clone(self) -> 'IndexConstructionModule':
+        """
+        复制当前索引（共享嵌入模型），用于写时复制的增量更新
+
+        Returns:
+            持有独立向量索引副本的新模块
+        """
+        if not self.vectorstore:
+            raise ValueError("请先构建向量索引")
+
+        cloned = IndexConstructionModule(
+            model_name=self.model_name,
+            index_save_path=self.index_save_path,
+            embeddings=self.embeddings
+        )
+        cloned.vectorstore = FAISS.deserialize_from_bytes(
+            self.vectorstore.serialize_to_bytes(),
+            self.embeddings,
+            allow_dangerous_deserialization=True
+        )
+        return cloned
+
     def save_index(self):
         """
         保存向量索引到配置的路径
@@ -92,10 +153,13 @@ class IndexConstructionModule:
         self.vectorstore.save_local(self.index_save_path)
         logger.info(f"向量索引已保存到: {self.index_save_path}")
     
-    def load_index(self):
+    def load_index(self, mmap: bool = False):
         """
         从配置的路径加载向量索引
 
+        Args:
+            mmap: 是否以内存映射方式只读加载FAISS索引（多进程共享物理内存）
+
         Returns:
             加载的向量存储对象，如果加载失败返回None
         """
@@ -107,17 +171,45 @@ class IndexConstructionModule:
             return None
 
         try:
-            self.vectorstore = FAISS.load_local(
-                self.index_save_path,
-                self.embeddings,
-                allow_dangerous_deserialization=True
-            )
-            logger.info(f"向量索引已从 {self.index_save_path} 加载")
+            if mmap:
+                self.vectorstore = self._load_index_mmap()
+            else:
+                self.vectorstore = FAISS.load_local(
+                    self.index_save_path,
+                    self.embeddings,
+                    allow_dangerous_deserialization=True
+                )
+            logger.info(f"向量索引已从 {self.index_save_path} 加载 (mmap={mmap})")
             return self.vectorstore
         except Exception as e:
             logger.warning(f"加载向量索引失败: {e}，将构建新索引")
             return None
     
+    def _load_index_mmap(self) -> FAISS:
+        """
+        以内存映射方式读取FAISS索引，向量数据由操作系统页缓存在各进程间共享
+
+        Returns:
+            FAISS向量存储对象
+        """
+        import pickle
+        import faiss
+
+        index_dir = Path(self.index_save_path)
+        # 新版faiss支持直接映射Flat索引的向量数据，旧版退化为普通mmap标志
+        flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+        index = faiss.read_index(str(index_dir / "index.faiss"), flags)
+
+        with open(index_dir / "index.pkl", "rb") as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+
+        return FAISS(
+            embedding_function=self.embeddings,
+            index=index,
+            docstore=docstore,
+            index_to_docstore_id=index_to_docstore_id
+        )
+
     def similarity_search(self, query: str, k: int = 5) -> List[Document]:
         """
         相似度搜索
@@ -0,0 +1,85 @@
+"""
+查询重写的前置判断与结果解析
+"""
+
+import hashlib
+import re
+from typing import Tuple
+
+# 指代、省略与追问用语：出现时需要结合历史补全查询
+ANAPHORA_PATTERN = re.compile(
+    r'这个|那个|这道|那道|这些|那些|这种|那种|它|上面|刚才|刚刚|之前|前面|上一个|'
+    r'还有(吗|呢|别的|其他)|换(一|个)|别的|其他的|另一个|同样|一样的|再来|再推荐'
+)
+
+# 图片识别结果需要由重写整合到查询中
+IMAGE_MARKER = "用户上传了一张图片"
+
+# 去掉空白与标点后不超过该长度的查询视为过于宽泛（如"川菜"、"做菜"），仍交给 LLM 重写
+MIN_SELF_CONTAINED_LENGTH = 5
+
+FINAL_QUERY_PATTERN = re.compile(r'最终查询\s*[:：]\s*(.+)')
+QUOTE_CHARS = '"\'“”‘’「」『』《》`'
+
+
+def normalize_query(query: str) -> str:
+    """去掉空白与标点并转小写，用于比较和缓存键"""
+    return re.sub(r'[\s\W_]+', '', query).lower()
+
+
+def needs_rewrite(query: str, chat_history: str = "") -> Tuple[bool, str]:
+    """
+    判断查询是否需要调用 LLM 重写
+
+    Args:
+        query: 原始查询
+        chat_history: 格式化后的此前对话，不含本轮问题；本轮问题混在其中时每个查询都会被判定为 "history"
+
+    Returns:
+        (是否需要重写, 原因)
+    """
+    if IMAGE_MARKER in query:
+        return True, "image"
+    if len(normalize_query(query)) < MIN_SELF_CONTAINED_LENGTH:
+        return True, "vague"
+    if chat_history:
+        return True, "history"
+    if ANAPHORA_PATTERN.search(query):
+        return True, "anaphora"
+    return False, "self_contained"
+
+
+def rewrite_cache_key(query: str, chat_history: str = "") -> Tuple[str, str]:
+    """缓存键：(归一化查询, 聊天历史摘要)"""
+    history_digest = hashlib.md5(chat_history.encode("utf-8")).hexdigest() if chat_history else ""
+    return normalize_query(query), history_digest
+
+
+def parse_rewrite_output(output: str, original: str) -> str:
+    """
+    从 LLM 输出中提取最终查询，兼容全角/半角冒号、引号和多行说明
+
+    Args:
+        output: LLM 原始输出
+        original: 原始查询，解析失败时返回
+
+    Returns:
+        最终查询
+    """
+    text = output.strip()
+    matches = FINAL_QUERY_PATTERN.findall(text)
+    if matches:
+        text = matches[-1]
+    else:
+        lines = [line for line in text.splitlines() if line.strip()]
+        text = lines[-1] if lines else ""
+
+    # 兼容 "原查询 → 新查询" 的示例格式
+    if "→" in text:
+        text = text.split("→")[-1]
+    text = re.sub(r'（保持原查询）|\(保持原查询\)', '', text)
+    text = text.strip().strip(QUOTE_CHARS).strip()
+
+    if not text or len(text) > max(100, len(original) * 4):
+        return original
+    return text
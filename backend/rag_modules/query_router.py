@@ -0,0 +1,143 @@
+"""
+本地查询路由模块
+"""
+
+import logging
+import re
+import time
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RouteDecision:
+    """路由决策结果"""
+    route: Optional[str]      # 置信度不足时为 None，需要回退到 LLM 路由
+    confidence: float
+    source: str               # rules / classifier / llm
+    elapsed_ms: float
+    candidate: Optional[str] = None   # 置信度不足时分类器的最可能路由（时间预算不足、不调用 LLM 时使用）
+
+
+class LocalQueryRouter:
+    """本地查询路由 - 关键词规则 + 基于嵌入向量的最近质心分类器"""
+
+    ROUTES = ('list', 'detail', 'general', 'chat')
+
+    # 每条规则命中后给出的路由类型，同一问题命中多个路由类型时视为冲突交给分类器
+    RULES = {
+        'chat': [
+            re.compile(r'^(你好|您好|hi|hello|嗨|哈喽|谢谢|多谢|感谢|再见|拜拜|晚安|早上好|中午好|下午好|晚上好|'
+                       r'你是谁|你叫什么.*|在吗|辛苦了|好的|嗯+|哈+)[!！。.~～?？\s]*$', re.IGNORECASE),
+        ],
+        'list': [
+            re.compile(r'推荐|有(什么|哪些|没有).{0,6}(菜|汤|甜品|饮品|早餐|主食)|来(点|几道|几个)|几(道|个|样)菜|吃什么'),
+        ],
+        'detail': [
+            re.compile(r'怎么(做|烧|炒|煮|蒸|炖|煎|炸|腌)|怎样做|如何(做|烧|炒|煮|蒸|炖|煎|炸)|做法|步骤|制作方法|教我做|'
+                       r'需要(什么|哪些)(食材|材料|原料|调料)'),
+        ],
+        'general': [
+            re.compile(r'什么是|为什么|营养|热量|卡路里|区别|技巧|作用|能不能|可以吃吗|能一起吃'),
+        ],
+    }
+
+    def __init__(self, confidence_threshold: float = 0.6, temperature: float = 0.05):
+        """
+        初始化本地路由
+
+        Args:
+            confidence_threshold: 低于该置信度时回退到 LLM 路由
+            temperature: 将余弦相似度转为概率时的 softmax 温度
+        """
+        self.confidence_threshold = confidence_threshold
+        self.temperature = temperature
+        self.centroids: Optional[np.ndarray] = None
+
+    @property
+    def is_fitted(self) -> bool:
+        return self.centroids is not None
+
+    def fit(self, examples: Sequence[Tuple[str, str]], vectors: Sequence[Sequence[float]]):
+        """
+        用标注样例的嵌入向量计算每个路由类型的归一化质心
+
+        Args:
+            examples: (问题, 路由类型) 列表
+            vectors: 与 examples 一一对应的嵌入向量
+        """
+        matrix = np.asarray(vectors, dtype=np.float32)
+        labels = np.array([label for _, label in examples])
+        centroids = []
+        for route in self.ROUTES:
+            centroid = matrix[labels == route].mean(axis=0)
+            centroids.append(centroid / np.linalg.norm(centroid))
+        self.centroids = np.stack(centroids)
+        logger.info(f"本地路由分类器已训练: {len(examples)} 条样例")
+
+    def match_rules(self, query: str) -> RouteDecision:
+        """
+        关键词规则匹配，只有唯一路由类型命中时才给出结果
+
+        Args:
+            query: 用户查询
+
+        Returns:
+            路由决策（未命中或冲突时 route 为 None）
+        """
+        start = time.perf_counter()
+        text = query.strip()
+        matched = [route for route, patterns in self.RULES.items() if any(p.search(text) for p in patterns)]
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if len(matched) == 1:
+            return RouteDecision(matched[0], 0.95, "rules", elapsed_ms)
+        return RouteDecision(None, 0.0, "rules", elapsed_ms)
+
+    def classify(self, query_embedding: Sequence[float]) -> RouteDecision:
+        """
+        最近质心分类
+
+        返回的耗时只包含与质心的相似度计算；查询向量由调用方提供，其嵌入计算（通常远大于分类本身）不在此计入
+
+        Args:
+            query_embedding: 查询的归一化嵌入向量
+
+        Returns:
+            路由决策（置信度低于阈值时 route 为 None）
+        """
+        start = time.perf_counter()
+        if self.centroids is None:
+            return RouteDecision(None, 0.0, "classifier", 0.0)
+
+        similarities = self.centroids @ np.asarray(query_embedding, dtype=np.float32)
+        logits = similarities / self.temperature
+        probs = np.exp(logits - logits.max())
+        probs /= probs.sum()
+        best = int(probs.argmax())
+        confidence = float(probs[best])
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        route = self.ROUTES[best] if confidence >= self.confidence_threshold else None
+        return RouteDecision(route, confidence, "classifier", elapsed_ms, candidate=self.ROUTES[best])
+
+    def route(self, query: str, query_embedding: Optional[List[float]] = None) -> RouteDecision:
+        """
+        先规则后分类器；两者都不确定时返回 route=None
+
+        Args:
+            query: 用户查询
+            query_embedding: 查询向量（为空时只使用规则）
+
+        Returns:
+            路由决策
+        """
+        decision = self.match_rules(query)
+        if decision.route or query_embedding is None:
+            return decision
+        classified = self.classify(query_embedding)
+        classified.elapsed_ms += decision.elapsed_ms
+        return classified
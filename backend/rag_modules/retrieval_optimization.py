@@ -2,8 +2,10 @@
 检索优化模块
 """
 
+import asyncio
 import logging
-from typing import List, Dict, Any
+import threading
+from typing import List, Dict, Any, Optional
 
 from langchain_community.vectorstores import FAISS
 from langchain_community.retrievers import BM25Retriever
@@ -67,24 +69,42 @@ class RetrievalOptimizationModule:
 
         logger.info("检索器设置完成")
     
-    def hybrid_search(self, query: str, top_k: int = 3) -> List[Document]:
+    def hybrid_search(self, query: str, top_k: int = 3, query_embedding: Optional[List[float]] = None,
+                      bm25_only: bool = False, cancelled: Optional[threading.Event] = None) -> List[Document]:
         """
         混合检索 - 结合向量检索和BM25检索，使用RRF重排
 
+        返回的文档是带本次分数的副本，分块对象在并发请求间共享，不能写入分数。
+
         Args:
             query: 查询文本
             top_k: 返回结果数量
+            query_embedding: 预先计算好的查询向量（批量检索时复用），为空则现场计算
+            bm25_only: 只做BM25检索（请求时间预算不足时跳过查询向量化与向量检索）
+            cancelled: 调用方已放弃结果时置位，向量检索后不再继续 BM25 与重排
 
         Returns:
             检索到的文档列表
         """
+        if bm25_only:
+            # 只按 BM25 排名计算 RRF 分数，返回带本次分数的副本
+            return self._rrf_rerank([], self._deduplicate_by_parent(self.bm25_retriever.invoke(query)))[:top_k]
+
         # 1. 向量检索 (带分数)
-        vector_results = self.vectorstore.similarity_search_with_relevance_scores(query, k=10)
-        vector_docs = []
-        for doc, score in vector_results:
-            if score >= self.score_threshold:
-                doc.metadata['score'] = score
-                vector_docs.append(doc)
+        if query_embedding is None:
+            vector_results = self.vectorstore.similarity_search_with_relevance_scores(query, k=10)
+        else:
+            relevance_fn = self.vectorstore._select_relevance_score_fn()
+            vector_results = [
+                (doc, relevance_fn(distance))
+                for doc, distance in self.vectorstore.similarity_search_with_score_by_vector(query_embedding, k=10)
+            ]
+        vector_docs = [
+            Document(page_content=doc.page_content, metadata={**doc.metadata, 'score': score})
+            for doc, score in vector_results if score >= self.score_threshold
+        ]
+        if cancelled is not None and cancelled.is_set():
+            return []
         
         # 2. BM25检索
         bm25_docs = self.bm25_retriever.invoke(query)
@@ -132,7 +152,63 @@ class RetrievalOptimizationModule:
                 
         return unique_docs
     
-    def metadata_filtered_search(self, query: str, filters: Dict[str, Any], top_k: int = 3) -> List[Document]:
+    def embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """
+        批量计算查询向量，一次前向计算摊薄多个请求的开销
+
+        Args:
+            queries: 查询文本列表
+
+        Returns:
+            查询向量列表
+        """
+        return self.vectorstore.embedding_function.embed_documents(queries)
+
+    def search_batch(self, queries: List[str], top_k: int = 3, filters: Optional[Dict[str, Any]] = None) -> List[List[Document]]:
+        """
+        批量检索 - 先批量向量化，再逐条做混合检索
+
+        Args:
+            queries: 查询文本列表
+            top_k: 每条查询返回结果数量
+            filters: 元数据过滤条件（对所有查询生效）
+
+        Returns:
+            与 queries 一一对应的检索结果
+        """
+        embeddings = self.embed_queries(queries)
+        if filters:
+            return [self.metadata_filtered_search(q, filters, top_k, query_embedding=e) for q, e in zip(queries, embeddings)]
+        return [self.hybrid_search(q, top_k, query_embedding=e) for q, e in zip(queries, embeddings)]
+
+    @staticmethod
+    async def _in_thread(func, *args) -> List[Document]:
+        """
+        在线程池中执行检索
+
+        取消协程不会中断已在运行的线程，只能置位 cancelled 让检索在向量检索之后提前结束，结果被丢弃。
+        """
+        cancelled = threading.Event()
+        try:
+            return await asyncio.to_thread(func, *args, cancelled)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    async def ahybrid_search(self, query: str, top_k: int = 3,
+                             query_embedding: Optional[List[float]] = None, bm25_only: bool = False) -> List[Document]:
+        """混合检索的异步版本，在线程池中执行避免阻塞事件循环"""
+        return await self._in_thread(self.hybrid_search, query, top_k, query_embedding, bm25_only)
+
+    async def ametadata_filtered_search(self, query: str, filters: Dict[str, Any], top_k: int = 3,
+                                        query_embedding: Optional[List[float]] = None,
+                                        bm25_only: bool = False) -> List[Document]:
+        """带元数据过滤检索的异步版本"""
+        return await self._in_thread(self.metadata_filtered_search, query, filters, top_k, query_embedding, bm25_only)
+
+    def metadata_filtered_search(self, query: str, filters: Dict[str, Any], top_k: int = 3,
+                                 query_embedding: Optional[List[float]] = None,
+                                 bm25_only: bool = False, cancelled: Optional[threading.Event] = None) -> List[Document]:
         """
         带元数据过滤的检索
         
@@ -140,12 +216,16 @@ class RetrievalOptimizationModule:
             query: 查询文本
             filters: 元数据过滤条件
             top_k: 返回结果数量
+            query_embedding: 预先计算好的查询向量
+            bm25_only: 只做BM25检索
+            cancelled: 调用方已放弃结果时置位
             
         Returns:
             过滤后的文档列表
         """
         # 先进行混合检索，获取更多候选
-        docs = self.hybrid_search(query, top_k * 3)
+        docs = self.hybrid_search(query, top_k * 3, query_embedding=query_embedding, bm25_only=bm25_only,
+                                  cancelled=cancelled)
         
         # 应用元数据过滤
         filtered_docs = []
@@ -210,9 +290,9 @@ class RetrievalOptimizationModule:
         reranked_docs = []
         for doc_id, final_score in sorted_docs:
             if doc_id in doc_objects:
-                doc = doc_objects[doc_id]
-                # 将RRF分数添加到文档元数据中
-                doc.metadata['rrf_score'] = final_score
+                # 将RRF分数添加到文档副本的元数据中
+                doc = Document(page_content=doc_objects[doc_id].page_content,
+                               metadata={**doc_objects[doc_id].metadata, 'rrf_score': final_score})
                 reranked_docs.append(doc)
                 print(f"[DEBUG] Final Rank {len(reranked_docs)}. {doc.metadata.get('dish_name')} - RRF Score: {final_score:.4f}")
 
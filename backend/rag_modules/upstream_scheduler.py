@@ -0,0 +1,305 @@
+"""
+上游 LLM 调度模块 - 并发上限、按模型令牌桶限流、优先级队列与自适应重试
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from contextlib import asynccontextmanager, nullcontext
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+
+import openai
+
+from core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 优先级数值越小越先执行：路由与重写很短且阻塞后续流程，优先于长回答
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+
+def retry_reason(error: Exception) -> Optional[str]:
+    """上游侧的可重试错误返回原因，否则返回 None"""
+    if isinstance(error, openai.RateLimitError):
+        return "429"
+    if isinstance(error, openai.APITimeoutError):
+        return "timeout"
+    if isinstance(error, openai.APIConnectionError):
+        return "connection"
+    if isinstance(error, openai.APIStatusError) and error.status_code >= 500:
+        return str(error.status_code)
+    return None
+
+
+class TokenBucket:
+    """令牌桶限流，收到 429 后在 Retry-After 期间暂停发放令牌；等待令牌的请求按优先级排队"""
+
+    def __init__(self, rate: float, burst: float):
+        """
+        Args:
+            rate: 每秒补充的请求数
+            burst: 桶容量（允许的突发请求数）
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.strikes = 0  # 连续收到 429 的次数，决定没有 Retry-After 时的暂停时长
+        self._waiters = []
+        self._seq = itertools.count()
+        self._changed = asyncio.Event()
+
+    def _take(self) -> float:
+        """尝试取一个令牌，成功返回 0，否则返回下一个令牌可用前需要等待的秒数"""
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _wait_change(self, timeout: Optional[float]):
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def acquire(self, priority: int = PRIORITY_NORMAL):
+        """取一个令牌；令牌不足时只有优先级最高的等待者取下一个令牌"""
+        if not self._waiters and self._take() == 0:
+            return
+        entry = (priority, next(self._seq))
+        heapq.heappush(self._waiters, entry)
+        # 新的等待者可能排在当前队首之前，唤醒队首重新判断
+        self._notify()
+        try:
+            while True:
+                if self._waiters[0] == entry:
+                    delay = self._take()
+                    if delay == 0:
+                        return
+                    await self._wait_change(delay)
+                else:
+                    await self._wait_change(None)
+        finally:
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+            self._notify()
+
+    def penalize(self, delay: float):
+        """上游限流时清空令牌并暂停发放"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+        self.tokens = 0
+
+
+class UpstreamScheduler:
+    """上游调用调度器 - 所有对 LLM 服务的请求都经过这里"""
+
+    def __init__(self, max_concurrency: int = 16, rate_limits: Dict[str, Dict[str, float]] = None,
+                 max_retries: int = 3, backoff_base: float = 0.5, backoff_max: float = 8.0):
+        """
+        初始化调度器
+
+        Args:
+            max_concurrency: 同时进行的上游请求上限
+            rate_limits: 按模型名的限流配置 {"模型名或default": {"rps": 5, "burst": 10}}，
+                每个 (模型, 端点) 各有一个令牌桶，一个端点限流不影响其他端点
+            max_retries: 429/5xx/超时的最大重试次数
+            backoff_base: 指数退避的基础时长（秒）
+            backoff_max: 单次退避的最大时长（秒）
+        """
+        self.max_concurrency = max_concurrency
+        self.rate_limits = rate_limits or {"default": {"rps": 10, "burst": 20}}
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._buckets: Dict[Tuple[str, Optional[str]], TokenBucket] = {}
+        self._active = 0
+        self._waiters = []
+        self._seq = itertools.count()
+
+    def _bucket(self, model: str, endpoint: Optional[str] = None) -> TokenBucket:
+        bucket = self._buckets.get((model, endpoint))
+        if bucket is None:
+            limit = self.rate_limits.get(model) or self.rate_limits.get("default") or {"rps": 10, "burst": 20}
+            bucket = self._buckets[(model, endpoint)] = TokenBucket(
+                float(limit["rps"]), float(limit.get("burst", limit["rps"]))
+            )
+        return bucket
+
+    def _update_gauges(self):
+        metrics.set_gauge("llm_queue_depth", len(self._waiters))
+        metrics.set_gauge("llm_inflight", self._active)
+
+    async def _acquire_slot(self, priority: int):
+        if self._active < self.max_concurrency and not self._waiters:
+            self._active += 1
+            self._update_gauges()
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._update_gauges()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # 已被分配槽位但调用方取消，归还槽位
+            if future.done() and not future.cancelled():
+                self._release_slot()
+            raise
+
+    def _release_slot(self):
+        # 槽位直接移交给优先级最高的等待者
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                self._update_gauges()
+                return
+        self._active -= 1
+        self._update_gauges()
+
+    @asynccontextmanager
+    async def admission(self, model: str, priority: int, endpoint: Optional[str] = None):
+        """
+        排队获取 (模型, 端点) 的限流令牌与并发槽位，退出时归还槽位
+
+        先取令牌再占槽位：等待令牌（包括 429 后的暂停）时不占用并发槽位，其他端点与高优先级请求不受影响。
+        块内的调用返回 429 时只暂停该端点的令牌桶。
+
+        Args:
+            model: 模型名（决定限流配置）
+            priority: 优先级
+            endpoint: 端点 base_url，为空时按模型共用一个令牌桶
+        """
+        bucket = self._bucket(model, endpoint)
+        start = time.perf_counter()
+        await bucket.acquire(priority)
+        await self._acquire_slot(priority)
+        metrics.observe("llm_queue_wait_seconds", time.perf_counter() - start, priority=priority)
+        try:
+            yield
+            bucket.strikes = 0
+        except Exception as e:
+            if retry_reason(e) == "429":
+                # 同一端点的其他请求一起暂停，避免继续触发限流
+                bucket.strikes += 1
+                delay = self._retry_after(e)
+                if delay is None:
+                    delay = min(self.backoff_base * (2 ** (bucket.strikes - 1)), self.backoff_max)
+                bucket.penalize(delay)
+            raise
+        finally:
+            self._release_slot()
+
+    @staticmethod
+    def _retry_after(error: Exception) -> Optional[float]:
+        response = getattr(error, "response", None)
+        value = response.headers.get("retry-after") if response is not None else None
+        if not value:
+            return None
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            try:
+                return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+            except (TypeError, ValueError):
+                return None
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        # 全抖动指数退避，Retry-After 作为下限
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        return max(delay, retry_after or 0.0)
+
+    async def _handle_failure(self, model: str, attempt: int, error: Exception) -> float:
+        """判断是否重试，返回退避时长；不可重试时重新抛出"""
+        reason = retry_reason(error)
+        metrics.inc("llm_upstream_errors_total", model=model, reason=reason or type(error).__name__)
+        if reason is None or attempt >= self.max_retries:
+            raise error
+        delay = self._backoff(attempt, self._retry_after(error))
+        metrics.inc("llm_retries_total", model=model, reason=reason)
+        logger.warning(f"上游 {model} 返回 {reason}，{delay:.2f}s 后第 {attempt + 1} 次重试")
+        return delay
+
+    async def run(self, model: str, priority: int, call: Callable[[], Awaitable[Any]], admit: bool = True) -> Any:
+        """
+        排队执行一次非流式调用，失败时按策略重试
+
+        Args:
+            model: 模型名（决定限流桶）
+            priority: 优先级
+            call: 发起调用的协程函数（每次重试重新调用）
+            admit: 是否在这里排队；端点池自己按端点调用 admission 时为 False，只负责重试
+
+        Returns:
+            调用结果
+        """
+        attempt = 0
+        while True:
+            try:
+                if not admit:
+                    return await call()
+                async with self.admission(model, priority):
+                    return await call()
+            except Exception as e:
+                delay = await self._handle_failure(model, attempt, e)
+            # 退避期间不占用并发槽位
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _iterate(self, call: Callable[[], AsyncIterator[Any]], model: str, priority: int,
+                       admit: bool) -> AsyncIterator[Any]:
+        async with self.admission(model, priority) if admit else nullcontext():
+            chunks = call()
+            try:
+                async for chunk in chunks:
+                    yield chunk
+            finally:
+                # 提前结束时关闭底层迭代器，端点池在其中持有的排队槽位随之归还
+                if hasattr(chunks, "aclose"):
+                    await chunks.aclose()
+
+    async def stream(self, model: str, priority: int, call: Callable[[], AsyncIterator[Any]],
+                     admit: bool = True) -> AsyncIterator[Any]:
+        """
+        排队执行一次流式调用；只在收到首个分块之前重试，之后的错误直接抛出
+
+        Args:
+            model: 模型名
+            priority: 优先级
+            call: 返回分块异步迭代器的函数
+            admit: 是否在这里排队（端点池按端点排队时为 False）
+        """
+        attempt = 0
+        while True:
+            started = False
+            delay = 0.0
+            chunks = self._iterate(call, model, priority, admit)
+            try:
+                async for chunk in chunks:
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                if started:
+                    raise
+                delay = await self._handle_failure(model, attempt, e)
+            finally:
+                # 调用方提前结束迭代时立即归还槽位，不等垃圾回收
+                await chunks.aclose()
+            await asyncio.sleep(delay)
+            attempt += 1
@@ -8,10 +8,11 @@ class ChatSessionResponse(BaseModel):
     title: str
     created_at: datetime
     updated_at: datetime
+    message_count: Optional[int] = None  # 仅在 with_counts=true 时返回
 
 class ChatMessageResponse(BaseModel):
-    """消息响应模型"""
-    id: int
+    """消息响应模型（尚未落库的消息 id 为空）"""
+    id: Optional[int] = None
     role: str
     content: str
     image_url: Optional[str] = None
@@ -19,10 +20,12 @@ class ChatMessageResponse(BaseModel):
     created_at: datetime
 
 class SessionListResponse(BaseModel):
-    """会话列表响应"""
+    """会话列表响应（按更新时间倒序的一页会话）"""
     sessions: List[ChatSessionResponse]
-    total: int
+    total: int  # 本页会话数
+    next_cursor: Optional[str] = None  # 传给 cursor 参数获取下一页，为空表示没有更多会话
 
 class HistoryResponse(BaseModel):
-    """历史记录响应"""
+    """历史记录响应（按时间正序的一页消息）"""
     messages: List[ChatMessageResponse]
+    next_cursor: Optional[int] = None  # 传给 before 参数获取更早的一页，为空表示没有更早的消息
@@ -18,6 +18,7 @@ class AnswerResponse(BaseModel):
     route_type: str
     documents: list
     session_id: Optional[str] = None
+    degradations: list = []
 
 
 class StreamChunk(BaseModel):
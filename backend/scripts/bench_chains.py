@@ -0,0 +1,115 @@
+"""
+LCEL 链构建开销微基准 - 对比每次请求现建链与预构建链的单次调用开销
+
+使用固定回复的假模型，只测量模板解析、Runnable 图构建与调用本身的开销，不访问上游。
+两种写法都在计时内从文档拼装上下文，非流式与流式各自对比。
+
+运行:
+    cd backend
+    python scripts/bench_chains.py --iterations 2000
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from langchain_core.documents import Document
+from langchain_core.language_models import FakeListChatModel
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnablePassthrough
+
+from core.prompts import PromptTemplates
+from rag_modules.endpoint_pool import EndpointPool
+from rag_modules.generation_integration import GenerationIntegrationModule
+from rag_modules.upstream_scheduler import UpstreamScheduler
+
+
+class FakeGenerationModule(GenerationIntegrationModule):
+    """经正常构造流程创建，只把各阶段、各端点的模型换成假模型（不需要 API Key）"""
+
+    def __init__(self, llm, **kwargs):
+        self.fake_llm = llm
+        super().__init__(model_name="fake", scheduler=UpstreamScheduler(),
+                         endpoint_pool=EndpointPool(["http://fake"]), **kwargs)
+
+    def setup_llm(self):
+        self.llms = {stage: self.fake_llm for stage in self.stage_settings}
+        self.endpoint_llms = {stage: {url: self.fake_llm for url in self.endpoint_pool.urls}
+                              for stage in self.stage_settings}
+        self.llm = self.llms["detail"]
+        self.build_chains()
+
+
+def per_request_chain(module: GenerationIntegrationModule, llm, question: str, docs, chat_history: str):
+    """改造前的写法：每次请求拼装上下文、解析模板并用闭包构建新链"""
+    context = module._build_context(docs)
+    prompt = ChatPromptTemplate.from_template(PromptTemplates.STEP_BY_STEP_TEMPLATE)
+    return (
+        {
+            "question": RunnablePassthrough(),
+            "context": lambda _: context,
+            "chat_history": lambda _: chat_history
+        }
+        | prompt
+        | llm
+        | StrOutputParser()
+    )
+
+
+def bench(label: str, func, iterations: int):
+    func()  # 预热
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {elapsed / iterations * 1e6:>10.1f} µs/次")
+
+
+async def bench_stream(label: str, factory, iterations: int):
+    async def consume():
+        async for _ in factory():
+            pass
+
+    await consume()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await consume()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {elapsed / iterations * 1e6:>10.1f} µs/次")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LCEL 链构建开销微基准")
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    llm = FakeListChatModel(responses=["好的"])
+    module = FakeGenerationModule(llm)
+    docs = [Document(page_content="示例食谱内容" * 20, metadata={"dish_name": "番茄炒蛋", "category": "荤菜"})]
+    question, chat_history = "番茄炒蛋怎么做", "用户: 你好\n助手: 你好！"
+
+    # 两种写法的计时都包含上下文拼装与一次完整调用
+    print(f"迭代次数: {args.iterations}")
+    bench("每次请求构建链 (invoke)",
+          lambda: per_request_chain(module, llm, question, docs, chat_history).invoke(question), args.iterations)
+    bench("预构建链 (invoke)", lambda: module.generate_step_by_step_answer(question, docs, chat_history), args.iterations)
+    bench("仅模板解析", lambda: ChatPromptTemplate.from_template(PromptTemplates.STEP_BY_STEP_TEMPLATE), args.iterations)
+    asyncio.run(bench_stream(
+        "每次请求构建链 (astream)",
+        lambda: per_request_chain(module, llm, question, docs, chat_history).astream(question),
+        args.iterations
+    ))
+    asyncio.run(bench_stream(
+        "预构建链 (astream)",
+        lambda: module.generate_step_by_step_answer_stream(question, docs, chat_history),
+        args.iterations
+    ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""
+上游端点池自检 - 在本地启动若干 OpenAI 兼容的桩服务，验证选路、对冲、熔断与按端点限流
+
+每个桩服务只实现 POST /v1/chat/completions，可配置响应延迟与返回 429 的次数，并记录同时处理的请求数。
+调用走真实的 openai 客户端，错误类型与线上一致；不需要外部网络与 API Key。
+
+运行:
+    cd backend
+    python scripts/check_endpoint_pool.py
+"""
+
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Callable, List
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+import openai
+
+from rag_modules.endpoint_pool import EndpointPool
+from rag_modules.upstream_scheduler import PRIORITY_HIGH, UpstreamScheduler
+
+MODEL = "stub-model"
+
+
+class StubServer:
+    """最小的 OpenAI 兼容桩服务"""
+
+    def __init__(self, delay: float = 0.0, fail_429: int = 0):
+        self.delay = delay
+        self.fail_429 = fail_429
+        self.requests = 0
+        self.active = 0
+        self.max_active = 0
+        self._server = None
+        self._handlers = set()
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}/v1"
+
+    async def start(self) -> 'StubServer':
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self
+
+    async def close(self):
+        self._server.close()
+        # 仍在模拟延迟的请求（如被对冲取消的主调用）直接结束
+        for task in self._handlers:
+            task.cancel()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._handlers.add(asyncio.current_task())
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.decode("latin-1").split("\r\n"):
+                    if line.lower().startswith("content-length:"):
+                        length = int(line.split(":", 1)[1])
+                if length:
+                    await reader.readexactly(length)
+                self.requests += 1
+                self.active += 1
+                self.max_active = max(self.max_active, self.active)
+                try:
+                    await asyncio.sleep(self.delay)
+                finally:
+                    self.active -= 1
+                if self.fail_429 > 0:
+                    self.fail_429 -= 1
+                    status, body = "429 Too Many Requests", {"error": {"message": "rate limited", "type": "rate_limit"}}
+                    extra = "Retry-After: 0.2\r\n"
+                else:
+                    status, extra = "200 OK", ""
+                    body = {
+                        "id": "stub", "object": "chat.completion", "created": int(time.time()), "model": MODEL,
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": "ok"}}],
+                        "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}
+                    }
+                payload = json.dumps(body).encode()
+                writer.write((f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n{extra}"
+                              f"Content-Length: {len(payload)}\r\n\r\n").encode() + payload)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError, asyncio.CancelledError):
+            pass
+        finally:
+            self._handlers.discard(asyncio.current_task())
+            writer.close()
+
+
+def make_call(clients: dict) -> Callable:
+    """以端点为参数发起一次补全调用（SDK 自身不重试，由调度器负责）"""
+    async def call(endpoint):
+        response = await clients[endpoint.url].chat.completions.create(
+            model=MODEL, messages=[{"role": "user", "content": "hi"}], max_tokens=1
+        )
+        return endpoint.url, response.choices[0].message.content
+    return call
+
+
+async def setup(servers: List[StubServer], **pool_kwargs):
+    pool = EndpointPool([s.url for s in servers], **pool_kwargs)
+    clients = {s.url: openai.AsyncOpenAI(base_url=s.url, api_key="stub", max_retries=0, timeout=5.0)
+               for s in servers}
+    return pool, clients
+
+
+async def teardown(servers: List[StubServer], clients: dict):
+    # 先关客户端的长连接，桩服务的连接处理随之正常退出
+    for client in clients.values():
+        await client.close()
+    for server in servers:
+        await server.close()
+
+
+def check(name: str, ok: bool, detail: str = ""):
+    print(f"{'✅' if ok else '❌'} {name}{'：' + detail if detail else ''}")
+    if not ok:
+        raise SystemExit(1)
+
+
+async def check_routing():
+    fast, slow = await StubServer(delay=0.01).start(), await StubServer(delay=0.2).start()
+    pool, clients = await setup([slow, fast])
+    scheduler = UpstreamScheduler(max_concurrency=8)
+    call = make_call(clients)
+    for _ in range(20):
+        await scheduler.run(MODEL, PRIORITY_HIGH, lambda: pool.run(call, admit=admission(scheduler)), admit=False)
+    check("按首 token 延迟选路", fast.requests >= 15 and pool.choose().url == fast.url,
+          f"快端点 {fast.requests} 次，慢端点 {slow.requests} 次")
+    await teardown([fast, slow], clients)
+
+
+def admission(scheduler: UpstreamScheduler):
+    return lambda endpoint: scheduler.admission(MODEL, PRIORITY_HIGH, endpoint.url)
+
+
+async def check_hedging():
+    stuck, fast = await StubServer(delay=2.0).start(), await StubServer(delay=0.01).start()
+    pool, clients = await setup([stuck, fast], hedge_default_delay=0.1)
+    # 让卡住的端点成为首选
+    pool.endpoints[0].ewma_ttft, pool.endpoints[1].ewma_ttft = 0.01, 0.05
+    scheduler = UpstreamScheduler(max_concurrency=8)
+    start = time.perf_counter()
+    url, _ = await pool.run(make_call(clients), hedge=True, admit=admission(scheduler))
+    elapsed = time.perf_counter() - start
+    check("对冲请求先于卡住的主端点返回", url == fast.url and elapsed < 1.0, f"{elapsed:.2f}s")
+    check("对冲请求经调度器按端点取令牌", (MODEL, fast.url) in scheduler._buckets)
+    await asyncio.sleep(0)
+    check("对冲结束后归还全部并发槽位", scheduler._active == 0, f"占用 {scheduler._active}")
+    await teardown([stuck, fast], clients)
+
+
+async def check_concurrency_cap():
+    servers = [await StubServer(delay=0.05).start() for _ in range(2)]
+    pool, clients = await setup(servers, hedge_default_delay=0.01, hedge_min_delay=0.01)
+    scheduler = UpstreamScheduler(max_concurrency=2)
+    call = make_call(clients)
+    await asyncio.gather(*(
+        scheduler.run(MODEL, PRIORITY_HIGH, lambda: pool.run(call, hedge=True, admit=admission(scheduler)),
+                      admit=False)
+        for _ in range(10)
+    ))
+    peak = sum(s.max_active for s in servers)
+    check("对冲请求也受并发上限约束", peak <= 2 and scheduler._active == 0, f"各端点峰值之和 {peak}")
+    await teardown(servers, clients)
+
+
+async def check_per_endpoint_rate_limit():
+    limited, healthy = await StubServer(fail_429=1).start(), await StubServer().start()
+    pool, clients = await setup([limited, healthy])
+    scheduler = UpstreamScheduler(max_concurrency=8, backoff_base=0.05)
+    pool.endpoints[0].ewma_ttft, pool.endpoints[1].ewma_ttft = 0.001, 0.01
+    await scheduler.run(MODEL, PRIORITY_HIGH, lambda: pool.run(make_call(clients), admit=admission(scheduler)),
+                        admit=False)
+    limited_bucket = scheduler._buckets[(MODEL, limited.url)]
+    healthy_bucket = scheduler._buckets.get((MODEL, healthy.url))
+    check("429 只暂停返回限流的端点", limited_bucket.blocked_until > 0 and
+          (healthy_bucket is None or healthy_bucket.blocked_until == 0))
+    await teardown([limited, healthy], clients)
+
+
+async def check_ejection():
+    broken, healthy = await StubServer(fail_429=100).start(), await StubServer().start()
+    pool, clients = await setup([broken, healthy], failure_threshold=2, cooldown_seconds=30)
+    pool.endpoints[0].ewma_ttft, pool.endpoints[1].ewma_ttft = 0.001, 0.01
+    call = make_call(clients)
+    for _ in range(2):
+        try:
+            await pool.run(call)
+        except openai.RateLimitError:
+            pass
+    url, _ = await pool.run(call)
+    check("连续失败的端点被摘除", not pool.endpoints[0].healthy and url == healthy.url)
+    await teardown([broken, healthy], clients)
+
+
+async def main():
+    await check_routing()
+    await check_hedging()
+    await check_concurrency_cap()
+    await check_per_endpoint_rate_limit()
+    await check_ejection()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,131 @@
+"""
+本地假 LLM 服务 - OpenAI 兼容的 /v1/chat/completions 与 /v1/models，用于压测与端点池测试，不消耗真实配额
+
+可配置首 token 延迟、生成速度、错误率与 429 比例。
+
+运行:
+    cd backend
+    python scripts/fake_llm_server.py --port 9001 --ttft-ms 300 --tokens-per-sec 40
+    # 然后以 LLM_BASE_URL=http://127.0.0.1:9001/v1 启动后端（多个端点用 LLM_BASE_URLS 逗号分隔）
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# 生成内容从这段文本中循环截取，每个字符算一个 token
+SAMPLE_TEXT = (
+    "首先将番茄洗净切块，鸡蛋打散加少许盐。锅中倒油烧热，倒入蛋液炒至凝固后盛出。"
+    "锅中再加少许油，放入番茄翻炒出汁，加入糖和盐调味，最后倒回鸡蛋翻炒均匀即可出锅。"
+)
+
+
+def create_app(args: argparse.Namespace) -> FastAPI:
+    app = FastAPI(title="Fake LLM")
+    stats = {"requests": 0, "errors": 0, "rate_limited": 0}
+
+    def completion_text(max_tokens: int) -> str:
+        length = min(max_tokens or args.default_tokens, args.default_tokens)
+        start = random.randrange(len(SAMPLE_TEXT))
+        return (SAMPLE_TEXT * (length // len(SAMPLE_TEXT) + 2))[start:start + length]
+
+    def injected_error():
+        """按配置的比例返回 429 或 500"""
+        roll = random.random()
+        if roll < args.rate_limit_rate:
+            stats["rate_limited"] += 1
+            return JSONResponse(
+                status_code=429,
+                content={"error": {"message": "Rate limit exceeded", "type": "rate_limit_error"}},
+                headers={"Retry-After": str(args.retry_after)}
+            )
+        if roll < args.rate_limit_rate + args.error_rate:
+            stats["errors"] += 1
+            return JSONResponse(status_code=500, content={"error": {"message": "Internal error", "type": "server_error"}})
+        return None
+
+    async def first_token_delay():
+        jitter = random.uniform(-args.ttft_jitter_ms, args.ttft_jitter_ms) if args.ttft_jitter_ms else 0
+        await asyncio.sleep(max(args.ttft_ms + jitter, 0) / 1000)
+
+    @app.get("/v1/models")
+    async def list_models():
+        return {"object": "list", "data": [{"id": args.model, "object": "model", "owned_by": "fake"}]}
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+        error = injected_error()
+        if error is not None:
+            return error
+
+        model = body.get("model", args.model)
+        text = completion_text(body.get("max_tokens"))
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        usage = {"prompt_tokens": sum(len(str(m.get("content", ""))) for m in body.get("messages", [])),
+                 "completion_tokens": len(text)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        if not body.get("stream"):
+            await first_token_delay()
+            await asyncio.sleep(len(text) / args.tokens_per_sec)
+            return {
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": usage
+            }
+
+        async def stream():
+            def chunk(delta, finish_reason=None):
+                data = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+                return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+            await first_token_delay()
+            yield chunk({"role": "assistant", "content": ""})
+            interval = 1 / args.tokens_per_sec
+            for token in text:
+                yield chunk({"content": token})
+                await asyncio.sleep(interval)
+            yield chunk({}, "stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI 兼容的本地假 LLM 服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--model", default="fake-model")
+    parser.add_argument("--ttft-ms", type=float, default=300.0, help="首 token 延迟（毫秒）")
+    parser.add_argument("--ttft-jitter-ms", type=float, default=0.0, help="首 token 延迟的随机抖动（毫秒）")
+    parser.add_argument("--tokens-per-sec", type=float, default=40.0, help="生成速度")
+    parser.add_argument("--default-tokens", type=int, default=200, help="每次回复的最大 token 数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 500 的比例")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="返回 429 的比例")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="429 响应的 Retry-After（秒）")
+    args = parser.parse_args()
+
+    print(f"假 LLM 服务: http://{args.host}:{args.port}/v1 (TTFT {args.ttft_ms}ms, {args.tokens_per_sec} tokens/s, "
+          f"错误率 {args.error_rate}, 429 比例 {args.rate_limit_rate})")
+    uvicorn.run(create_app(args), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+端到端压测 - 以混合问题负载并发请求 /api/v1/rag/ask_stream，结果写入 JSON 便于对比
+
+上游使用 scripts/fake_llm_server.py 时不消耗真实配额。
+
+运行:
+    cd backend
+    python scripts/fake_llm_server.py --port 9001 &
+    LLM_BASE_URL=http://127.0.0.1:9001/v1 uvicorn main:app --port 8000 &
+    python scripts/load_test.py --concurrency 32 --duration 60 --output results/load_c32.json
+
+指标:
+    客户端：吞吐（请求/秒）、端到端延迟、首个 delta 事件延迟（TTFT）、流持续时间（首个 delta 到 done）的 p50/p95/p99
+    服务端：运行结束时从 /api/v1/admin/metrics 读取的数据库写入延迟与事件循环延迟（多 worker 时为响应请求的那个 worker）
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+# 默认混合负载：(问题, 权重, 是否在同一会话中追问)
+DEFAULT_WORKLOAD = [
+    ("推荐几道简单的素菜", 3, False),
+    ("红烧肉怎么做", 3, False),
+    ("番茄炒蛋需要哪些食材", 2, False),
+    ("宫保鸡丁是什么口味", 2, False),
+    ("你好", 1, False),
+    ("那它需要炖多久", 1, True),
+]
+
+SERVER_HISTOGRAMS = ("db_write_seconds", "event_loop_lag_seconds", "pre_generation_latency_seconds",
+                     "llm_ttft_seconds", "llm_queue_wait_seconds")
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"count": 0, "avg": None, "p50": None, "p95": None, "p99": None, "max": None}
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return round(ordered[min(int(q * len(ordered)), len(ordered) - 1)], 4)
+
+    return {
+        "count": len(ordered),
+        "avg": round(sum(ordered) / len(ordered), 4),
+        "p50": pick(0.5),
+        "p95": pick(0.95),
+        "p99": pick(0.99),
+        "max": round(ordered[-1], 4)
+    }
+
+
+def load_workload(path: Optional[str]) -> List[tuple]:
+    """问题文件为 JSON 数组：[{"question": ..., "weight": 1, "follow_up": false}, ...]"""
+    if not path:
+        return DEFAULT_WORKLOAD
+    with open(path, encoding="utf-8") as f:
+        items = json.load(f)
+    return [(i["question"], i.get("weight", 1), i.get("follow_up", False)) for i in items]
+
+
+async def parse_events(response: httpx.Response):
+    """解析 SSE 事件流，产出 (事件名, 数据)"""
+    buffer = ""
+    async for text in response.aiter_text():
+        buffer += text
+        while "\n\n" in buffer:
+            raw, buffer = buffer.split("\n\n", 1)
+            event, data = "message", ""
+            for line in raw.split("\n"):
+                if line.startswith("event: "):
+                    event = line[7:]
+                elif line.startswith("data: "):
+                    data += line[6:]
+            if data:
+                yield event, json.loads(data)
+
+
+async def ask_once(client: httpx.AsyncClient, question: str, session_id: Optional[str]) -> Dict[str, Any]:
+    """发起一次流式提问并记录各阶段耗时"""
+    start = time.perf_counter()
+    result = {"question": question, "ok": False, "ttft": None, "stream": None, "session_id": session_id}
+    first_delta = None
+    try:
+        payload = {"question": question, "session_id": session_id}
+        async with client.stream("POST", "/api/v1/rag/ask_stream", json=payload) as response:
+            if response.status_code != 200:
+                result["error"] = f"HTTP {response.status_code}"
+                return result
+            async for event, data in parse_events(response):
+                if event == "meta":
+                    result["session_id"] = data.get("session_id")
+                elif event == "delta" and first_delta is None:
+                    first_delta = time.perf_counter()
+                    result["ttft"] = first_delta - start
+                elif event == "error":
+                    result["error"] = data.get("message")
+                    return result
+                elif event == "done":
+                    result["ok"] = True
+                    result["usage"] = data.get("usage")
+    except (httpx.HTTPError, json.JSONDecodeError) as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        end = time.perf_counter()
+        result["latency"] = end - start
+        if first_delta is not None:
+            result["stream"] = end - first_delta
+    return result
+
+
+async def worker(client: httpx.AsyncClient, workload: List[tuple], deadline: float, remaining: List[int],
+                 results: List[Dict[str, Any]]):
+    questions = [w[0] for w in workload]
+    weights = [w[1] for w in workload]
+    follow_ups = {w[0] for w in workload if w[2]}
+    session_id = None
+    while time.perf_counter() < deadline and remaining[0] != 0:
+        remaining[0] -= 1
+        question = random.choices(questions, weights)[0]
+        # 追问沿用上一次的会话（带历史），其余问题新建会话
+        result = await ask_once(client, question, session_id if question in follow_ups else None)
+        session_id = result.get("session_id") or session_id
+        results.append(result)
+
+
+async def fetch_server_metrics(client: httpx.AsyncClient) -> Dict[str, Any]:
+    headers = {"X-Admin-Token": os.getenv("ADMIN_TOKEN", "")}
+    try:
+        response = await client.get("/api/v1/admin/metrics", headers=headers)
+        response.raise_for_status()
+        histograms = response.json()["data"]["histograms"]
+    except (httpx.HTTPError, KeyError, ValueError) as e:
+        return {"error": str(e)}
+    return {k: v for k, v in histograms.items() if k.split("{")[0] in SERVER_HISTOGRAMS}
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    workload = load_workload(args.workload)
+    timeout = httpx.Timeout(args.timeout, connect=10.0)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=timeout, limits=limits) as client:
+        results: List[Dict[str, Any]] = []
+        remaining = [args.requests or -1]
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*(
+            worker(client, workload, deadline, remaining, results) for _ in range(args.concurrency)
+        ))
+        elapsed = time.perf_counter() - start
+        server = await fetch_server_metrics(client)
+
+    ok = [r for r in results if r["ok"]]
+    errors: Dict[str, int] = {}
+    for r in results:
+        if not r["ok"]:
+            key = (r.get("error") or "incomplete")[:80]
+            errors[key] = errors.get(key, 0) + 1
+    return {
+        "config": {
+            "base_url": args.base_url,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "requests": args.requests,
+            "workload": [{"question": q, "weight": w, "follow_up": f} for q, w, f in workload],
+            "label": args.label,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S")
+        },
+        "summary": {
+            "elapsed_seconds": round(elapsed, 2),
+            "requests": len(results),
+            "succeeded": len(ok),
+            "failed": len(results) - len(ok),
+            "requests_per_second": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+            "errors": errors
+        },
+        "latency_seconds": percentiles([r["latency"] for r in ok]),
+        "ttft_seconds": percentiles([r["ttft"] for r in ok if r["ttft"] is not None]),
+        "stream_seconds": percentiles([r["stream"] for r in ok if r["stream"] is not None]),
+        "server": server
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ask_stream 端到端压测")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=int, default=16, help="并发虚拟用户数")
+    parser.add_argument("--duration", type=float, default=30.0, help="最长运行时间（秒）")
+    parser.add_argument("--requests", type=int, default=0, help="总请求数上限（0 表示只按时长）")
+    parser.add_argument("--timeout", type=float, default=120.0, help="单个请求超时（秒）")
+    parser.add_argument("--workload", help="问题文件（JSON），默认使用内置混合负载")
+    parser.add_argument("--label", default="", help="写入结果的标签，便于对比多次运行")
+    parser.add_argument("--output", default="load_test_results.json")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    summary = report["summary"]
+    print(f"请求 {summary['requests']} (失败 {summary['failed']}), 吞吐 {summary['requests_per_second']} req/s")
+    for name in ("latency_seconds", "ttft_seconds", "stream_seconds"):
+        stats = report[name]
+        print(f"{name:<16} p50 {stats['p50']}  p95 {stats['p95']}  p99 {stats['p99']}")
+    print(f"结果已写入 {output}")
+
+
+if __name__ == "__main__":
+    main()
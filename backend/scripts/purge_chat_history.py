@@ -0,0 +1,67 @@
+"""
+手动清理聊天记录 - 按保留策略执行一次分批清理与增量回收，输出回收的字节数
+
+已有的 SQLite 库如果创建时未启用增量回收（auto_vacuum=INCREMENTAL），需在停止服务后用
+--enable-incremental-vacuum 转换一次（执行完整 VACUUM，耗时与库大小成正比）。
+
+运行:
+    cd backend
+    python scripts/purge_chat_history.py --days 90 --max-messages 500
+    python scripts/purge_chat_history.py --enable-incremental-vacuum
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from core.database import SQLALCHEMY_DATABASE_URL, create_engine_for, create_session_factory
+from core.migrations import run_migrations
+from services.retention_service import ChatRetentionJob
+
+
+async def enable_incremental_vacuum(engine):
+    """把已有的 SQLite 库转换为增量回收模式"""
+    if engine.dialect.name != "sqlite":
+        print("只有 SQLite 需要转换，Postgres 由 autovacuum 回收空间")
+        return
+    async with engine.connect() as conn:
+        # VACUUM 不能在事务中执行
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+        await conn.exec_driver_sql("VACUUM")
+        mode = (await conn.exec_driver_sql("PRAGMA auto_vacuum")).scalar()
+    print(f"auto_vacuum = {mode}（2 表示增量模式）")
+
+
+async def main(args: argparse.Namespace):
+    engine = create_engine_for(args.url)
+    await run_migrations(engine)
+    if args.enable_incremental_vacuum:
+        await enable_incremental_vacuum(engine)
+
+    job = ChatRetentionJob(
+        session_factory=create_session_factory(engine),
+        engine=engine,
+        retention_days=args.days,
+        max_messages_per_session=args.max_messages,
+        batch_size=args.batch_size,
+        vacuum_pages=args.vacuum_pages
+    )
+    report = await job.run_once()
+    await engine.dispose()
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="按保留策略清理聊天记录")
+    parser.add_argument("--url", default=SQLALCHEMY_DATABASE_URL)
+    parser.add_argument("--days", type=float, default=0, help="删除最后更新早于该天数的会话（0 表示不按时间清理）")
+    parser.add_argument("--max-messages", type=int, default=0, help="每个会话最多保留的消息数（0 表示不限制）")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--vacuum-pages", type=int, default=0, help="增量回收的最大页数（0 表示全部）")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true", help="离线转换为增量回收模式")
+    asyncio.run(main(parser.parse_args()))
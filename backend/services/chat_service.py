@@ -1,22 +1,69 @@
+import base64
+import struct
+import time
 import uuid
-from typing import List, Optional
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, desc, func
-from models.chat import ChatSession, ChatMessage
+from sqlalchemy import select, delete, desc, func, and_, or_, update
+from models.chat import ChatSession, ChatMessage, utcnow
+from core.metrics import metrics
+from services.message_writer import MessageWriter, message_writer
+from services.retrieval_protocol import DOC_REF
+
+def encode_session_cursor(row: Any) -> str:
+    """会话列表游标：最后一行的 (updated_at, id)"""
+    raw = f"{row.updated_at.isoformat()}|{row.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_session_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        updated_at, session_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(updated_at), session_id
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"无效的分页游标: {cursor}") from e
+
+
+def encode_document_refs(documents: Optional[List[Dict[str, Any]]]) -> Optional[bytes]:
+    """把回答引用的文档按检索协议的文档引用格式压缩为 (parent_id, score) 序列，缺少 parent_id 的文档不保存"""
+    refs = []
+    for doc in documents or []:
+        try:
+            refs.append(DOC_REF.pack(bytes.fromhex(doc["parent_id"]), float(doc.get("score") or 0.0)))
+        except (KeyError, TypeError, ValueError, struct.error):
+            continue
+    return b"".join(refs) or None
+
+
+def decode_document_refs(data: Optional[bytes]) -> List[Tuple[str, float]]:
+    """按排名返回 (parent_id, score)"""
+    if not data:
+        return []
+    return [(parent_id.hex(), score) for parent_id, score in DOC_REF.iter_unpack(data)]
+
 
 class ChatService:
     """聊天服务 - 处理会话和消息的持久化"""
 
-    def __init__(self, db: AsyncSession):
+    def __init__(self, db: AsyncSession, writer: MessageWriter = None):
+        """
+        Args:
+            db: 数据库会话
+            writer: 消息延迟写入队列，默认使用进程内共享的 message_writer（压测时传入独立的队列）
+        """
         self.db = db
+        self.writer = writer or message_writer
 
     async def create_session(self, title: str = "新对话") -> ChatSession:
         """创建新会话"""
         session_id = str(uuid.uuid4())
         session = ChatSession(id=session_id, title=title)
+        start = time.perf_counter()
         self.db.add(session)
         await self.db.commit()
         await self.db.refresh(session)
+        metrics.observe("db_write_seconds", time.perf_counter() - start, op="create_session")
         return session
 
     async def get_session(self, session_id: str) -> Optional[ChatSession]:
@@ -24,36 +71,237 @@ class ChatService:
         result = await self.db.execute(select(ChatSession).where(ChatSession.id == session_id))
         return result.scalar_one_or_none()
     
-    async def get_all_sessions(self) -> List[ChatSession]:
-        """获取所有会话列表（按时间倒序）"""
-        result = await self.db.execute(select(ChatSession).order_by(desc(ChatSession.updated_at)))
-        return result.scalars().all()
+    async def list_sessions(self, limit: int = 50, cursor: Optional[str] = None,
+                            with_counts: bool = False) -> Tuple[List[Any], Optional[str]]:
+        """
+        按更新时间倒序分页获取会话列表
+
+        只查询会话列（不加载消息），由 (updated_at, id) 索引支撑游标分页。
 
-    async def add_message(self, session_id: str, role: str, content: str, image_url: str = None, meta_data: dict = None) -> ChatMessage:
-        """添加消息"""
+        Args:
+            limit: 每页条数
+            cursor: 上一页返回的游标，为空时从最新的会话开始
+            with_counts: 是否附带每个会话已落库的消息数（SQL 中按会话计数）
+
+        Returns:
+            (会话行 id/title/created_at/updated_at[/message_count], 下一页游标)
+
+        Raises:
+            ValueError: 游标格式错误
+        """
+        columns = [ChatSession.id, ChatSession.title, ChatSession.created_at, ChatSession.updated_at]
+        if with_counts:
+            columns.append(
+                select(func.count(ChatMessage.id))
+                .where(ChatMessage.session_id == ChatSession.id)
+                .scalar_subquery()
+                .label("message_count")
+            )
+        query = select(*columns)
+        if cursor:
+            updated_at, session_id = decode_session_cursor(cursor)
+            query = query.where(or_(
+                ChatSession.updated_at < updated_at,
+                and_(ChatSession.updated_at == updated_at, ChatSession.id < session_id)
+            ))
+        result = await self.db.execute(
+            query.order_by(desc(ChatSession.updated_at), desc(ChatSession.id)).limit(limit + 1)
+        )
+        rows = result.all()
+        next_cursor = encode_session_cursor(rows[limit - 1]) if len(rows) > limit else None
+        return rows[:limit], next_cursor
+
+    async def add_message(self, session_id: str, role: str, content: str, image_url: str = None,
+                          meta_data: dict = None, documents: List[Dict[str, Any]] = None) -> ChatMessage:
+        """
+        添加消息（延迟写入启用时只入队，由后台任务批量落库）
+
+        documents 为回答引用的文档，只保存 parent_id 与分数，读取时由 RAG 服务还原展示信息。
+        """
+        doc_refs = encode_document_refs(documents)
+        if self.writer.running:
+            return self.writer.enqueue(session_id, role, content, image_url=image_url, meta_data=meta_data,
+                                          doc_refs=doc_refs)
+
+        start = time.perf_counter()
         message = ChatMessage(
             session_id=session_id,
             role=role,
             content=content,
             image_url=image_url,
-            meta_data=meta_data
+            meta_data=meta_data,
+            doc_refs=doc_refs
         )
         self.db.add(message)
         
         # 更新会话时间
         session = await self.get_session(session_id)
         if session:
-            session.updated_at = func.now() # 使用数据库当前时间
+            session.updated_at = utcnow()
             
         await self.db.commit()
         await self.db.refresh(message)
+        metrics.observe("db_write_seconds", time.perf_counter() - start, op="add_message")
         return message
 
     async def get_history(self, session_id: str) -> List[ChatMessage]:
-        """获取会话历史消息"""
+        """获取会话历史消息（包含尚未落库的消息）"""
+        # 先取待写入快照再查询：查询期间提交的批次可能同时出现在两边，按内容去重
+        pending = self.writer.pending(session_id)
         result = await self.db.execute(
             select(ChatMessage)
             .where(ChatMessage.session_id == session_id)
             .order_by(ChatMessage.created_at)
         )
+        return self._with_pending(result.scalars().all(), pending)
+
+    async def delete_messages_batch(self, condition, limit: int, oldest_first: bool = False) -> int:
+        """
+        删除满足条件的一批消息并提交，返回删除条数
+
+        分批删除让每个写事务都很短，延迟写入的批量提交不会被长时间阻塞。
+        """
+        ids = select(ChatMessage.id).where(condition).limit(limit)
+        if oldest_first:
+            ids = ids.order_by(ChatMessage.created_at, ChatMessage.id)
+        start = time.perf_counter()
+        result = await self.db.execute(
+            delete(ChatMessage)
+            .where(ChatMessage.id.in_(ids.scalar_subquery()))
+            .execution_options(synchronize_session=False)
+        )
+        await self.db.commit()
+        metrics.observe("db_write_seconds", time.perf_counter() - start, op="delete_messages")
+        return result.rowcount
+
+    async def delete_session(self, session_id: str, batch_size: int = 1000) -> Optional[int]:
+        """
+        删除会话及其全部消息（含尚未落库的消息）
+
+        Returns:
+            删除的消息数，会话不存在时返回 None
+        """
+        deleted = await self.writer.discard(session_id)
+        while True:
+            count = await self.delete_messages_batch(ChatMessage.session_id == session_id, batch_size)
+            deleted += count
+            if count < batch_size:
+                break
+        result = await self.db.execute(
+            delete(ChatSession).where(ChatSession.id == session_id).execution_options(synchronize_session=False)
+        )
+        await self.db.commit()
+        # 删除期间又排入队列的消息（如进行中的流式回答结束）在会话删除后才会落库，再丢弃一次
+        deleted += await self.writer.discard(session_id)
+        if not result.rowcount and not deleted:
+            return None
+        return deleted
+
+    async def get_recent_history(self, session_id: str, n: int = 10) -> List[ChatMessage]:
+        """
+        获取会话最近 n 条消息（按时间正序），包含尚未落库的消息
+
+        由 (session_id, created_at) 复合索引支撑，开销与会话长度无关。
+        """
+        pending = self.writer.pending(session_id)
+        result = await self.db.execute(
+            select(ChatMessage)
+            .where(ChatMessage.session_id == session_id)
+            .order_by(desc(ChatMessage.created_at), desc(ChatMessage.id))
+            .limit(n)
+        )
+        messages = list(reversed(result.scalars().all()))
+        return self._with_pending(messages, pending)[-n:]
+
+    async def get_messages_page(self, session_id: str, limit: int = 50,
+                                before: Optional[int] = None) -> Tuple[List[ChatMessage], Optional[int]]:
+        """
+        按游标向前翻页获取消息
+
+        Args:
+            session_id: 会话ID
+            limit: 每页条数
+            before: 游标，返回该消息之前的消息；为空时返回最新一页（含尚未落库的消息）
+
+        Returns:
+            (按时间正序的消息, 下一页游标)，没有更早的消息时游标为空
+        """
+        pending = self.writer.pending(session_id) if before is None else []
+        query = select(ChatMessage).where(ChatMessage.session_id == session_id)
+        if before is not None:
+            cursor = await self.db.get(ChatMessage, before)
+            if cursor is None or cursor.session_id != session_id:
+                return [], None
+            query = query.where(or_(
+                ChatMessage.created_at < cursor.created_at,
+                and_(ChatMessage.created_at == cursor.created_at, ChatMessage.id < cursor.id)
+            ))
+        result = await self.db.execute(
+            query.order_by(desc(ChatMessage.created_at), desc(ChatMessage.id)).limit(limit + 1)
+        )
+        rows = result.scalars().all()
+        has_more = len(rows) > limit
+        messages = list(reversed(rows[:limit]))
+        next_cursor = messages[0].id if has_more else None
+        return self._with_pending(messages, pending), next_cursor
+
+    async def get_unsummarized_messages(self, session_id: str, after_id: Optional[int], keep_recent: int,
+                                        limit: int = 20) -> List[ChatMessage]:
+        """
+        获取尚未合并进摘要、且已移出最近 keep_recent 条窗口的已落库消息（按时间正序）
+
+        Args:
+            session_id: 会话ID
+            after_id: 摘要已覆盖到的消息ID
+            keep_recent: 最近保留原文的消息数（已扣除尚未落库的消息）
+            limit: 单次最多返回的消息数
+        """
+        recent = (
+            select(ChatMessage.id)
+            .where(ChatMessage.session_id == session_id)
+            .order_by(desc(ChatMessage.created_at), desc(ChatMessage.id))
+            .limit(keep_recent)
+        )
+        query = select(ChatMessage).where(ChatMessage.session_id == session_id)
+        if after_id is not None:
+            query = query.where(ChatMessage.id > after_id)
+        if keep_recent > 0:
+            query = query.where(ChatMessage.id.not_in(recent.scalar_subquery()))
+        result = await self.db.execute(query.order_by(ChatMessage.created_at, ChatMessage.id).limit(limit))
         return result.scalars().all()
+
+    async def update_summary(self, session_id: str, summary: str, summary_message_id: int,
+                             previous_message_id: Optional[int]) -> bool:
+        """
+        保存会话摘要；摘要已被其他任务更新时放弃（按之前覆盖到的消息ID做乐观并发控制）
+
+        Returns:
+            是否保存成功
+        """
+        if previous_message_id is None:
+            unchanged = ChatSession.summary_message_id.is_(None)
+        else:
+            unchanged = ChatSession.summary_message_id == previous_message_id
+        start = time.perf_counter()
+        result = await self.db.execute(
+            update(ChatSession)
+            .where(ChatSession.id == session_id, unchanged)
+            # 摘要刷新不改变会话的排序时间
+            .values(summary=summary, summary_message_id=summary_message_id, updated_at=ChatSession.updated_at)
+            .execution_options(synchronize_session=False)
+        )
+        await self.db.commit()
+        metrics.observe("db_write_seconds", time.perf_counter() - start, op="update_summary")
+        return result.rowcount > 0
+
+    @staticmethod
+    def _with_pending(messages: List[ChatMessage], pending: List[ChatMessage]) -> List[ChatMessage]:
+        """把未落库的消息接在已落库消息之后"""
+        if not pending:
+            return messages
+
+        def key(m: ChatMessage):
+            return m.role, m.content, m.created_at.replace(tzinfo=None) if m.created_at else None
+
+        persisted = {key(m) for m in messages}
+        return list(messages) + [m for m in pending if key(m) not in persisted]
@@ -1,35 +1,51 @@
+import asyncio
 import base64
 import io
 import os
 from pathlib import Path
+from typing import Optional
 from PIL import Image
-from openai import OpenAI
+from openai import AsyncOpenAI
 
+from core.http_client import get_async_http_client
 
-class ImageService:
-    """图片识别服务层"""
-    
-    def __init__(self):
-        self.client = OpenAI(
+_client: Optional[AsyncOpenAI] = None
+
+
+def get_vision_client() -> AsyncOpenAI:
+    """进程内共享的视觉模型客户端，底层复用共享连接池；连接池被关闭后随之重建"""
+    global _client
+    if _client is None or _client.is_closed():
+        _client = AsyncOpenAI(
             api_key=os.getenv("LLM_API_KEY"),
             base_url=os.getenv("LLM_BASE_URL"),
+            http_client=get_async_http_client()
         )
-    
-    def recognize_food(self, image_path: str) -> str:
+    return _client
+
+
+class ImageService:
+    """图片识别服务层"""
+
+    def __init__(self):
+        self.client = get_vision_client()
+
+    async def recognize_food(self, image_path: str) -> str:
         """
         调用API获取图片中的食物名称
-        
+
         Args:
             image_path: 图片路径
-            
+
         Returns:
             食物名称（逗号分隔）
         """
-        b64_img = self._image_to_webp_b64(image_path)
+        # 图片转码是CPU密集操作，放到线程池避免阻塞事件循环
+        b64_img = await asyncio.to_thread(self._image_to_webp_b64, image_path)
         if not b64_img:
             raise RuntimeError("图片读取失败，请检查路径或格式")
-        
-        response = self.client.chat.completions.create(
+
+        response = await self.client.chat.completions.create(
             model=os.getenv("LLM_MODEL_VL"),
             messages=[
                 {
@@ -52,16 +68,16 @@ class ImageService:
             stream=False,
             max_tokens=1000
         )
-        
+
         return response.choices[0].message.content
-    
+
     def _image_to_webp_b64(self, path: str) -> str:
         """
         把任意本地图片转换为 WebP 格式并 base64 编码
-        
+
         Args:
             path: 图片路径
-            
+
         Returns:
             base64 编码的 WebP 图片
         """
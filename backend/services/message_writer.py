@@ -0,0 +1,240 @@
+"""
+聊天消息延迟写入 - 请求路径只把消息放入内存队列，后台任务按批量或时间窗口合并为一次事务落库
+
+环境变量:
+    CHAT_WRITE_BEHIND        是否启用延迟写入（默认 1，关闭后每条消息同步提交）
+    CHAT_FLUSH_BATCH_SIZE    单个事务写入的最大消息数，队列达到该长度时立即落库（默认 64）
+    CHAT_FLUSH_INTERVAL_MS   队列中最早的消息最多等待的时长（默认 50）
+    CHAT_WRITE_QUEUE_MAX     队列最多缓存的消息数，数据库长时间不可用时丢弃最早的消息（默认 10000）
+    CHAT_WRITE_MAX_RETRIES   同一批次连续写入失败的最大次数，超过后丢弃该批次（默认 10）
+
+尚未落库的消息由 pending() 提供给历史查询，同一进程内的后续请求可以读到自己刚写入的消息。
+进程正常退出时 stop() 会写完队列中的消息；进程被强制杀死时最多丢失一个时间窗口内的消息。
+违反约束的消息（如会话已被删除）逐条重试后丢弃，不会阻塞队列；丢弃的消息计入 chat_write_dropped_total。
+"""
+
+import asyncio
+import os
+import time
+from typing import Callable, List, Optional
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from core.database import AsyncSessionLocal
+from core.metrics import metrics
+from models.chat import ChatMessage, ChatSession, utcnow
+
+
+def write_behind_enabled() -> bool:
+    return os.getenv("CHAT_WRITE_BEHIND", "1").lower() not in ("0", "false")
+
+
+class MessageWriter:
+    """批量落库的消息写入队列（每个进程一个实例）"""
+
+    def __init__(self, session_factory: Callable = AsyncSessionLocal, batch_size: int = 64,
+                 flush_interval: float = 0.05, max_backoff: float = 5.0, max_queue: int = 10000,
+                 max_retries: int = 10):
+        """
+        Args:
+            session_factory: 数据库会话工厂
+            batch_size: 单个事务写入的最大消息数
+            flush_interval: 时间窗口（秒）
+            max_backoff: 写入失败后重试的最长间隔（秒）
+            max_queue: 队列最多缓存的消息数
+            max_retries: 同一批次连续写入失败的最大次数
+        """
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self._queue: List[ChatMessage] = []
+        self._inflight: List[ChatMessage] = []
+        self._has_pending = asyncio.Event()
+        self._batch_full = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._failures = 0
+
+    @classmethod
+    def from_env(cls) -> 'MessageWriter':
+        return cls(
+            batch_size=int(os.getenv("CHAT_FLUSH_BATCH_SIZE", 64)),
+            flush_interval=float(os.getenv("CHAT_FLUSH_INTERVAL_MS", 50)) / 1000,
+            max_queue=int(os.getenv("CHAT_WRITE_QUEUE_MAX", 10000)),
+            max_retries=int(os.getenv("CHAT_WRITE_MAX_RETRIES", 10))
+        )
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """在事件循环中启动后台落库任务"""
+        if not self.running:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """停止后台任务并写完队列中剩余的消息"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if self._queue:
+            print(f"❌ 关闭时仍有 {len(self._queue)} 条消息未能落库")
+
+    def enqueue(self, session_id: str, role: str, content: str, image_url: str = None,
+                meta_data: dict = None, doc_refs: bytes = None) -> ChatMessage:
+        """
+        把消息放入写入队列，立即返回未落库的消息对象（id 为空）
+
+        created_at 在入队时确定，批量写入后消息顺序与入队顺序一致。
+        """
+        message = ChatMessage(
+            session_id=session_id,
+            role=role,
+            content=content,
+            image_url=image_url,
+            meta_data=meta_data,
+            doc_refs=doc_refs,
+            created_at=utcnow()
+        )
+        self._queue.append(message)
+        if len(self._queue) > self.max_queue:
+            # 数据库长时间不可用时限制内存占用，丢弃最早的消息
+            overflow = len(self._queue) - self.max_queue
+            del self._queue[:overflow]
+            self._drop(overflow, "queue_full")
+        metrics.set_gauge("chat_write_queue_depth", len(self._queue))
+        self._has_pending.set()
+        if len(self._queue) >= self.batch_size:
+            self._batch_full.set()
+        return message
+
+    def pending(self, session_id: str) -> List[ChatMessage]:
+        """某个会话中尚未提交的消息（含正在写入的批次），按入队顺序"""
+        return [m for m in self._inflight + self._queue if m.session_id == session_id]
+
+    async def discard(self, session_id: str) -> int:
+        """
+        丢弃某个会话尚未写入的消息（会话被删除时），返回丢弃的条数
+
+        正在写入的批次中有该会话的消息时等待其提交，调用方随后删除消息即可一并删除。
+        """
+        kept = [m for m in self._queue if m.session_id != session_id]
+        dropped = len(self._queue) - len(kept)
+        self._queue = kept
+        metrics.set_gauge("chat_write_queue_depth", len(self._queue))
+        if any(m.session_id == session_id for m in self._inflight):
+            async with self._flush_lock:
+                pass
+        return dropped
+
+    async def _run(self):
+        while True:
+            await self._has_pending.wait()
+            try:
+                await asyncio.wait_for(self._batch_full.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+            if self._failures:
+                # 数据库不可用时退避，消息保留在队列中
+                await asyncio.sleep(min(self.flush_interval * 2 ** self._failures, self.max_backoff))
+
+    async def flush(self):
+        """把队列中的消息分批写入数据库，每批一个事务"""
+        async with self._flush_lock:
+            while self._queue:
+                batch = self._queue[:self.batch_size]
+                del self._queue[:len(batch)]
+                self._inflight = batch
+                try:
+                    try:
+                        await self._write(batch)
+                    except IntegrityError:
+                        # 批次中有违反约束的消息，逐条写入找出并丢弃，其余消息照常落库
+                        await self._write_each(batch)
+                    self._failures = 0
+                except Exception as e:
+                    self._failures += 1
+                    metrics.inc("chat_write_failures_total")
+                    if self._failures >= self.max_retries:
+                        self._drop(len(batch), "retries_exhausted")
+                        print(f"❌ 消息批量写入连续失败 {self._failures} 次，丢弃 {len(batch)} 条消息: {e}")
+                        self._failures = 0
+                        continue
+                    self._queue[0:0] = batch
+                    print(f"❌ 消息批量写入失败（第 {self._failures} 次），{len(self._queue)} 条消息等待重试: {e}")
+                    break
+                finally:
+                    self._inflight = []
+            metrics.set_gauge("chat_write_queue_depth", len(self._queue))
+            if len(self._queue) < self.batch_size:
+                self._batch_full.clear()
+            if not self._queue:
+                self._has_pending.clear()
+
+    async def _write_each(self, batch: List[ChatMessage]):
+        """
+        逐条写入，违反约束的消息直接丢弃
+
+        已写入或丢弃的消息从 batch 中移除，遇到其他错误时 batch 中只剩尚未写入的消息。
+        """
+        while batch:
+            message = batch[0]
+            try:
+                await self._write([message])
+            except IntegrityError as e:
+                self._drop(1, "integrity_error")
+                print(f"❌ 消息违反约束已丢弃（会话 {message.session_id}）: {e.orig}")
+            batch.pop(0)
+
+    def _drop(self, count: int, reason: str):
+        metrics.inc("chat_write_dropped_total", count, reason=reason)
+
+    async def _write(self, batch: List[ChatMessage]):
+        start = time.perf_counter()
+        rows = [{
+            "session_id": m.session_id,
+            "role": m.role,
+            "content": m.content,
+            "image_url": m.image_url,
+            "meta_data": m.meta_data,
+            "doc_refs": m.doc_refs,
+            "created_at": m.created_at
+        } for m in batch]
+        session_ids = {m.session_id for m in batch}
+        async with self.session_factory() as db:
+            async with db.begin():
+                # 会话已被删除（其他 worker 或保留策略清理）的消息直接丢弃，不写入孤立消息
+                existing = set((await db.execute(
+                    select(ChatSession.id).where(ChatSession.id.in_(session_ids))
+                )).scalars().all())
+                if len(existing) < len(session_ids):
+                    orphans = [row for row in rows if row["session_id"] not in existing]
+                    rows = [row for row in rows if row["session_id"] in existing]
+                    self._drop(len(orphans), "session_deleted")
+                    session_ids = existing
+                if not rows:
+                    return
+                await db.execute(insert(ChatMessage), rows)
+                # 同一批次涉及的会话只更新一次 updated_at
+                await db.execute(
+                    update(ChatSession)
+                    .where(ChatSession.id.in_(session_ids))
+                    .values(updated_at=utcnow())
+                    .execution_options(synchronize_session=False)
+                )
+        metrics.observe("db_write_seconds", time.perf_counter() - start, op="flush_messages")
+        metrics.observe("chat_write_batch_size", len(batch))
+
+
+message_writer = MessageWriter.from_env()
@@ -4,6 +4,7 @@ import sys
 
 sys.path.append(str(Path(__file__).parent.parent))
 from core.rag_system import RecipeRAGSystem
+from core.deadline import Deadline
 
 
 class RAGService:
@@ -12,15 +13,21 @@ class RAGService:
     def __init__(self):
         self.rag = RecipeRAGSystem()
     
+    def create_deadline(self, timeout_ms: Optional[str] = None) -> Deadline:
+        """按请求头中的预算（毫秒）创建截止时间，未指定时使用配置的默认预算"""
+        return Deadline.from_header(timeout_ms, self.rag.config.request_deadline)
+
     def get_statistics(self) -> Dict[str, Any]:
         """获取知识库统计信息"""
         return self.rag.get_statistics()
     
-    def ask_question(
+    async def ask_question(
         self, 
         question: str, 
         chat_history: List[Dict[str, Any]] = None,
-        stream: bool = False
+        stream: bool = False,
+        deadline: Optional[Deadline] = None,
+        summary: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         提问接口
@@ -28,13 +35,37 @@ class RAGService:
         Args:
             question: 用户问题
             stream: 是否流式返回
+            deadline: 请求截止时间
+            summary: 会话滚动摘要
             
         Returns:
             回答结果
         """
-        return self.rag.ask_question(question, chat_history=chat_history, stream=stream)
+        return await self.rag.ask_question(
+            question, chat_history=chat_history, stream=stream, deadline=deadline, summary=summary
+        )
+
+    @property
+    def history_window(self) -> int:
+        """需要从数据库读取的最近消息数"""
+        return self.rag.history_window
+
+    def message_documents(self, message) -> Optional[List[Dict[str, Any]]]:
+        """按当前知识库还原消息引用的文档（旧消息直接使用 meta_data 中保存的文档信息）"""
+        if message.doc_refs:
+            from services.chat_service import decode_document_refs
+            return self.rag.resolve_documents(decode_document_refs(message.doc_refs))
+        if message.meta_data:
+            return message.meta_data.get("documents")
+        return None
+
+    def refresh_summary(self, session_id: str):
+        """本轮对话结束后在后台刷新会话摘要"""
+        if self.rag.config.conversation_summary_enabled:
+            from services.summary_service import conversation_summarizer
+            conversation_summarizer.schedule(session_id, self.rag)
     
-    def search_by_category(
+    async def search_by_category(
         self, 
         category: str, 
         query: str = ""
@@ -49,7 +80,7 @@ class RAGService:
         Returns:
             菜品列表
         """
-        return self.rag.search_by_category(category, query)
+        return await self.rag.search_by_category(category, query)
     
     def get_categories(self) -> List[str]:
         """获取支持的分类列表"""
@@ -61,7 +92,15 @@ class RAGService:
         from rag_modules import DataPreparationModule
         return DataPreparationModule.get_supported_difficulties()
     
-    def ask_with_image(
+    def rebuild_index(self) -> Dict[str, Any]:
+        """后台构建新的索引代际，完成后自动切换"""
+        return self.rag.index_manager.start_rebuild()
+
+    def get_index_status(self) -> Dict[str, Any]:
+        """获取索引构建进度与当前代际"""
+        return self.rag.index_manager.get_status()
+    
+    async def ask_with_image(
         self, 
         question: str, 
         image_name: Optional[str] = None
@@ -86,7 +125,7 @@ class RAGService:
         if not image_path.exists():
             raise ValueError("图片不存在")
         
-        food_name = image_service.recognize_food(image_path)
+        food_name = await image_service.recognize_food(image_path)
         
         if food_name == "没有食材":
             raise ValueError("图片中没有食材")
@@ -0,0 +1,252 @@
+"""
+聊天记录保留策略 - 后台定期分批清理过期会话与超长会话中最早的消息，并增量回收 SQLite 空闲页
+
+环境变量:
+    CHAT_RETENTION_DAYS              会话最后更新超过该天数后整体删除（默认 0，不按时间清理）
+    CHAT_RETENTION_MAX_MESSAGES      每个会话最多保留的消息数，超出时删除最早的消息（默认 0，不限制）
+    CHAT_PURGE_INTERVAL_SECONDS      清理间隔（默认 3600）
+    CHAT_PURGE_BATCH_SIZE            单个删除事务的最大消息数（默认 500）
+    CHAT_PURGE_PAUSE_MS              两个删除事务之间的间隔，让出写锁给正常写入（默认 50）
+    CHAT_VACUUM_PAGES                每次增量回收的最大页数（默认 0，回收全部空闲页）
+
+每次运行的结果（删除数量、回收字节数）记录在 last_report 并输出到日志与指标。
+"""
+
+import asyncio
+import os
+import time
+from datetime import timedelta
+from typing import Any, Callable, Dict, Optional
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from core.database import AsyncSessionLocal, engine as default_engine
+from core.metrics import metrics
+from models.chat import ChatMessage, ChatSession, utcnow
+from services.chat_service import ChatService
+from services.message_writer import message_writer
+
+
+class ChatRetentionJob:
+    """按保留策略分批清理聊天记录的后台任务"""
+
+    def __init__(self, session_factory: Callable = AsyncSessionLocal, engine: AsyncEngine = default_engine,
+                 retention_days: float = 0, max_messages_per_session: int = 0, interval: float = 3600.0,
+                 batch_size: int = 500, pause: float = 0.05, vacuum_pages: int = 0):
+        """
+        Args:
+            session_factory: 数据库会话工厂
+            engine: 数据库引擎（统计库大小与增量回收）
+            retention_days: 会话保留天数，0 表示不按时间清理
+            max_messages_per_session: 每个会话保留的消息数，0 表示不限制
+            interval: 清理间隔（秒）
+            batch_size: 单个删除事务的最大消息数
+            pause: 删除事务之间的间隔（秒）
+            vacuum_pages: 每次增量回收的最大页数，0 表示全部
+        """
+        self.session_factory = session_factory
+        self.engine = engine
+        self.retention_days = retention_days
+        self.max_messages_per_session = max_messages_per_session
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.vacuum_pages = vacuum_pages
+        self.last_report: Optional[Dict[str, Any]] = None
+        self._running = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_env(cls) -> 'ChatRetentionJob':
+        return cls(
+            retention_days=float(os.getenv("CHAT_RETENTION_DAYS", 0)),
+            max_messages_per_session=int(os.getenv("CHAT_RETENTION_MAX_MESSAGES", 0)),
+            interval=float(os.getenv("CHAT_PURGE_INTERVAL_SECONDS", 3600)),
+            batch_size=int(os.getenv("CHAT_PURGE_BATCH_SIZE", 500)),
+            pause=float(os.getenv("CHAT_PURGE_PAUSE_MS", 50)) / 1000,
+            vacuum_pages=int(os.getenv("CHAT_VACUUM_PAGES", 0))
+        )
+
+    @property
+    def is_running(self) -> bool:
+        return self._running.locked()
+
+    def policy(self) -> Dict[str, Any]:
+        return {
+            "retention_days": self.retention_days,
+            "max_messages_per_session": self.max_messages_per_session,
+            "interval_seconds": self.interval,
+            "batch_size": self.batch_size
+        }
+
+    def start(self):
+        """启动定期清理任务，必须在事件循环中调用"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                metrics.inc("chat_purge_runs_total", result="error")
+                print(f"❌ 聊天记录清理失败: {e}")
+
+    async def run_once(self) -> Dict[str, Any]:
+        """
+        执行一次清理与增量回收
+
+        Returns:
+            本次运行报告
+        """
+        async with self._running:
+            start = time.perf_counter()
+            size_before = await self.database_size()
+            async with self.session_factory() as db:
+                service = ChatService(db)
+                sessions, expired_messages = await self._purge_expired(service)
+                trimmed = await self._trim_long_sessions(service)
+                orphans = await self._purge_orphans(service)
+            vacuum = await self._vacuum()
+            size_after = await self.database_size()
+
+            report = {
+                "sessions_deleted": sessions,
+                "messages_deleted": expired_messages + trimmed + orphans,
+                "messages_trimmed": trimmed,
+                "orphan_messages_deleted": orphans,
+                "vacuum": vacuum,
+                "bytes_before": size_before["bytes"],
+                "bytes_after": size_after["bytes"],
+                "bytes_reclaimed": max(size_before["bytes"] - size_after["bytes"], 0),
+                "free_bytes": size_after["free_bytes"],
+                "elapsed_seconds": round(time.perf_counter() - start, 3),
+                "finished_at": utcnow().isoformat()
+            }
+            self.last_report = report
+            metrics.inc("chat_purge_runs_total", result="ok")
+            metrics.inc("chat_purge_deleted_total", sessions, kind="sessions")
+            metrics.inc("chat_purge_deleted_total", report["messages_deleted"], kind="messages")
+            metrics.inc("chat_purge_bytes_reclaimed_total", report["bytes_reclaimed"])
+            metrics.set_gauge("chat_db_size_bytes", report["bytes_after"])
+            metrics.observe("chat_purge_seconds", report["elapsed_seconds"])
+            print(f"🧹 聊天记录清理：删除会话 {sessions}、消息 {report['messages_deleted']}，"
+                  f"回收 {report['bytes_reclaimed']} 字节（库大小 {report['bytes_after']}，空闲 {report['free_bytes']}），"
+                  f"耗时 {report['elapsed_seconds']}s")
+            return report
+
+    async def _delete_batches(self, service: ChatService, condition, oldest_first: bool = False,
+                              limit: Optional[int] = None) -> int:
+        """分批删除满足条件的消息，批次之间让出写锁；limit 为本次最多删除的条数"""
+        deleted = 0
+        while limit is None or deleted < limit:
+            batch = self.batch_size if limit is None else min(self.batch_size, limit - deleted)
+            count = await service.delete_messages_batch(condition, batch, oldest_first=oldest_first)
+            deleted += count
+            if count < batch:
+                break
+            await asyncio.sleep(self.pause)
+        return deleted
+
+    async def _purge_expired(self, service: ChatService):
+        """删除最后更新早于保留期限的会话"""
+        if self.retention_days <= 0:
+            return 0, 0
+        cutoff = utcnow() - timedelta(days=self.retention_days)
+        sessions = messages = 0
+        while True:
+            result = await service.db.execute(
+                select(ChatSession.id).where(ChatSession.updated_at < cutoff).limit(100)
+            )
+            ids = result.scalars().all()
+            if not ids:
+                return sessions, messages
+            # 还有消息等待落库的会话即将更新，本次不删除
+            ids = [session_id for session_id in ids if not message_writer.pending(session_id)]
+            if not ids:
+                return sessions, messages
+            messages += await self._delete_batches(service, ChatMessage.session_id.in_(ids))
+            # 清理期间又有新消息的会话不删除
+            result = await service.db.execute(
+                delete(ChatSession)
+                .where(ChatSession.id.in_(ids), ChatSession.updated_at < cutoff)
+                .execution_options(synchronize_session=False)
+            )
+            await service.db.commit()
+            sessions += result.rowcount
+            if result.rowcount < len(ids):
+                return sessions, messages
+            await asyncio.sleep(self.pause)
+
+    async def _trim_long_sessions(self, service: ChatService) -> int:
+        """删除超出每会话消息上限的最早消息"""
+        if self.max_messages_per_session <= 0:
+            return 0
+        trimmed = 0
+        while True:
+            result = await service.db.execute(
+                select(ChatMessage.session_id, func.count(ChatMessage.id))
+                .group_by(ChatMessage.session_id)
+                .having(func.count(ChatMessage.id) > self.max_messages_per_session)
+                .limit(100)
+            )
+            over_limit = result.all()
+            if not over_limit:
+                return trimmed
+            before = trimmed
+            for session_id, count in over_limit:
+                trimmed += await self._delete_batches(
+                    service, ChatMessage.session_id == session_id, oldest_first=True,
+                    limit=count - self.max_messages_per_session
+                )
+            if trimmed == before:
+                return trimmed
+
+    async def _purge_orphans(self, service: ChatService) -> int:
+        """删除会话已不存在的消息（会话删除时恰好在写入的延迟批次）"""
+        return await self._delete_batches(service, ChatMessage.session_id.not_in(select(ChatSession.id)))
+
+    async def database_size(self) -> Dict[str, int]:
+        """库占用的字节数与其中可复用的空闲字节数"""
+        async with self.engine.connect() as conn:
+            if self.engine.dialect.name == "sqlite":
+                page_size = (await conn.exec_driver_sql("PRAGMA page_size")).scalar()
+                page_count = (await conn.exec_driver_sql("PRAGMA page_count")).scalar()
+                freelist = (await conn.exec_driver_sql("PRAGMA freelist_count")).scalar()
+                return {"bytes": page_size * page_count, "free_bytes": page_size * freelist}
+            if self.engine.dialect.name == "postgresql":
+                size = (await conn.exec_driver_sql("SELECT pg_database_size(current_database())")).scalar()
+                return {"bytes": size, "free_bytes": 0}
+        return {"bytes": 0, "free_bytes": 0}
+
+    async def _vacuum(self) -> str:
+        """SQLite 增量回收空闲页；Postgres 由 autovacuum 负责"""
+        if self.engine.dialect.name != "sqlite":
+            return "autovacuum"
+        async with self.engine.connect() as conn:
+            mode = (await conn.exec_driver_sql("PRAGMA auto_vacuum")).scalar()
+            if mode != 2:
+                # 库创建时未启用增量模式，需离线转换一次
+                return "unavailable"
+            pages = f"({self.vacuum_pages})" if self.vacuum_pages else ""
+            await conn.commit()
+            # 该 PRAGMA 每执行一步回收一页，普通 execute 只执行一步；executescript 会执行到底
+            raw = await conn.get_raw_connection()
+            await raw.driver_connection.executescript(f"PRAGMA incremental_vacuum{pages};")
+            # WAL 模式下回收的页在检查点后才从文件中截掉
+            (await conn.exec_driver_sql("PRAGMA wal_checkpoint(PASSIVE)")).fetchall()
+        return "incremental"
+
+
+chat_retention_job = ChatRetentionJob.from_env()
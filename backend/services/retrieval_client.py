@@ -0,0 +1,183 @@
+"""
+检索服务异步客户端与远程检索模块
+"""
+
+import asyncio
+import itertools
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from core.metrics import metrics
+from services import retrieval_protocol as protocol
+
+logger = logging.getLogger(__name__)
+
+
+class RetrievalServiceClient:
+    """单连接多路复用的检索服务客户端，并发请求按 request_id 区分"""
+
+    def __init__(self, address: str, timeout: float = 10.0):
+        """
+        初始化客户端（首次调用时才建立连接）
+
+        Args:
+            address: 服务地址，unix:///path 或 tcp://host:port
+            timeout: 单次请求超时（秒）
+        """
+        self.address = address
+        self.timeout = timeout
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._loop = None
+        self._connect_lock: Optional[asyncio.Lock] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._ids = itertools.count(1)
+
+    async def _ensure_connected(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # 事件循环变化（如 fork 后的新 worker）时丢弃旧连接；旧连接属于旧循环，只能丢弃不能关闭
+            self._loop = loop
+            self._connect_lock = asyncio.Lock()
+            self._reader, self._writer, self._reader_task = None, None, None
+        if self._writer is not None and not self._writer.is_closing():
+            return
+        async with self._connect_lock:
+            if self._writer is not None and not self._writer.is_closing():
+                return
+            kind, target = protocol.parse_address(self.address)
+            if kind == "unix":
+                self._reader, self._writer = await asyncio.open_unix_connection(target)
+            else:
+                self._reader, self._writer = await asyncio.open_connection(target[0], target[1])
+            self._reader_task = loop.create_task(self._read_loop(self._reader, self._writer))
+            logger.info(f"已连接检索服务: {self.address}")
+
+    async def _read_loop(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                op, request_id, body = await protocol.read_frame(reader)
+                future = self._pending.pop(request_id, None)
+                if future is None or future.done():
+                    continue
+                if op == protocol.OP_ERROR:
+                    future.set_exception(RuntimeError(f"检索服务错误: {body.decode('utf-8', 'replace')}"))
+                else:
+                    future.set_result(body)
+        except Exception as e:
+            # 连接断开，所有等待中的请求失败，下次调用时重连
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError(f"检索服务连接断开: {e}"))
+            self._pending.clear()
+            writer.close()
+            # 期间可能已重连，只清除本读循环对应的连接
+            if self._writer is writer:
+                self._writer = None
+
+    async def _request(self, op: int, body: bytes) -> bytes:
+        await self._ensure_connected()
+        request_id = next(self._ids) & 0xFFFFFFFF
+        future = self._loop.create_future()
+        self._pending[request_id] = future
+        self._writer.write(protocol.encode_frame(op, request_id, body))
+        await self._writer.drain()
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def search(self, queries: List[str], top_k: int, filters: Optional[Dict[str, Any]] = None,
+                     bm25_only: bool = False) -> Tuple[str, List[List[Tuple[str, int, float]]]]:
+        """
+        批量检索（bm25_only 时服务端跳过向量化与向量检索）
+
+        Returns:
+            (服务端代际ID, 每条查询的命中列表[(parent_id, chunk_index, score)])
+        """
+        body = await self._request(protocol.OP_SEARCH, protocol.encode_search_request(queries, top_k, filters, bm25_only))
+        return protocol.decode_search_response(body)
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        """批量计算文本向量"""
+        body = await self._request(protocol.OP_EMBED, protocol.encode_embed_request(texts))
+        return protocol.decode_embed_response(body)
+
+    async def close(self):
+        writer, self._writer = self._writer, None
+        if writer:
+            writer.close()
+        if self._reader_task:
+            self._reader_task.cancel()
+
+
+class RemoteRetrievalModule:
+    """远程检索模块 - 接口与 RetrievalOptimizationModule 的异步方法一致，命中引用在本地语料中解析"""
+
+    def __init__(self, client: RetrievalServiceClient, data_module,
+                 on_generation_change: Callable[[str], None] = None, corpus_generation: Optional[str] = None):
+        """
+        初始化远程检索模块
+
+        Args:
+            client: 检索服务客户端
+            data_module: 已加载文档与分块的数据准备模块
+            on_generation_change: 服务端代际变化时的回调
+            corpus_generation: 本地语料所属的代际（从该代际的语料文件加载时），本地重新分块时为空
+        """
+        self.client = client
+        self.data_module = data_module
+        self.on_generation_change = on_generation_change
+        self.corpus_generation = corpus_generation
+        self.service_generation: Optional[str] = None
+        self._parents: Dict[str, Document] = {
+            doc.metadata["parent_id"]: doc for doc in data_module.documents if doc.metadata.get("parent_id")
+        }
+        self._refs: Dict[Tuple[str, int], Document] = {}
+        for chunk in data_module.chunks:
+            parent_id = chunk.metadata.get("parent_id")
+            if chunk.metadata.get("doc_type") == "child":
+                self._refs[(parent_id, chunk.metadata.get("chunk_index"))] = chunk
+            else:
+                self._refs[(parent_id, protocol.WHOLE_PARENT)] = chunk
+
+    async def ahybrid_search(self, query: str, top_k: int = 3, query_embedding=None,
+                             bm25_only: bool = False) -> List[Document]:
+        # 查询向量由检索服务批量计算，本地传入的向量忽略；BM25 降级随请求发给服务端
+        return await self._search(query, top_k, None, bm25_only)
+
+    async def ametadata_filtered_search(self, query: str, filters: Dict[str, Any], top_k: int = 3,
+                                        query_embedding=None, bm25_only: bool = False) -> List[Document]:
+        return await self._search(query, top_k, filters, bm25_only)
+
+    async def _search(self, query: str, top_k: int, filters: Optional[Dict[str, Any]],
+                      bm25_only: bool = False) -> List[Document]:
+        generation_id, results = await self.client.search([query], top_k, filters, bm25_only)
+        if generation_id != self.service_generation:
+            previous, self.service_generation = self.service_generation, generation_id
+            if previous is not None and self.on_generation_change:
+                self.on_generation_change(generation_id)
+
+        # 块序号只在同一代际的语料中有意义：本地语料与服务端代际不一致（或本地重新分块）时，
+        # 同一序号可能指向别的段落，此时退化为返回整篇父文档
+        exact = self.corpus_generation is not None and generation_id == self.corpus_generation
+        if not exact:
+            metrics.inc("retrieval_ref_fallback_total")
+        docs = []
+        seen_parents = set()
+        for parent_id, chunk_index, score in results[0]:
+            if exact:
+                chunk = self._refs.get((parent_id, chunk_index))
+            elif parent_id in seen_parents:
+                continue
+            else:
+                chunk = self._parents.get(parent_id)
+                seen_parents.add(parent_id)
+            if chunk is None:
+                # 本地语料尚未同步到服务端代际
+                continue
+            docs.append(Document(page_content=chunk.page_content, metadata={**chunk.metadata, "rrf_score": score}))
+        return docs
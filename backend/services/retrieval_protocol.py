@@ -0,0 +1,185 @@
+"""
+检索服务二进制协议
+
+帧格式（网络字节序）:
+    头部 10 字节: version(u8) | op(u8) | request_id(u32) | body_len(u32)
+    随后 body_len 字节的消息体
+
+SEARCH 请求体:  top_k(u16) | flags(u8) | n(u16) | n × [len(u32) | utf-8 查询] | len(u32) | 过滤条件 JSON
+SEARCH 响应体:  len(u8) | 代际ID | n(u16) | n × [hits(u16) | hits × 命中]
+    命中 22 字节: parent_id(md5 16字节) | chunk_index(u16) | score(f32)
+EMBED 请求体:   n(u16) | n × [len(u32) | utf-8 文本]
+EMBED 响应体:   n(u16) | dim(u16) | n × dim 个 f32
+
+SEARCH 标志位: 0x01 只做 BM25 检索（请求时间预算不足时跳过向量化与向量检索）
+
+计数与块序号超出 u16 范围时编码端直接报错，不会被静默截断。
+
+文档引用 20 字节: parent_id(md5 16字节) | score(f32)，与命中的父文档ID编码一致，聊天记录按排名顺序保存
+"""
+
+import asyncio
+import json
+import struct
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+PROTOCOL_VERSION = 3
+
+OP_SEARCH = 1
+OP_EMBED = 2
+OP_RESULT = 0x80
+OP_ERROR = 0xFF
+
+SEARCH_BM25_ONLY = 0x01
+
+# 父文档未能按标题分割时整体作为一个chunk，用该值表示
+WHOLE_PARENT = 0xFFFF
+
+HEADER = struct.Struct("!BBII")
+HIT = struct.Struct("!16sHf")
+DOC_REF = struct.Struct("!16sf")
+U16 = struct.Struct("!H")
+U32 = struct.Struct("!I")
+
+# 单帧最大 16MB，防止异常长度导致内存耗尽
+MAX_BODY = 16 * 1024 * 1024
+
+
+class ProtocolError(Exception):
+    """检索服务协议错误"""
+    pass
+
+
+def parse_address(address: str) -> Tuple[str, Any]:
+    """
+    解析服务地址
+
+    Args:
+        address: unix:///path/to.sock 或 tcp://host:port
+
+    Returns:
+        ("unix", path) 或 ("tcp", (host, port))
+    """
+    parsed = urlparse(address)
+    if parsed.scheme == "unix":
+        return "unix", parsed.path
+    if parsed.scheme == "tcp":
+        return "tcp", (parsed.hostname or "127.0.0.1", parsed.port or 8765)
+    raise ValueError(f"不支持的检索服务地址: {address}")
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Tuple[int, int, bytes]:
+    """读取一帧，返回 (op, request_id, body)"""
+    header = await reader.readexactly(HEADER.size)
+    version, op, request_id, body_len = HEADER.unpack(header)
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"协议版本不匹配: {version}")
+    if body_len > MAX_BODY:
+        raise ProtocolError(f"消息体过大: {body_len}")
+    body = await reader.readexactly(body_len) if body_len else b""
+    return op, request_id, body
+
+
+def encode_frame(op: int, request_id: int, body: bytes = b"") -> bytes:
+    return HEADER.pack(PROTOCOL_VERSION, op, request_id, len(body)) + body
+
+
+def _u16(value: int, field: str) -> bytes:
+    """按 u16 编码计数或序号，超出范围时报错而不是截断"""
+    if not 0 <= value <= 0xFFFF:
+        raise ProtocolError(f"{field} 超出 u16 范围: {value}")
+    return U16.pack(value)
+
+
+def _pack_strings(texts: List[str]) -> bytes:
+    parts = [_u16(len(texts), "文本数")]
+    for text in texts:
+        data = text.encode("utf-8")
+        parts.append(U32.pack(len(data)))
+        parts.append(data)
+    return b"".join(parts)
+
+
+def _unpack_strings(body: bytes, offset: int = 0) -> Tuple[List[str], int]:
+    (count,) = U16.unpack_from(body, offset)
+    offset += U16.size
+    texts = []
+    for _ in range(count):
+        (length,) = U32.unpack_from(body, offset)
+        offset += U32.size
+        texts.append(body[offset:offset + length].decode("utf-8"))
+        offset += length
+    return texts, offset
+
+
+def encode_search_request(queries: List[str], top_k: int, filters: Optional[Dict[str, Any]] = None,
+                          bm25_only: bool = False) -> bytes:
+    filters_data = json.dumps(filters or {}, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    flags = SEARCH_BM25_ONLY if bm25_only else 0
+    return (_u16(top_k, "top_k") + bytes([flags]) + _pack_strings(queries)
+            + U32.pack(len(filters_data)) + filters_data)
+
+
+def decode_search_request(body: bytes) -> Tuple[List[str], int, Dict[str, Any], bool]:
+    (top_k,) = U16.unpack_from(body, 0)
+    flags = body[U16.size]
+    queries, offset = _unpack_strings(body, U16.size + 1)
+    (length,) = U32.unpack_from(body, offset)
+    offset += U32.size
+    filters = json.loads(body[offset:offset + length].decode("utf-8")) if length else {}
+    return queries, top_k, filters, bool(flags & SEARCH_BM25_ONLY)
+
+
+def encode_search_response(generation_id: str, results: List[List[Tuple[str, int, float]]]) -> bytes:
+    gen = generation_id.encode("ascii")
+    parts = [bytes([len(gen)]), gen, _u16(len(results), "查询数")]
+    for hits in results:
+        parts.append(_u16(len(hits), "命中数"))
+        for parent_id, chunk_index, score in hits:
+            # 子块序号不能与表示整篇父文档的 WHOLE_PARENT 冲突
+            if chunk_index != WHOLE_PARENT and not 0 <= chunk_index < WHOLE_PARENT:
+                raise ProtocolError(f"块序号超出范围: {chunk_index}")
+            parts.append(HIT.pack(bytes.fromhex(parent_id), chunk_index, score))
+    return b"".join(parts)
+
+
+def decode_search_response(body: bytes) -> Tuple[str, List[List[Tuple[str, int, float]]]]:
+    gen_len = body[0]
+    generation_id = body[1:1 + gen_len].decode("ascii")
+    offset = 1 + gen_len
+    (count,) = U16.unpack_from(body, offset)
+    offset += U16.size
+    results = []
+    for _ in range(count):
+        (n_hits,) = U16.unpack_from(body, offset)
+        offset += U16.size
+        hits = []
+        for _ in range(n_hits):
+            parent, chunk_index, score = HIT.unpack_from(body, offset)
+            offset += HIT.size
+            hits.append((parent.hex(), chunk_index, score))
+        results.append(hits)
+    return generation_id, results
+
+
+def encode_embed_request(texts: List[str]) -> bytes:
+    return _pack_strings(texts)
+
+
+def decode_embed_request(body: bytes) -> List[str]:
+    texts, _ = _unpack_strings(body)
+    return texts
+
+
+def encode_embed_response(vectors: List[List[float]]) -> bytes:
+    dim = len(vectors[0]) if vectors else 0
+    flat = [value for vector in vectors for value in vector]
+    return _u16(len(vectors), "向量数") + _u16(dim, "向量维度") + struct.pack(f"!{len(flat)}f", *flat)
+
+
+def decode_embed_response(body: bytes) -> List[List[float]]:
+    (count,) = U16.unpack_from(body, 0)
+    (dim,) = U16.unpack_from(body, U16.size)
+    flat = struct.unpack_from(f"!{count * dim}f", body, 2 * U16.size)
+    return [list(flat[i * dim:(i + 1) * dim]) for i in range(count)]
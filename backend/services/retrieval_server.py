@@ -0,0 +1,226 @@
+"""
+独立检索服务进程 - 持有嵌入模型、FAISS 与 BM25，对 Web 层提供批量检索
+
+启动:
+    python -m services.retrieval_server --address unix:///tmp/smartcooks-retrieval.sock
+    python -m services.retrieval_server --address tcp://127.0.0.1:8765
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Any, List, Tuple
+
+sys.path.append(str(Path(__file__).parent.parent))
+os.environ.setdefault("HF_ENDPOINT", "https://hf-mirror.com")
+
+from core.config import DEFAULT_CONFIG, RAGConfig
+from core.index_generation import (
+    RetrievalSnapshot,
+    load_generation_snapshot,
+    load_or_build_snapshot,
+    read_current_generation
+)
+from core.metrics import metrics
+from rag_modules import DataPreparationModule, IndexConstructionModule
+from services import retrieval_protocol as protocol
+
+logger = logging.getLogger(__name__)
+
+
+class RetrievalServer:
+    """检索服务 - 将并发到达的查询合并成批，一次向量化后逐条检索"""
+
+    def __init__(self, config: RAGConfig = None, batch_window_ms: float = 2.0, max_batch: int = 64):
+        """
+        初始化检索服务
+
+        Args:
+            config: RAG配置
+            batch_window_ms: 合批等待窗口（毫秒）
+            max_batch: 单批最多查询条数
+        """
+        self.config = config or DEFAULT_CONFIG
+        self.batch_window = batch_window_ms / 1000
+        self.max_batch = max_batch
+        self.mmap_index = self.config.faiss_mmap or os.getenv("RAG_FAISS_MMAP", "").lower() in ("1", "true")
+
+        index_module = IndexConstructionModule(
+            model_name=self.config.embedding_model,
+            index_save_path=self.config.index_save_path
+        )
+        data_module = DataPreparationModule(self.config.data_path)
+        self.snapshot: RetrievalSnapshot = load_or_build_snapshot(
+            self.config, data_module, index_module, mmap=self.mmap_index
+        )
+        self._queue: asyncio.Queue = None
+
+    async def serve(self, address: str):
+        """监听地址并处理请求，直到进程退出"""
+        self._queue = asyncio.Queue()
+        kind, target = protocol.parse_address(address)
+        if kind == "unix":
+            Path(target).unlink(missing_ok=True)
+            server = await asyncio.start_unix_server(self._handle_connection, path=target)
+        else:
+            server = await asyncio.start_server(self._handle_connection, host=target[0], port=target[1])
+
+        batcher = asyncio.create_task(self._batch_loop())
+        follower = asyncio.create_task(self._follow_generations())
+        logger.info(f"检索服务已启动: {address} (代际 {self.snapshot.generation_id})")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+            follower.cancel()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """一个连接上可流水线发送多个请求，响应按 request_id 对应"""
+        tasks = set()
+        try:
+            while True:
+                op, request_id, body = await protocol.read_frame(reader)
+                task = asyncio.create_task(self._dispatch(op, request_id, body, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        except protocol.ProtocolError as e:
+            logger.warning(f"协议错误，关闭连接: {e}")
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    async def _dispatch(self, op: int, request_id: int, body: bytes, writer: asyncio.StreamWriter):
+        try:
+            if op == protocol.OP_SEARCH:
+                queries, top_k, filters, bm25_only = protocol.decode_search_request(body)
+                generation_id, results = await self._submit(("search", queries, top_k, filters, bm25_only))
+                payload = protocol.encode_search_response(generation_id, results)
+            elif op == protocol.OP_EMBED:
+                texts = protocol.decode_embed_request(body)
+                _, vectors = await self._submit(("embed", texts, 0, None, False))
+                payload = protocol.encode_embed_response(vectors)
+            else:
+                raise protocol.ProtocolError(f"未知操作: {op}")
+            frame = protocol.encode_frame(protocol.OP_RESULT, request_id, payload)
+        except Exception as e:
+            frame = protocol.encode_frame(protocol.OP_ERROR, request_id, str(e).encode("utf-8"))
+        try:
+            writer.write(frame)
+            await writer.drain()
+        except ConnectionError:
+            # 客户端已断开，响应无人接收
+            pass
+
+    async def _submit(self, request: Tuple) -> Tuple[str, Any]:
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((request, future, time.perf_counter()))
+        return await future
+
+    async def _batch_loop(self):
+        """收集合批窗口内的请求，在线程池中统一向量化和检索"""
+        while True:
+            items = [await self._queue.get()]
+            deadline = time.perf_counter() + self.batch_window
+            while len(items) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            snapshot = self.snapshot
+            try:
+                outputs = await asyncio.to_thread(self._run_batch, snapshot, [item[0] for item in items])
+                for (_, future, _), output in zip(items, outputs):
+                    if not future.done():
+                        future.set_result((snapshot.generation_id, output))
+            except Exception as e:
+                for _, future, _ in items:
+                    if not future.done():
+                        future.set_exception(e)
+
+            now = time.perf_counter()
+            metrics.observe("retrieval_service_batch_size", len(items))
+            for _, _, enqueued in items:
+                metrics.observe("retrieval_service_latency_seconds", now - enqueued)
+
+    def _run_batch(self, snapshot: RetrievalSnapshot, requests: List[Tuple]) -> List[Any]:
+        """一次前向计算所有查询向量，再逐条检索并编码成命中引用（只做 BM25 的请求不参与向量化）"""
+        retrieval = snapshot.retrieval_module
+        texts = [text for request in requests if not request[4] for text in request[1]]
+        vectors = retrieval.embed_queries(texts) if texts else []
+
+        outputs = []
+        offset = 0
+        for kind, items, top_k, filters, bm25_only in requests:
+            if bm25_only:
+                batch_vectors = [None] * len(items)
+            else:
+                batch_vectors = vectors[offset:offset + len(items)]
+                offset += len(items)
+            if kind == "embed":
+                outputs.append(batch_vectors)
+                continue
+            results = []
+            for query, vector in zip(items, batch_vectors):
+                if filters:
+                    docs = retrieval.metadata_filtered_search(
+                        query, filters, top_k, query_embedding=vector, bm25_only=bm25_only
+                    )
+                else:
+                    docs = retrieval.hybrid_search(query, top_k, query_embedding=vector, bm25_only=bm25_only)
+                results.append([self._to_hit(doc) for doc in docs])
+            outputs.append(results)
+        return outputs
+
+    @staticmethod
+    def _to_hit(doc) -> Tuple[str, int, float]:
+        metadata = doc.metadata
+        chunk_index = metadata.get("chunk_index", protocol.WHOLE_PARENT) if metadata.get("doc_type") == "child" \
+            else protocol.WHOLE_PARENT
+        return metadata["parent_id"], chunk_index, float(metadata.get("rrf_score", 0.0))
+
+    async def _follow_generations(self, interval: float = 5.0):
+        """跟随磁盘上的当前代际指针，管理端重建后自动切换"""
+        while True:
+            await asyncio.sleep(interval)
+            generation_id = read_current_generation(self.config.index_save_path)
+            if not generation_id or generation_id == self.snapshot.generation_id:
+                continue
+            try:
+                self.snapshot = await asyncio.to_thread(
+                    load_generation_snapshot,
+                    self.config,
+                    generation_id,
+                    self.snapshot.index_module.embeddings,
+                    self.mmap_index
+                )
+                logger.info(f"检索服务已切换到代际 {generation_id}")
+            except Exception as e:
+                logger.error(f"检索服务切换代际失败: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="食谱检索服务")
+    parser.add_argument("--address", default=os.getenv("RETRIEVAL_SERVICE", "unix:///tmp/smartcooks-retrieval.sock"))
+    parser.add_argument("--batch-window-ms", type=float, default=2.0)
+    parser.add_argument("--max-batch", type=int, default=64)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = RetrievalServer(batch_window_ms=args.batch_window_ms, max_batch=args.max_batch)
+    asyncio.run(server.serve(args.address))
+
+
+if __name__ == "__main__":
+    main()
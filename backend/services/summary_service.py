@@ -0,0 +1,80 @@
+"""
+会话滚动摘要 - 每轮对话结束后在后台把移出历史窗口的消息合并进会话摘要
+
+提示词只使用摘要与最近几轮原文，长会话的提示词长度与 LLM 延迟不再随轮数增长。
+同一会话同一时间只有一个刷新任务；刷新期间又有新一轮结束时，当前任务完成后再刷新一次。
+"""
+
+import asyncio
+from typing import Callable, Dict, Set
+
+from core.database import AsyncSessionLocal
+from core.metrics import metrics
+from services.chat_service import ChatService
+from services.message_writer import message_writer
+
+
+class ConversationSummarizer:
+    """按会话去重的后台摘要刷新任务"""
+
+    def __init__(self, session_factory: Callable = AsyncSessionLocal, max_messages_per_refresh: int = 20):
+        """
+        Args:
+            session_factory: 数据库会话工厂
+            max_messages_per_refresh: 单次合并进摘要的最多消息数（历史很长的旧会话分多次追上）
+        """
+        self.session_factory = session_factory
+        self.max_messages_per_refresh = max_messages_per_refresh
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._rerun: Set[str] = set()
+
+    def schedule(self, session_id: str, rag_system):
+        """安排刷新某个会话的摘要，不等待完成"""
+        if session_id in self._tasks:
+            self._rerun.add(session_id)
+            return
+        task = asyncio.get_running_loop().create_task(self._run(session_id, rag_system))
+        self._tasks[session_id] = task
+
+    async def _run(self, session_id: str, rag_system):
+        try:
+            while True:
+                self._rerun.discard(session_id)
+                try:
+                    await self.refresh(session_id, rag_system)
+                except Exception as e:
+                    metrics.inc("conversation_summaries_total", result="error")
+                    print(f"❌ 会话摘要刷新失败 {session_id}: {e}")
+                    return
+                if session_id not in self._rerun:
+                    return
+        finally:
+            self._tasks.pop(session_id, None)
+
+    async def refresh(self, session_id: str, rag_system) -> bool:
+        """
+        把移出历史窗口的消息合并进摘要
+
+        Returns:
+            摘要是否有更新
+        """
+        # 尚未落库的消息都是最新的，从窗口中扣除
+        keep_recent = max(rag_system.history_window - len(message_writer.pending(session_id)), 0)
+        async with self.session_factory() as db:
+            service = ChatService(db)
+            session = await service.get_session(session_id)
+            if session is None:
+                return False
+            messages = await service.get_unsummarized_messages(
+                session_id, session.summary_message_id, keep_recent, limit=self.max_messages_per_refresh
+            )
+            if not messages:
+                return False
+            history = [{"role": m.role, "content": m.content} for m in messages]
+            summary = await rag_system.summarize_conversation(session.summary, history)
+            saved = await service.update_summary(session_id, summary, messages[-1].id, session.summary_message_id)
+        metrics.inc("conversation_summaries_total", result="updated" if saved else "conflict")
+        return saved
+
+
+conversation_summarizer = ConversationSummarizer()